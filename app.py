@@ -1,32 +1,56 @@
 import cv2
-import numpy as np
-import json
 import os
 import threading
 import time
 import webbrowser
+from dataclasses import replace
 from flask import Flask, Response, render_template, request, jsonify
 from werkzeug.utils import secure_filename
 
 from core.state import (
+    claim_job,
     create_state,
     ensure_storage_dirs,
+    release_job,
     reset_temporal_state,
-    EFFECTS,
+    take_job,
     PROFILES_FILE,
+    STREAM_IDLE_TIMEOUT,
+    STREAM_MAX_VIEWERS,
     BG_DIR,
     UPLOAD_DIR,
-    TEMPORAL_WINDOW_MAX,
+    MAX_COLOR_RANGES,
+    RECORD_DIR,
+    TRACE_DIR,
 )
+from core.recorder import FrameRecorder
+from core.shm_ring import FrameRingWriter, RING_PATH_DEFAULT, RING_SLOTS_DEFAULT
+from core.trace import TraceWriter, TRACE_MAX_SECONDS_DEFAULT, TRACE_MAX_SECONDS_MAX
+from core.calibration import CalibrationJob, CALIBRATION_FRAMES_DEFAULT, pick_color_range
+from core.capture import CAPTURE_APIS, CAPTURE_BUFFER_MAX, CAPTURE_FORMATS, CAPTURE_FPS_MAX, describe_capture
+from core.backend import COMPUTE_BACKENDS, opencl_available, resolve_backend
+from core.config import ColorRange, make_color_range, config_to_dict, parse_tuning
+from core.effects import EFFECTS
+from core.events import EventHub, RequestStats
+from core.profiles import open_profile_store
+from core.governor import TARGET_FPS_MIN, TARGET_FPS_MAX
 from core.mediapipe_utils import init_segmentor
-from core.scenes import get_scene_factories, generate_builtin_backgrounds
-from core.camera import camera_thread_fn, generate_frames
+from core.scenes import get_scene_factories, get_animated_scene_factories, generate_builtin_backgrounds
+from core.bg_stream import BackgroundStream, set_virtual_bg
+from core.camera import camera_thread_fn, latest_preprocessed
+from core.broadcast import FrameBroadcaster, STREAM_JPEG_QUALITY
+from core.output import OUTPUT_MODES, encode_frame, encode_rle
+from core.uploads import UploadProcessor
+from core.memprof import MemoryProfiler, MEMPROF_SNAPSHOT_INTERVAL_DEFAULT
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
 state = create_state()
 ensure_storage_dirs()
+profile_store = open_profile_store(PROFILES_FILE)
+config = state['config']
+state['broadcaster'] = FrameBroadcaster(max_viewers=STREAM_MAX_VIEWERS, idle_timeout=STREAM_IDLE_TIMEOUT)
 
 _segmentor, MEDIAPIPE_AVAILABLE, _mp = init_segmentor()
 
@@ -38,8 +62,12 @@ BUILTIN_SCENES = [
     ('sunset', '🌅 Sunset', SCENE_FACTORIES['sunset']),
     ('city', '🌃 City', SCENE_FACTORIES['city']),
 ]
+ANIMATED_SCENE_FACTORIES = get_animated_scene_factories()
+ANIMATED_SCENES = [
+    ('space_live', '✨ Live Space', ANIMATED_SCENE_FACTORIES['space_live']),
+]
 
-generate_builtin_backgrounds(BG_DIR, SCENE_FACTORIES)
+generate_builtin_backgrounds(BG_DIR, SCENE_FACTORIES, ANIMATED_SCENE_FACTORIES)
 
 camera_thread = threading.Thread(
     target=camera_thread_fn,
@@ -48,6 +76,60 @@ camera_thread = threading.Thread(
 )
 camera_thread.start()
 
+# Requests that /batch may dispatch (fast control updates, no uploads or waits)
+BATCH_PATHS = {
+    '/set_hsv', '/set_pipeline', '/set_effect', '/set_bg_mode', '/set_smart_bg_type',
+    '/set_solid_color', '/set_builtin_bg', '/set_active_range', '/add_color_range',
+    '/delete_color_range', '/toggle', '/load_profile',
+}
+BATCH_MAX_OPS = 32
+METRICS_INTERVAL = 0.5
+request_stats = RequestStats()
+
+
+def _ui_state():
+    """Everything the web UI mirrors; /events pushes diffs of this dict."""
+    cfg = config.current
+    data = config_to_dict(cfg)
+    del data['backproject_model']
+    data.update({
+        'config_version': cfg.version,
+        'has_backproject_model': cfg.backproject_model is not None,
+        'active_range_idx': state['active_range_idx'],
+        'virtual_bg_name': state['virtual_bg_name'],
+        'has_background': state['background'] is not None,
+        'recording': state['recorder'] is not None,
+        'mediapipe_available': MEDIAPIPE_AVAILABLE,
+        'profiles': profile_store.all(),
+    })
+    return data
+
+
+event_hub = EventHub(_ui_state)
+
+
+def _metrics_loop():
+    last_frames = state['frames_processed']
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        frames = state['frames_processed']
+        fps = (frames - last_frames) / METRICS_INTERVAL
+        last_frames = frames
+        if event_hub.subscriber_count:
+            event_hub.publish('metrics', {
+                'fps': round(fps, 1),
+                **state['governor'].status(),
+                **request_stats.snapshot(),
+            })
+
+
+threading.Thread(target=_metrics_loop, daemon=True).start()
+
+
+def _frame_x(x):
+    """Normalized x on the (possibly mirrored) video -> x in camera orientation."""
+    return 1.0 - x if state['capture_config'].mirror else x
+
 
 def _parse_bool(value):
     if isinstance(value, bool):
@@ -59,15 +141,129 @@ def _parse_bool(value):
     return False
 
 
+def _replace_range(ranges, idx, hsv_min, hsv_max):
+    ranges = list(ranges)
+    ranges[idx] = make_color_range(hsv_min, hsv_max)
+    return ranges
+
+
+def _clamp_range_idx(idx, cfg):
+    return max(0, min(idx, len(cfg.color_ranges) - 1))
+
+
+@app.before_request
+def _request_start():
+    # Per request (not on g): /batch dispatches nested requests in the same app context.
+    request.environ['cloak.t0'] = time.perf_counter()
+
+
+@app.after_request
+def _request_done(response):
+    ms = (time.perf_counter() - request.environ.get('cloak.t0', time.perf_counter())) * 1000.0
+    nested = request.environ.get('cloak.nested', False)
+    is_post = request.method == 'POST'
+    if not nested:
+        request_stats.record(request.path, ms if is_post else None)
+
+    # Log state-mutating requests (with latency) into an active trace.
+    tracer = state.get('tracer')
+    if (tracer is not None and is_post and request.path != '/batch'
+            and not request.path.startswith('/trace/')):
+        if request.files:
+            body = {'files': [f.filename for f in request.files.values()]}
+        else:
+            body = request.get_json(silent=True)
+        tracer.note_request(request.method, request.path, body, response.status_code, ms)
+
+    # Push what changed to /events clients (once per batch, not per op).
+    if is_post and not nested:
+        event_hub.publish_state()
+    return response
+
+
 @app.route('/')
 def index():
-    scenes = [{'id': s[0], 'label': s[1]} for s in BUILTIN_SCENES]
+    scenes = [{'id': s[0], 'label': s[1]} for s in BUILTIN_SCENES + ANIMATED_SCENES]
     return render_template('index.html', effects=EFFECTS, scenes=scenes)
 
 
+@app.route('/events')
+def events():
+    """Server-Sent Events: a state snapshot, then state diffs and ~2 Hz metrics."""
+    sub = event_hub.subscribe()
+    response = Response(event_hub.stream(sub), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: event_hub.unsubscribe(sub))
+    return response
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """
+    Apply several control updates from one message, in order: {"ops": [{"path", "body"}]}.
+    An op whose handler raises is reported as {"status": 500, "error": ...} and
+    the remaining ops still run, so results always line up with ops.
+    """
+    ops = (request.json or {}).get('ops')
+    if not isinstance(ops, list) or len(ops) > BATCH_MAX_OPS:
+        return jsonify({'status': 'error', 'message': f'Expected up to {BATCH_MAX_OPS} ops'})
+    results = []
+    for op in ops:
+        path = op.get('path') if isinstance(op, dict) else None
+        if path not in BATCH_PATHS:
+            results.append({'status': 'error', 'message': f'Not batchable: {path}'})
+            continue
+        try:
+            with app.test_request_context(path, method='POST', json=op.get('body') or {},
+                                          environ_overrides={'cloak.nested': True}):
+                response = app.full_dispatch_request()
+        except Exception as err:
+            app.logger.exception('Batch op %s failed', path)
+            results.append({'status': 500, 'error': f'{type(err).__name__}: {err}'})
+            continue
+        body = response.get_json(silent=True)
+        results.append(body if body is not None else {'status': response.status_code,
+                                                      'error': response.get_data(as_text=True)[:200]})
+    return jsonify({'status': 'ok', 'results': results})
+
+
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(state), mimetype='multipart/x-mixed-replace; boundary=frame')
+    broadcaster = state['broadcaster']
+    if not broadcaster.acquire():
+        return jsonify({'status': 'error', 'message': 'Too many viewers'}), 503
+    response = Response(broadcaster.frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    response.call_on_close(broadcaster.release)
+    return response
+
+
+@app.route('/stream_status', methods=['GET'])
+def stream_status():
+    return jsonify({'status': 'ok', **state['broadcaster'].stats()})
+
+
+@app.route('/snapshot', methods=['GET'])
+def snapshot():
+    """
+    Latest published frame, encoded as /video_feed does, or with ?format=rle
+    as a run-length matte (alpha output mode). RLE suits hard mattes, so
+    ?threshold=N binarizes the feathered edge first.
+    """
+    with state['lock']:
+        frame = state['frame']
+    if frame is None:
+        return jsonify({'status': 'error', 'message': 'Camera not ready yet, try again'})
+    if request.args.get('format') == 'rle':
+        if frame.ndim != 2:
+            return jsonify({'status': 'error', 'message': 'RLE needs output_mode "alpha"'})
+        threshold = request.args.get('threshold', type=int)
+        if threshold is not None:
+            frame = cv2.threshold(frame, max(0, min(threshold, 255)) - 1, 255, cv2.THRESH_BINARY)[1]
+        return Response(encode_rle(frame), mimetype='application/octet-stream')
+    content_type, data = encode_frame(frame, STREAM_JPEG_QUALITY)
+    if data is None:
+        return jsonify({'status': 'error', 'message': 'Could not encode frame'})
+    return Response(data, mimetype=content_type)
 
 
 @app.route('/capture_background', methods=['POST'])
@@ -83,32 +279,31 @@ def capture_background():
 
 @app.route('/toggle', methods=['POST'])
 def toggle():
-    if state['bg_mode'] == 'invisible' and state['background'] is None:
+    cfg = config.current
+    if cfg.bg_mode == 'invisible' and state['background'] is None:
         return jsonify({'status': 'error', 'message': 'Capture background first!'})
-    if state['bg_mode'] == 'virtual' and state['virtual_bg'] is None:
+    if cfg.bg_mode == 'virtual' and state['virtual_bg'] is None:
         return jsonify({'status': 'error', 'message': 'Select a virtual background first!'})
-    if state['bg_mode'] == 'smart' and not MEDIAPIPE_AVAILABLE:
+    if cfg.bg_mode == 'smart' and not MEDIAPIPE_AVAILABLE:
         return jsonify({'status': 'error', 'message': 'MediaPipe not available. Run: pip install mediapipe'})
-    if state['bg_mode'] == 'smart' and state['smart_bg_type'] == 'virtual' and state['virtual_bg'] is None:
+    if cfg.bg_mode == 'smart' and cfg.smart_bg_type == 'virtual' and state['virtual_bg'] is None:
         return jsonify({'status': 'error', 'message': 'Select a virtual background first!'})
-    if not state['running']:
+    if not cfg.running:
         reset_temporal_state(state)
-    state['running'] = not state['running']
-    return jsonify({'status': 'ok', 'running': state['running']})
+    cfg = config.transform(lambda c: {'running': not c.running})
+    return jsonify({'status': 'ok', 'running': cfg.running})
 
 
 @app.route('/set_bg_mode', methods=['POST'])
 def set_bg_mode():
     mode = request.json.get('mode', 'invisible')
     if mode in ('invisible', 'virtual', 'smart'):
-        if mode != state['bg_mode']:
-            state['bg_mode'] = mode
+        if mode != config.current.bg_mode:
             reset_temporal_state(state)
-        if state['running']:
-            state['running'] = False
+        config.update(bg_mode=mode, running=False)
     return jsonify({
         'status': 'ok',
-        'mode': state['bg_mode'],
+        'mode': config.current.bg_mode,
         'mediapipe_available': MEDIAPIPE_AVAILABLE,
     })
 
@@ -116,14 +311,16 @@ def set_bg_mode():
 @app.route('/set_smart_bg_type', methods=['POST'])
 def set_smart_bg_type():
     """Set smart-mode background type: blur | virtual | solid"""
+    changes = {}
     bg_type = request.json.get('type', 'blur')
     if bg_type in ('blur', 'virtual', 'solid'):
-        state['smart_bg_type'] = bg_type
+        changes['smart_bg_type'] = bg_type
     blur_amount = request.json.get('blur_amount')
     if blur_amount is not None:
         k = max(3, int(blur_amount))
-        state['smart_blur_amount'] = k if k % 2 == 1 else k + 1
-    return jsonify({'status': 'ok', 'smart_bg_type': state['smart_bg_type']})
+        changes['smart_blur_amount'] = k if k % 2 == 1 else k + 1
+    cfg = config.update(**changes)
+    return jsonify({'status': 'ok', 'smart_bg_type': cfg.smart_bg_type})
 
 
 @app.route('/set_solid_color', methods=['POST'])
@@ -133,58 +330,153 @@ def set_solid_color():
     r = int(data.get('r', 0))
     g = int(data.get('g', 177))
     b = int(data.get('b', 64))
-    state['solid_color'] = [b, g, r]
+    config.update(solid_color=(b, g, r))
     return jsonify({'status': 'ok', 'r': r, 'g': g, 'b': b})
 
 
 @app.route('/smart_status', methods=['GET'])
 def smart_status():
+    cfg = config.current
     return jsonify({
         'mediapipe_available': MEDIAPIPE_AVAILABLE,
-        'smart_bg_type': state['smart_bg_type'],
-        'smart_blur_amount': state['smart_blur_amount'],
-        'solid_color_rgb': [state['solid_color'][2], state['solid_color'][1], state['solid_color'][0]],
+        'smart_bg_type': cfg.smart_bg_type,
+        'smart_blur_amount': cfg.smart_blur_amount,
+        'solid_color_rgb': [cfg.solid_color[2], cfg.solid_color[1], cfg.solid_color[0]],
         'virtual_bg_name': state['virtual_bg_name'],
     })
 
 
+@app.route('/set_capture', methods=['POST'])
+def set_capture():
+    """Renegotiate the camera: {width, height, fps, fourcc, buffer_size, mirror, device, api}."""
+    data = request.json or {}
+    changes = {}
+    try:
+        for key, lo, hi in (('device', 0, 63), ('width', 160, 3840), ('height', 120, 2160),
+                            ('fps', 1, CAPTURE_FPS_MAX), ('buffer_size', 1, CAPTURE_BUFFER_MAX)):
+            if key in data:
+                changes[key] = max(lo, min(int(data[key]), hi))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid capture setting'})
+    if 'fourcc' in data:
+        fourcc = 'auto' if str(data['fourcc']).lower() == 'auto' else str(data['fourcc']).upper()
+        if fourcc not in CAPTURE_FORMATS:
+            return jsonify({'status': 'error', 'message': f'Unknown format: {data["fourcc"]}'})
+        changes['fourcc'] = fourcc
+    if 'api' in data:
+        if data['api'] != 'auto' and data['api'] not in CAPTURE_APIS:
+            return jsonify({'status': 'error', 'message': f'Unknown capture API: {data["api"]}'})
+        changes['api'] = data['api']
+    if 'mirror' in data:
+        changes['mirror'] = _parse_bool(data['mirror'])
+
+    current = state['capture_config']
+    cc = replace(current, **changes)
+    message = 'Capture settings applied'
+    if (cc.device, cc.width, cc.height) != (current.device, current.width, current.height):
+        # A background from another camera mode no longer lines up with the frame.
+        state['background'] = None
+        reset_temporal_state(state)
+        message = 'Capture settings applied; capture the background again'
+    state['capture_config'] = cc
+    # The camera loop reopens the device on its next frame.
+    deadline = time.monotonic() + 3.0
+    while state.get('cap_config') is not cc and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return jsonify({'status': 'ok', 'message': message, **_capture_status()})
+
+
+def _capture_status():
+    info = state.get('capture_info')
+    if info is None or state.get('cap_config') is not state['capture_config']:
+        info = describe_capture(None, state['capture_config'])
+    return info
+
+
+@app.route('/capture_status', methods=['GET'])
+def capture_status():
+    return jsonify({'status': 'ok', **_capture_status()})
+
+
 @app.route('/pipeline_status', methods=['GET'])
 def pipeline_status():
+    cfg = config.current
     return jsonify({
-        'use_ai_refine': state.get('use_ai_refine', False),
-        'temporal_window': state.get('temporal_window', 1),
+        'use_ai_refine': cfg.use_ai_refine,
+        'motion_compensation': cfg.motion_compensation,
+        'bg_adapt': cfg.bg_adapt,
+        'bg_model': state['bg_model'].stats(),
+        'stages_evaluated': state['stages_evaluated'],
+        **cfg.tuning(),
+        'mask_precision': cfg.mask_precision,
+        'mask_model': cfg.mask_model,
+        'compute_backend': cfg.compute_backend,
+        'compute_backend_active': resolve_backend(cfg.compute_backend),
+        'output_mode': cfg.output_mode,
+        'opencl_available': opencl_available(),
+        'config_version': cfg.version,
         'mediapipe_available': MEDIAPIPE_AVAILABLE,
+        **state['governor'].status(),
     })
 
 
 @app.route('/set_pipeline', methods=['POST'])
 def set_pipeline():
     data = request.json or {}
-    changed = False
+    cfg = config.current
+    changes = {}
 
     if 'use_ai_refine' in data:
-        new_val = _parse_bool(data.get('use_ai_refine'))
-        if new_val != state.get('use_ai_refine', False):
-            state['use_ai_refine'] = new_val
-            changed = True
+        changes['use_ai_refine'] = _parse_bool(data.get('use_ai_refine'))
 
-    if 'temporal_window' in data:
-        try:
-            window = int(data.get('temporal_window'))
-        except (TypeError, ValueError):
-            window = state.get('temporal_window', 1)
-        window = max(1, min(window, TEMPORAL_WINDOW_MAX))
-        if window != state.get('temporal_window', 1):
-            state['temporal_window'] = window
-            changed = True
+    if 'motion_compensation' in data:
+        changes['motion_compensation'] = _parse_bool(data.get('motion_compensation'))
+
+    if 'bg_adapt' in data:
+        changes['bg_adapt'] = _parse_bool(data.get('bg_adapt'))
+
+    # temporal_window, feather_radius, CLAHE / bilateral / morphology parameters
+    changes.update(parse_tuning(data, cfg))
+
+    if data.get('mask_precision') in ('uint8', 'float'):
+        changes['mask_precision'] = data['mask_precision']
+
+    if data.get('mask_model') == 'ranges' or (
+        data.get('mask_model') == 'backproject' and cfg.backproject_model is not None
+    ):
+        changes['mask_model'] = data['mask_model']
+
+    if data.get('compute_backend') in COMPUTE_BACKENDS:
+        changes['compute_backend'] = data['compute_backend']
+
+    if data.get('output_mode') in OUTPUT_MODES:
+        changes['output_mode'] = data['output_mode']
 
-    if changed:
+    new_cfg = config.update(**changes)
+    reset_keys = ('temporal_window', 'use_ai_refine', 'mask_precision')
+    if any(getattr(new_cfg, k) != getattr(cfg, k) for k in reset_keys):
         reset_temporal_state(state)
 
+    governor = state['governor']
+    if 'adaptive_quality' in data:
+        governor.set_enabled(_parse_bool(data.get('adaptive_quality')))
+
+    if 'target_fps' in data:
+        try:
+            target = int(data.get('target_fps'))
+        except (TypeError, ValueError):
+            target = governor.target_fps
+        governor.set_target_fps(max(TARGET_FPS_MIN, min(target, TARGET_FPS_MAX)))
+
     return jsonify({
         'status': 'ok',
-        'use_ai_refine': state.get('use_ai_refine', False),
-        'temporal_window': state.get('temporal_window', 1),
+        'use_ai_refine': new_cfg.use_ai_refine,
+        'motion_compensation': new_cfg.motion_compensation,
+        'bg_adapt': new_cfg.bg_adapt,
+        **new_cfg.tuning(),
+        'mask_precision': new_cfg.mask_precision,
+        'output_mode': new_cfg.output_mode,
+        **governor.status(),
     })
 
 
@@ -198,36 +490,75 @@ def set_builtin_bg():
             if img is None:
                 img = fn()
                 cv2.imwrite(path, img)
-            state['virtual_bg'] = img
-            state['virtual_bg_name'] = label
+            set_virtual_bg(state, img, label)
             return jsonify({'status': 'ok', 'name': label})
+    for scene_id, label, factory in ANIMATED_SCENES:
+        if scene_id == name:
+            stream = BackgroundStream(factory()).start()
+            set_virtual_bg(state, stream.poster(), label, stream)
+            return jsonify({'status': 'ok', 'name': label, 'animated': True})
     return jsonify({'status': 'error', 'message': 'Scene not found'})
 
 
+def _apply_upload(entry):
+    set_virtual_bg(state, entry['image'], entry['name'], entry.get('stream'))
+    event_hub.publish_state()
+
+
+uploads = UploadProcessor(UPLOAD_DIR, _apply_upload)
+
+
+def _stream_size():
+    """(w, h) backgrounds are pre-scaled to: the live frame, else the requested capture size."""
+    raw = state.get('raw_frame')
+    if raw is not None:
+        return raw.shape[1], raw.shape[0]
+    cc = state['capture_config']
+    return cc.width, cc.height
+
+
 @app.route('/upload_bg', methods=['POST'])
 def upload_bg():
+    """Queue an uploaded background; poll /upload_status?job=<id> until it is applied."""
     if 'file' not in request.files:
         return jsonify({'status': 'error', 'message': 'No file uploaded'})
     f = request.files['file']
-    if f.filename == '':
-        return jsonify({'status': 'error', 'message': 'Empty filename'})
     filename = secure_filename(f.filename)
-    save_path = os.path.join(UPLOAD_DIR, filename)
-    f.save(save_path)
-    img = cv2.imread(save_path)
-    if img is None:
-        return jsonify({'status': 'error', 'message': 'Invalid image file'})
-    state['virtual_bg'] = img
-    state['virtual_bg_name'] = filename
-    return jsonify({'status': 'ok', 'name': filename, 'url': f'/static/uploads/{filename}'})
+    if filename == '':
+        return jsonify({'status': 'error', 'message': 'Empty filename'})
+    data = f.read()
+    if not data:
+        return jsonify({'status': 'error', 'message': 'Empty file'})
+    job_id = uploads.submit(filename, data, _stream_size())
+    return jsonify({'status': 'pending', 'job': job_id}), 202
+
+
+@app.route('/upload_status', methods=['GET'])
+def upload_status():
+    result = uploads.job(request.args.get('job', type=int))
+    if result is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'})
+    return jsonify(result)
+
+
+@app.route('/uploads', methods=['GET'])
+def list_uploads():
+    return jsonify({'uploads': uploads.recent(), **uploads.stats()})
+
+
+@app.route('/set_upload_bg', methods=['POST'])
+def set_upload_bg():
+    result = uploads.select(request.json.get('id'), _stream_size())
+    return jsonify(result), 202 if result['status'] == 'pending' else 200
 
 
 @app.route('/bg_status', methods=['GET'])
 def bg_status():
     return jsonify({
-        'bg_mode': state['bg_mode'],
+        'bg_mode': config.current.bg_mode,
         'virtual_bg_name': state['virtual_bg_name'],
         'has_virtual_bg': state['virtual_bg'] is not None,
+        'animated_bg': state['virtual_bg_stream'] is not None,
     })
 
 
@@ -235,153 +566,326 @@ def bg_status():
 def set_hsv():
     data = request.json
     idx = int(data.get('idx', state['active_range_idx']))
-    idx = max(0, min(idx, len(state['color_ranges']) - 1))
-    state['color_ranges'][idx]['hsv_min'] = [int(data['h_min']), int(data['s_min']), int(data['v_min'])]
-    state['color_ranges'][idx]['hsv_max'] = [int(data['h_max']), int(data['s_max']), int(data['v_max'])]
+    hsv_min = [int(data['h_min']), int(data['s_min']), int(data['v_min'])]
+    hsv_max = [int(data['h_max']), int(data['s_max']), int(data['v_max'])]
+    config.transform(lambda cfg: {
+        'color_ranges': _replace_range(cfg.color_ranges, _clamp_range_idx(idx, cfg), hsv_min, hsv_max),
+    })
     return jsonify({'status': 'ok'})
 
 
 @app.route('/set_effect', methods=['POST'])
 def set_effect():
-    effect = request.json.get('effect', 'none')
+    data = request.json
+    changes = {}
+    effect = data.get('effect', 'none')
     if effect in EFFECTS:
-        state['effect'] = effect
+        changes['effect'] = effect
+    if data.get('region') in ('frame', 'mask'):
+        changes['effect_region'] = data['region']
+    config.update(**changes)
     return jsonify({'status': 'ok'})
 
 
 @app.route('/pick_color', methods=['POST'])
 def pick_color():
     data = request.json
-    with state['lock']:
-        frame = state.get('pp_frame')
-        if frame is None:
-            frame = state.get('raw_frame')
-        if frame is None:
-            frame = state.get('frame')
+    # Both are in camera orientation; the clicked point is on the mirrored view.
+    frame = latest_preprocessed(state)
     if frame is None:
         return jsonify({'status': 'error', 'message': 'No frame available'})
-    h_frame, w_frame = frame.shape[:2]
-    x = int(float(data['x']) * w_frame)
-    y = int(float(data['y']) * h_frame)
-    x = max(0, min(x, w_frame - 1))
-    y = max(0, min(y, h_frame - 1))
-    bgr = frame[y, x]
-    hsv = cv2.cvtColor(np.uint8([[bgr]]), cv2.COLOR_BGR2HSV)[0][0]
-    h, s, v = int(hsv[0]), int(hsv[1]), int(hsv[2])
-    sens = int(data.get('sensitivity', 20))
+    hsv, hsv_min, hsv_max = pick_color_range(frame, _frame_x(float(data['x'])), float(data['y']),
+                                             int(data.get('sensitivity', 20)))
     result = {
-        'h_min': max(0, h - sens),
-        's_min': max(0, s - sens * 2),
-        'v_min': max(0, v - sens * 2),
-        'h_max': min(179, h + sens),
-        's_max': min(255, s + sens * 2),
-        'v_max': min(255, v + sens * 2),
-        'hsv': [h, s, v],
+        'h_min': hsv_min[0], 's_min': hsv_min[1], 'v_min': hsv_min[2],
+        'h_max': hsv_max[0], 's_max': hsv_max[1], 'v_max': hsv_max[2],
+        'hsv': hsv,
     }
     idx = state['active_range_idx']
-    state['color_ranges'][idx]['hsv_min'] = [result['h_min'], result['s_min'], result['v_min']]
-    state['color_ranges'][idx]['hsv_max'] = [result['h_max'], result['s_max'], result['v_max']]
+    config.transform(lambda cfg: {
+        'color_ranges': _replace_range(cfg.color_ranges, _clamp_range_idx(idx, cfg), hsv_min, hsv_max),
+    })
     return jsonify({'status': 'ok', **result})
 
 
+@app.route('/calibrate', methods=['POST'])
+def calibrate():
+    """Fit the cloak colour from a drag-selected rectangle over several frames."""
+    data = request.json or {}
+    try:
+        rect = tuple(max(0.0, min(float(data[k]), 1.0)) for k in ('x0', 'y0', 'x1', 'y1'))
+        n_frames = int(data.get('frames', CALIBRATION_FRAMES_DEFAULT))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid selection'})
+    if abs(rect[2] - rect[0]) < 0.01 or abs(rect[3] - rect[1]) < 0.01:
+        return jsonify({'status': 'error', 'message': 'Selection too small'})
+    rect = (_frame_x(rect[0]), rect[1], _frame_x(rect[2]), rect[3])
+    job = claim_job(state, 'calibration', lambda: CalibrationJob(rect, n_frames))
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Calibration already in progress'})
+    job.start()
+    if not job.done.wait(timeout=5.0):
+        job.cancel()
+        release_job(state, 'calibration', job)
+        return jsonify({'status': 'error', 'message': 'Calibration timed out (is the camera running?)'})
+    if job.error or not job.result['color_ranges']:
+        return jsonify({'status': 'error', 'message': job.error or 'No dominant colour found'})
+
+    use_backproject = data.get('model') == 'backproject'
+    ranges = job.result['color_ranges'][:MAX_COLOR_RANGES]
+    state['active_range_idx'] = 0
+    cfg = config.update(
+        color_ranges=ranges,
+        backproject_model=job.result['model'],
+        mask_model='backproject' if use_backproject else 'ranges',
+    )
+    reset_temporal_state(state)
+    return jsonify({
+        'status': 'ok',
+        'ranges': cfg.color_ranges_dicts(),
+        'active_idx': 0,
+        'mask_model': cfg.mask_model,
+        'pixels': job.result['pixels'],
+    })
+
+
 @app.route('/profiles', methods=['GET'])
 def get_profiles():
-    if os.path.exists(PROFILES_FILE):
-        with open(PROFILES_FILE) as f:
-            return jsonify(json.load(f))
-    return jsonify({})
+    return jsonify(profile_store.all())
 
 
 @app.route('/save_profile', methods=['POST'])
 def save_profile():
-    name = request.json.get('name', 'default').strip()
+    data = request.json or {}
+    name = data.get('name', 'default').strip()
     if not name:
         return jsonify({'status': 'error', 'message': 'Profile name cannot be empty'})
-    profiles = {}
-    if os.path.exists(PROFILES_FILE):
-        with open(PROFILES_FILE) as f:
-            profiles = json.load(f)
-    profiles[name] = {
-        'color_ranges': state['color_ranges'],
-        'hsv_min': state['color_ranges'][0]['hsv_min'],
-        'hsv_max': state['color_ranges'][0]['hsv_max'],
-        'effect': state['effect'],
-    }
-    with open(PROFILES_FILE, 'w') as f:
-        json.dump(profiles, f, indent=2)
-    return jsonify({'status': 'ok', 'profiles': profiles})
+    cfg = config.current
+    if isinstance(data.get('pipeline'), dict):
+        # Tuning-only profile (e.g. a point picked by experiments/part3/pareto.py):
+        # loading it keeps the current colours and effect.
+        profile = {'pipeline': {**cfg.tuning(), **parse_tuning(data['pipeline'], cfg)}}
+    else:
+        color_ranges = cfg.color_ranges_dicts()
+        profile = {
+            'color_ranges': color_ranges,
+            'hsv_min': color_ranges[0]['hsv_min'],
+            'hsv_max': color_ranges[0]['hsv_max'],
+            'effect': cfg.effect,
+            'pipeline': cfg.tuning(),
+        }
+    profile_store.save(name, profile)
+    return jsonify({'status': 'ok', 'profiles': profile_store.all()})
 
 
 @app.route('/load_profile', methods=['POST'])
 def load_profile():
     name = request.json.get('name')
-    if os.path.exists(PROFILES_FILE):
-        with open(PROFILES_FILE) as f:
-            profiles = json.load(f)
-        if name in profiles:
-            p = profiles[name]
-            if 'color_ranges' in p:
-                state['color_ranges'] = p['color_ranges']
-            else:
-                state['color_ranges'] = [
-                    {'hsv_min': p.get('hsv_min', [0, 0, 0]), 'hsv_max': p.get('hsv_max', [0, 0, 0])}
-                ]
+    p = profile_store.get(name)
+    if p is not None:
+        old_cfg = config.current
+        changes = parse_tuning(p.get('pipeline') or {}, old_cfg)
+        if 'color_ranges' in p:
+            changes['color_ranges'] = p['color_ranges']
+        elif 'hsv_min' in p:
+            changes['color_ranges'] = [
+                {'hsv_min': p.get('hsv_min', [0, 0, 0]), 'hsv_max': p.get('hsv_max', [0, 0, 0])}
+            ]
+        if 'color_ranges' in changes:
             state['active_range_idx'] = 0
-            state['effect'] = p.get('effect', 'none')
-            return jsonify({'status': 'ok', 'color_ranges': state['color_ranges'], 'active_idx': 0, **p})
+            changes['effect'] = p.get('effect', 'none')
+        cfg = config.update(**changes)
+        if cfg.temporal_window != old_cfg.temporal_window:
+            reset_temporal_state(state)
+        return jsonify({'status': 'ok', **p, **cfg.tuning(), 'effect': cfg.effect,
+                        'color_ranges': cfg.color_ranges_dicts(), 'active_idx': state['active_range_idx']})
     return jsonify({'status': 'error', 'message': 'Profile not found'})
 
 
 @app.route('/delete_profile', methods=['POST'])
 def delete_profile():
     name = request.json.get('name')
-    if os.path.exists(PROFILES_FILE):
-        with open(PROFILES_FILE) as f:
-            profiles = json.load(f)
-        if name in profiles:
-            del profiles[name]
-            with open(PROFILES_FILE, 'w') as f:
-                json.dump(profiles, f, indent=2)
-            return jsonify({'status': 'ok', 'profiles': profiles})
+    if profile_store.delete(name):
+        return jsonify({'status': 'ok', 'profiles': profile_store.all()})
     return jsonify({'status': 'error', 'message': 'Profile not found'})
 
 
 @app.route('/color_ranges', methods=['GET'])
 def get_color_ranges():
+    cfg = config.current
     return jsonify({
         'status': 'ok',
-        'ranges': state['color_ranges'],
-        'active_idx': state['active_range_idx'],
+        'ranges': cfg.color_ranges_dicts(),
+        'active_idx': _clamp_range_idx(state['active_range_idx'], cfg),
     })
 
 
 @app.route('/add_color_range', methods=['POST'])
 def add_color_range():
-    if len(state['color_ranges']) >= 6:
-        return jsonify({'status': 'error', 'message': 'Maximum 6 colors allowed'})
-    state['color_ranges'].append({'hsv_min': [0, 0, 0], 'hsv_max': [0, 0, 0]})
-    new_idx = len(state['color_ranges']) - 1
+    added = []
+
+    def add(cfg):
+        if len(cfg.color_ranges) >= MAX_COLOR_RANGES:
+            return {}
+        added.append(True)
+        return {'color_ranges': cfg.color_ranges + (ColorRange((0, 0, 0), (0, 0, 0)),)}
+
+    cfg = config.transform(add)
+    if not added:
+        return jsonify({'status': 'error', 'message': f'Maximum {MAX_COLOR_RANGES} colors allowed'})
+    new_idx = len(cfg.color_ranges) - 1
     state['active_range_idx'] = new_idx
-    return jsonify({'status': 'ok', 'ranges': state['color_ranges'], 'active_idx': new_idx})
+    return jsonify({'status': 'ok', 'ranges': cfg.color_ranges_dicts(), 'active_idx': new_idx})
 
 
 @app.route('/delete_color_range', methods=['POST'])
 def delete_color_range():
     idx = int(request.json.get('idx', 0))
-    if len(state['color_ranges']) <= 1:
+
+    deleted = []
+
+    def delete(cfg):
+        if len(cfg.color_ranges) <= 1 or not 0 <= idx < len(cfg.color_ranges):
+            return {}
+        deleted.append(True)
+        return {'color_ranges': cfg.color_ranges[:idx] + cfg.color_ranges[idx + 1:]}
+
+    cfg = config.transform(delete)
+    if not deleted:
         return jsonify({'status': 'error', 'message': 'Must keep at least one color'})
-    state['color_ranges'].pop(idx)
-    state['active_range_idx'] = max(0, min(state['active_range_idx'], len(state['color_ranges']) - 1))
-    return jsonify({'status': 'ok', 'ranges': state['color_ranges'], 'active_idx': state['active_range_idx']})
+    state['active_range_idx'] = _clamp_range_idx(state['active_range_idx'], cfg)
+    return jsonify({'status': 'ok', 'ranges': cfg.color_ranges_dicts(), 'active_idx': state['active_range_idx']})
 
 
 @app.route('/set_active_range', methods=['POST'])
 def set_active_range():
-    idx = int(request.json.get('idx', 0))
-    idx = max(0, min(idx, len(state['color_ranges']) - 1))
+    cfg = config.current
+    idx = _clamp_range_idx(int(request.json.get('idx', 0)), cfg)
     state['active_range_idx'] = idx
-    cr = state['color_ranges'][idx]
-    return jsonify({'status': 'ok', 'active_idx': idx, **cr})
+    cr = cfg.color_ranges[idx]
+    return jsonify({'status': 'ok', 'active_idx': idx, 'hsv_min': list(cr.hsv_min), 'hsv_max': list(cr.hsv_max)})
+
+
+@app.route('/record/start', methods=['POST'])
+def record_start():
+    data = request.json or {}
+    try:
+        fps = max(1.0, min(float(data.get('fps', state['governor'].target_fps)), 60.0))
+        segment_seconds = data.get('segment_seconds')
+        segment_seconds = max(1.0, float(segment_seconds)) if segment_seconds else None
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid recording options'})
+    path = os.path.join(RECORD_DIR, time.strftime('cloak_%Y%m%d_%H%M%S.mp4'))
+    if claim_job(state, 'recorder', lambda: FrameRecorder(path, fps=fps, segment_seconds=segment_seconds)) is None:
+        return jsonify({'status': 'error', 'message': 'Already recording'})
+    return jsonify({'status': 'ok', 'path': path})
+
+
+@app.route('/record/stop', methods=['POST'])
+def record_stop():
+    recorder = take_job(state, 'recorder')
+    if recorder is None:
+        return jsonify({'status': 'error', 'message': 'Not recording'})
+    return jsonify({'status': 'ok', **recorder.stop()})
+
+
+@app.route('/record/status', methods=['GET'])
+def record_status():
+    recorder = state['recorder']
+    if recorder is None:
+        return jsonify({'status': 'ok', 'recording': False})
+    return jsonify({'status': 'ok', **recorder.stats()})
+
+
+@app.route('/trace/start', methods=['POST'])
+def trace_start():
+    data = request.json or {}
+    try:
+        max_seconds = max(1.0, min(float(data.get('max_seconds', TRACE_MAX_SECONDS_DEFAULT)),
+                                   TRACE_MAX_SECONDS_MAX))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid trace options'})
+    path = os.path.join(TRACE_DIR, time.strftime('trace_%Y%m%d_%H%M%S'))
+    if claim_job(state, 'tracer', lambda: TraceWriter(path, max_seconds=max_seconds)) is None:
+        return jsonify({'status': 'error', 'message': 'Already tracing'})
+    return jsonify({'status': 'ok', 'path': path, 'max_seconds': max_seconds})
+
+
+@app.route('/trace/stop', methods=['POST'])
+def trace_stop():
+    tracer = take_job(state, 'tracer')
+    if tracer is None:
+        return jsonify({'status': 'error', 'message': 'Not tracing'})
+    return jsonify({'status': 'ok', **tracer.stop()})
+
+
+@app.route('/trace/status', methods=['GET'])
+def trace_status():
+    tracer = state['tracer']
+    if tracer is None:
+        return jsonify({'status': 'ok', 'tracing': False})
+    return jsonify({'status': 'ok', **tracer.stats()})
+
+
+@app.route('/shm/start', methods=['POST'])
+def shm_start():
+    data = request.json or {}
+    try:
+        slots = max(2, min(int(data.get('slots', RING_SLOTS_DEFAULT)), 64))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid ring options'})
+    if claim_job(state, 'shm_ring', lambda: FrameRingWriter(RING_PATH_DEFAULT, slots=slots)) is None:
+        return jsonify({'status': 'error', 'message': 'Shared-memory output already running'})
+    return jsonify({'status': 'ok', 'path': RING_PATH_DEFAULT, 'slots': slots})
+
+
+@app.route('/shm/stop', methods=['POST'])
+def shm_stop():
+    ring = take_job(state, 'shm_ring')
+    if ring is None:
+        return jsonify({'status': 'error', 'message': 'Shared-memory output not running'})
+    return jsonify({'status': 'ok', **ring.close()})
+
+
+@app.route('/shm/status', methods=['GET'])
+def shm_status():
+    ring = state['shm_ring']
+    if ring is None:
+        return jsonify({'status': 'ok', 'running': False})
+    return jsonify({'status': 'ok', 'running': True, **ring.stats()})
+
+
+@app.route('/memprof/start', methods=['POST'])
+def memprof_start():
+    """Per-stage allocation profiling of the camera loop (slow while tracemalloc is on)."""
+    data = request.json or {}
+    try:
+        interval = float(data.get('snapshot_interval', MEMPROF_SNAPSHOT_INTERVAL_DEFAULT))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid profiler options'})
+    trace_allocations = _parse_bool(data.get('tracemalloc', True))
+    profiler = claim_job(state, 'memprof', lambda: MemoryProfiler(trace_allocations=trace_allocations,
+                                                                  snapshot_interval=interval))
+    if profiler is None:
+        return jsonify({'status': 'error', 'message': 'Memory profiler already running'})
+    return jsonify({'status': 'ok', 'trace_allocations': profiler.trace_allocations,
+                    'snapshot_interval': profiler.snapshot_interval})
+
+
+@app.route('/memprof/stop', methods=['POST'])
+def memprof_stop():
+    profiler = take_job(state, 'memprof')
+    if profiler is None:
+        return jsonify({'status': 'error', 'message': 'Memory profiler not running'})
+    return jsonify({'status': 'ok', **profiler.stop()})
+
+
+@app.route('/memprof/status', methods=['GET'])
+def memprof_status():
+    profiler = state['memprof']
+    if profiler is None:
+        return jsonify({'status': 'ok', 'active': False})
+    return jsonify({'status': 'ok', **profiler.stats()})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+"""
+Production entry point: the web app under an asyncio server.
+
+    pip install uvicorn a2wsgi
+    python asgi.py                  # or: uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+/video_feed and /events are served natively as async streams, so every
+viewer is an open socket on the event loop rather than a server thread; all
+other routes run through Flask on a small WSGI thread pool. Limits come from
+the environment: CLOAK_MAX_CONNECTIONS (open connections before the server
+answers 503), CLOAK_MAX_VIEWERS and CLOAK_STREAM_IDLE_S (see core/state.py).
+"""
+import asyncio
+import json
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import app as flask_app, event_hub, state
+
+HOST = os.environ.get('CLOAK_HOST', '127.0.0.1')
+PORT = int(os.environ.get('CLOAK_PORT', '5000'))
+MAX_CONNECTIONS = int(os.environ.get('CLOAK_MAX_CONNECTIONS', '1000'))
+KEEP_ALIVE_TIMEOUT = 5
+WSGI_WORKERS = 8
+
+MJPEG_TYPE = b'multipart/x-mixed-replace; boundary=frame'
+SSE_HEADERS = [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+               (b'x-accel-buffering', b'no')]
+
+wsgi_app = WSGIMiddleware(flask_app, workers=WSGI_WORKERS)
+
+
+async def _send_error(send, status, message):
+    body = json.dumps({'status': 'error', 'message': message}).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _stream(receive, send, headers, chunks):
+    """
+    Send an async generator of chunks (bytes or str) until it ends or the
+    client goes away. Each wait for the next chunk races the disconnect, so
+    a client that leaves while the stream is idle frees its slot at once.
+    """
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    pending = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait((pending, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                return
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        if pending is not None and not pending.done():
+            # The generator must be idle before aclose().
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        await chunks.aclose()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/video_feed':
+        broadcaster = state['broadcaster']
+        if not broadcaster.acquire():
+            await _send_error(send, 503, 'Too many viewers')
+            return
+        try:
+            await _stream(receive, send, [(b'content-type', MJPEG_TYPE)], broadcaster.aframes())
+        finally:
+            broadcaster.release()
+    elif scope['type'] == 'http' and scope['path'] == '/events':
+        sub = event_hub.subscribe(asyncio.get_running_loop())
+        try:
+            await _stream(receive, send, SSE_HEADERS, event_hub.astream(sub))
+        finally:
+            event_hub.unsubscribe(sub)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host=HOST, port=PORT, limit_concurrency=MAX_CONNECTIONS,
+                timeout_keep_alive=KEEP_ALIVE_TIMEOUT)
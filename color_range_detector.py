@@ -8,11 +8,13 @@ from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QSlider, QPushButton
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QImage, QPixmap
 
+from core.capture import CaptureConfig, open_capture
+
 class ColorRangeSelector(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle('HSV Color Range Selector')
-        self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+        self.cap = open_capture(CaptureConfig())[0]
         self.hsv_min = [0, 0, 0]
         self.hsv_max = [255, 255, 255]
         self.init_ui()
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+
+# numpy: OpenCV allocates every intermediate (the original behaviour).
+# dst:   the same calls write into buffers bound once per shape (dst= outputs).
+# umat:  the chain runs on cv2.UMat through OpenCV's transparent API, which
+#        dispatches to OpenCL (including CPU runtimes such as PoCL) when present.
+COMPUTE_BACKENDS = ('numpy', 'dst', 'umat')
+COMPUTE_BACKEND_DEFAULT = 'dst'
+
+
+def opencl_available():
+    try:
+        return bool(cv2.ocl.haveOpenCL())
+    except (AttributeError, cv2.error):
+        return False
+
+
+def resolve_backend(name):
+    """Backend actually used for `name`: umat falls back to dst without an OpenCL runtime."""
+    if name not in COMPUTE_BACKENDS:
+        return COMPUTE_BACKEND_DEFAULT
+    if name == 'umat' and not opencl_available():
+        return 'dst'
+    return name
+
+
+class Workspace:
+    """
+    Named output buffers for the per-frame chain, allocated on first use and
+    re-bound only when a frame shape changes. Buffers are overwritten every
+    frame: anything that must outlive the frame has to be copied.
+    In umat mode the buffers are UMats, which carry no shape in Python, so
+    chain functions take the frame shape from their host-side caller.
+    """
+
+    def __init__(self, backend=COMPUTE_BACKEND_DEFAULT):
+        self.backend = backend
+        self.umat = backend == 'umat'
+        if self.umat:
+            cv2.ocl.setUseOpenCL(True)
+        self.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self._buffers = {}
+
+    def buf(self, name, shape, dtype=np.uint8, host=False):
+        """Buffer `name`; host=True keeps it a numpy array even in umat mode."""
+        shape = tuple(shape)
+        entry = self._buffers.get(name)
+        if entry is None or entry[0] != shape or entry[1] != dtype:
+            array = np.empty(shape, dtype)
+            entry = (shape, dtype, cv2.UMat(array) if self.umat and not host else array)
+            self._buffers[name] = entry
+        return entry[2]
+
+    def upload(self, name, array):
+        """Host array -> backend array (a UMat copy in umat mode, unchanged otherwise)."""
+        if not self.umat or not isinstance(array, np.ndarray):
+            return array
+        umat = cv2.UMat(array)
+        self._buffers[name] = (array.shape, array.dtype, umat)
+        return umat
+
+    @property
+    def nbytes(self):
+        return sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for shape, dtype, _ in self._buffers.values())
+
+
+def make_workspace(backend, previous=None):
+    """Workspace for `backend` (None for numpy), reusing `previous` when it already matches."""
+    backend = resolve_backend(backend)
+    if backend == 'numpy':
+        return None
+    if previous is not None and previous.backend == backend:
+        return previous
+    return Workspace(backend)
+
+
+def out(ws, name, shape, dtype=np.uint8, host=False):
+    """Pre-bound dst buffer from `ws`, or None so OpenCV allocates as usual."""
+    return ws.buf(name, shape, dtype, host) if ws is not None else None
+
+
+def upload(ws, name, array):
+    return ws.upload(name, array) if ws is not None else array
+
+
+def download(x):
+    return x.get() if isinstance(x, cv2.UMat) else x
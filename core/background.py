@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+
+# Rows updated per frame: one in BG_ROW_STRIDE, so the whole frame is
+# refreshed every BG_ROW_STRIDE frames at a quarter of the cost.
+BG_ROW_STRIDE = 4
+# Largest change per update (levels): the approximate running median moves
+# each pixel this far toward the frame, so brief occluders barely register.
+BG_STEP = 2
+# Pixels further than this from the model (max over channels) are foreground
+# (someone walking past) and left alone.
+BG_FOREGROUND_DIFF = 40
+# When this share of a slice's visible pixels is foreground, the scene itself
+# may have changed (lights switched, camera bumped)...
+BG_RESEED_FRACTION = 0.75
+# ...and once a slice has disagreed this many refreshes in a row (about a
+# second at stride 4 and 30 fps) it is re-seeded from the frame. A large
+# foreground object disagrees just as much, so without a person mask to keep
+# people out of the visible area slices are never re-seeded.
+BG_RESEED_REFRESHES = 8
+
+
+class BackgroundModel:
+    """
+    Keeps the captured 'invisible' background current instead of trusting one
+    snapshot. Each update() runs an approximate running median, in place on
+    the background array, over one slice of rows. It only touches pixels that
+    are outside the cloak alpha and the person mask, and that are close enough
+    to the model to be background, so the cloak area keeps what was behind it
+    and people are not absorbed. Slow lighting drift is followed a couple of
+    levels per refresh; a lasting scene change re-seeds slices outright.
+    """
+
+    def __init__(self, stride=BG_ROW_STRIDE, step=BG_STEP, threshold=BG_FOREGROUND_DIFF,
+                 reseed_fraction=BG_RESEED_FRACTION, reseed_refreshes=BG_RESEED_REFRESHES):
+        self.stride = stride
+        self.step = step
+        self.threshold = threshold
+        self.reseed_fraction = reseed_fraction
+        self.reseed_refreshes = reseed_refreshes
+        self._background = None
+        self._phase = 0
+        # Consecutive refreshes each slice has mostly disagreed with the model
+        self._disagree = [0] * stride
+        self.updates = 0
+        self.reseeds = 0
+
+    def update(self, background, frame, alpha, person_mask=None):
+        """background, frame: BGR uint8 of one size; alpha: uint8 cloak alpha (0 = visible)."""
+        if background is not self._background:
+            # A new capture starts a new model.
+            self._background = background
+            self._phase = 0
+            self._disagree = [0] * self.stride
+            self.updates = self.reseeds = 0
+        phase = self._phase
+        rows = slice(phase, None, self.stride)
+        self._phase = (phase + 1) % self.stride
+
+        bg = np.ascontiguousarray(background[rows])
+        fr = np.ascontiguousarray(frame[rows])
+        visible = alpha[rows] == 0
+        if person_mask is not None:
+            person = person_mask[rows]
+            visible &= person < (128 if person.dtype == np.uint8 else 0.5)
+        n_visible = np.count_nonzero(visible)
+        if not n_visible:
+            return
+        diff = cv2.absdiff(fr, bg)
+        near = np.maximum(np.maximum(diff[..., 0], diff[..., 1]), diff[..., 2]) <= self.threshold
+        update = visible & near
+        if np.count_nonzero(update) < (1.0 - self.reseed_fraction) * n_visible:
+            self._disagree[phase] += 1
+        else:
+            self._disagree[phase] = 0
+        if person_mask is not None and self._disagree[phase] >= self.reseed_refreshes:
+            bg[visible] = fr[visible]
+            self._disagree[phase] = 0
+            self.reseeds += 1
+        else:
+            # Pixels that still match the model keep following it either way.
+            mask = update.view(np.uint8)
+            up = np.minimum(cv2.subtract(fr, bg), self.step, out=diff)
+            down = np.minimum(cv2.subtract(bg, fr), self.step)
+            cv2.add(bg, up, dst=bg, mask=mask)
+            cv2.subtract(bg, down, dst=bg, mask=mask)
+        background[rows] = bg
+        self.updates += 1
+
+    def stats(self):
+        return {
+            'stride': self.stride,
+            'updates': self.updates,
+            'reseeds': self.reseeds,
+        }
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.avi', '.mov', '.mkv', '.m4v')
+BG_STREAM_CAPACITY = 8
+
+
+def is_video_file(filename):
+    return filename.lower().endswith(VIDEO_EXTENSIONS)
+
+
+class BackgroundStream:
+    """
+    Looping video / animated background decoded on its own thread.
+    Frames are decoded and resized to the stream size ahead of time and parked in a
+    bounded ring buffer. The compositor pops at most one frame per camera frame and
+    falls back to the last frame when the decoder is behind, so it never blocks.
+    """
+
+    def __init__(self, source, size=(640, 480), capacity=BG_STREAM_CAPACITY):
+        # source: path to a video file, or a callable frame_fn(idx) -> BGR image
+        self._source = source
+        self._size = tuple(size)
+        # Frames are pre-mirrored here when the camera output will be mirrored.
+        self._mirror = False
+        self._buffer = deque(maxlen=max(1, int(capacity)))
+        self._cond = threading.Condition()
+        self._last = None
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def poster(self, timeout=2.0):
+        """First decoded frame, used as the still preview / readiness check."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._last is None and not self._buffer and not self._stop:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._buffer:
+                return self._buffer[0]
+            return self._last
+
+    def next_frame(self, width, height, mirror=False):
+        """Non-blocking: the next pre-decoded frame, or the previous one if none is ready."""
+        with self._cond:
+            if self._size != (width, height) or self._mirror != mirror:
+                self._size = (width, height)
+                self._mirror = mirror
+                self._buffer.clear()
+                self._last = None
+            if self._buffer:
+                self._last = self._buffer.popleft()
+                self._cond.notify()
+            return self._last
+
+    def _fit(self, frame, size, mirror):
+        if frame.shape[1] != size[0] or frame.shape[0] != size[1]:
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if mirror:
+            frame = cv2.flip(frame, 1)
+        return frame
+
+    def _run(self):
+        if callable(self._source):
+            self._run_generated()
+        else:
+            self._run_video()
+
+    def _push(self, frame):
+        with self._cond:
+            while len(self._buffer) >= self._buffer.maxlen and not self._stop:
+                self._cond.wait()
+            if self._stop:
+                return False
+            size, mirror = self._size, self._mirror
+        # Resize outside the lock; drop the frame if the target changed meanwhile.
+        frame = self._fit(frame, size, mirror)
+        with self._cond:
+            if self._size == size and self._mirror == mirror:
+                self._buffer.append(frame)
+                self._cond.notify_all()
+        return True
+
+    def _run_generated(self):
+        idx = 0
+        while self._push(self._source(idx)):
+            idx += 1
+
+    def _run_video(self):
+        cap = cv2.VideoCapture(self._source)
+        try:
+            rewound = False
+            while not self._stop:
+                ret, frame = cap.read()
+                if not ret:
+                    if rewound:
+                        # Rewind produced nothing: unreadable or empty file.
+                        break
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    rewound = True
+                    continue
+                rewound = False
+                if not self._push(frame):
+                    break
+        finally:
+            cap.release()
+            with self._cond:
+                self._stop = True
+                self._cond.notify_all()
+
+
+def set_virtual_bg(state, image, name, stream=None):
+    """Swap the virtual background, stopping any previous stream."""
+    old = state.get('virtual_bg_stream')
+    state['virtual_bg_stream'] = stream
+    state['virtual_bg'] = image
+    state['virtual_bg_name'] = name
+    if old is not None and old is not stream:
+        old.stop()
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+
+from .output import encode_frame
+
+STREAM_JPEG_QUALITY = 85
+STREAM_MAX_VIEWERS_DEFAULT = 200
+# A stream with no new frame for this long (camera gone) is closed.
+STREAM_IDLE_TIMEOUT_DEFAULT = 30.0
+
+_PART_HEADER = b'--frame\r\nContent-Type: %s\r\n\r\n'
+
+
+def _wake(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class FrameBroadcaster:
+    """
+    Encodes each processed frame once (JPEG, or PNG for the mask output modes)
+    and hands the same multipart chunk to every /video_feed viewer.
+
+    The camera thread only drops its frame into a slot (submit); an encoder
+    thread turns the newest one into a chunk, and only while someone is
+    watching. Viewers wait on a sequence number rather than polling: blocking
+    WSGI streams through a Condition, asyncio streams through futures resolved
+    on their own event loop, so an async viewer costs a socket, not a thread.
+    A slow viewer skips straight to the newest frame.
+    """
+
+    def __init__(self, quality=STREAM_JPEG_QUALITY, max_viewers=STREAM_MAX_VIEWERS_DEFAULT,
+                 idle_timeout=STREAM_IDLE_TIMEOUT_DEFAULT):
+        self.quality = quality
+        self.max_viewers = max_viewers
+        self.idle_timeout = idle_timeout
+        self.viewers = 0
+        self.seq = 0
+        self.part = None
+        self.frames_encoded = 0
+        self.viewers_rejected = 0
+        self._pending = None
+        self._waiters = set()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        """Offer the newest processed frame; never blocks on encoding."""
+        with self._cond:
+            self._pending = frame
+            if self.viewers:
+                self._cond.notify_all()
+
+    def _encode_loop(self):
+        while True:
+            with self._cond:
+                while self._pending is None or not self.viewers:
+                    self._cond.wait()
+                frame, self._pending = self._pending, None
+            content_type, data = encode_frame(frame, self.quality)
+            if data is None:
+                continue
+            part = _PART_HEADER % content_type.encode() + data + b'\r\n'
+            with self._cond:
+                self.seq += 1
+                self.part = part
+                self.frames_encoded += 1
+                waiters, self._waiters = self._waiters, set()
+                self._cond.notify_all()
+            for loop, fut in waiters:
+                try:
+                    loop.call_soon_threadsafe(_wake, fut)
+                except RuntimeError:
+                    pass  # that viewer's event loop has closed
+
+    def acquire(self):
+        """Reserve a viewer slot; False when the stream is at capacity."""
+        with self._cond:
+            if self.viewers >= self.max_viewers:
+                self.viewers_rejected += 1
+                return False
+            self.viewers += 1
+            self._cond.notify_all()
+            return True
+
+    def release(self):
+        """Free a slot taken by acquire(), once its stream has closed."""
+        with self._cond:
+            self.viewers = max(0, self.viewers - 1)
+
+    def wait_frame(self, last_seq, timeout=None):
+        """(seq, chunk) newer than `last_seq`, or None after `timeout` seconds."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq != last_seq and self.part is not None, timeout):
+                return None
+            return self.seq, self.part
+
+    async def wait_frame_async(self, last_seq, timeout=None):
+        """Awaitable wait_frame() for asyncio servers."""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self.seq != last_seq and self.part is not None:
+                return self.seq, self.part
+            entry = (loop, loop.create_future())
+            self._waiters.add(entry)
+        try:
+            await asyncio.wait_for(entry[1], timeout)
+        except asyncio.TimeoutError:
+            with self._cond:
+                self._waiters.discard(entry)
+            return None
+        with self._cond:
+            return self.seq, self.part
+
+    def frames(self):
+        """Blocking multipart generator for WSGI servers; ends after idle_timeout without a frame."""
+        seq = 0
+        while True:
+            got = self.wait_frame(seq, self.idle_timeout)
+            if got is None:
+                return
+            seq, part = got
+            yield part
+
+    async def aframes(self):
+        """Async multipart generator for asyncio servers; ends after idle_timeout without a frame."""
+        seq = 0
+        while True:
+            got = await self.wait_frame_async(seq, self.idle_timeout)
+            if got is None:
+                return
+            seq, part = got
+            yield part
+
+    def stats(self):
+        return {
+            'viewers': self.viewers,
+            'max_viewers': self.max_viewers,
+            'viewers_rejected': self.viewers_rejected,
+            'frames_encoded': self.frames_encoded,
+            'idle_timeout_s': self.idle_timeout,
+        }
@@ -0,0 +1,161 @@
+import threading
+
+import cv2
+import numpy as np
+
+H_BINS = 30
+S_BINS = 32
+HS_RANGES = [0, 180, 0, 256]
+CALIBRATION_FRAMES_DEFAULT = 8
+CALIBRATION_FRAMES_MAX = 30
+
+
+class BackprojectModel:
+    """
+    Normalized H-S histogram of the cloak plus the V range seen during calibration.
+    Compared by identity, so publishing a new model always bumps the config version.
+    """
+
+    def __init__(self, hist, v_min, v_max, threshold=32):
+        hist.flags.writeable = False
+        self.hist = hist
+        self.v_min = int(v_min)
+        self.v_max = int(v_max)
+        self.threshold = int(threshold)
+
+
+def backproject_mask(hsv, model):
+    prob = cv2.calcBackProject([hsv], [0, 1], model.hist, HS_RANGES, 1)
+    _, mask = cv2.threshold(prob, model.threshold, 255, cv2.THRESH_BINARY)
+    v_ok = cv2.inRange(hsv[:, :, 2], model.v_min, model.v_max)
+    return cv2.bitwise_and(mask, v_ok)
+
+
+def pick_color_range(frame, x, y, sensitivity=20):
+    """
+    HSV range around the pixel at normalized (x, y) of a BGR frame:
+    (hsv, hsv_min, hsv_max), with S and V given twice the hue tolerance.
+    """
+    h_frame, w_frame = frame.shape[:2]
+    px = max(0, min(int(x * w_frame), w_frame - 1))
+    py = max(0, min(int(y * h_frame), h_frame - 1))
+    hsv = cv2.cvtColor(np.uint8([[frame[py, px]]]), cv2.COLOR_BGR2HSV)[0][0]
+    h, s, v = int(hsv[0]), int(hsv[1]), int(hsv[2])
+    hsv_min = [max(0, h - sensitivity), max(0, s - sensitivity * 2), max(0, v - sensitivity * 2)]
+    hsv_max = [min(179, h + sensitivity), min(255, s + sensitivity * 2), min(255, v + sensitivity * 2)]
+    return [h, s, v], hsv_min, hsv_max
+
+
+def build_hs_histogram(hsv_crops):
+    hist = None
+    for crop in hsv_crops:
+        hist = cv2.calcHist([crop], [0, 1], None, [H_BINS, S_BINS], HS_RANGES, hist=hist, accumulate=hist is not None)
+    return hist
+
+
+def _v_bounds(hsv_crops, lo_pct=2, hi_pct=98):
+    v = np.concatenate([c[:, :, 2].ravel() for c in hsv_crops])
+    return int(np.percentile(v, lo_pct)), int(np.percentile(v, hi_pct))
+
+
+def propose_color_ranges(hist, v_min, v_max, max_ranges=6, peak_fraction=0.05, coverage=0.95):
+    """
+    Split the H-S histogram into connected blobs of significant bins and turn the
+    heaviest blobs into tight hsv_min/hsv_max ranges, until `coverage` of the
+    sampled pixels is explained or `max_ranges` is reached. A red cloak that wraps
+    around hue 0 naturally yields two ranges.
+    """
+    total = float(hist.sum())
+    if total <= 0:
+        return []
+    significant = (hist >= hist.max() * peak_fraction).astype(np.uint8)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(significant, connectivity=8)
+    blobs = []
+    for label in range(1, n):
+        mass = float(hist[labels == label].sum())
+        blobs.append((mass, label))
+    blobs.sort(reverse=True)
+
+    h_step = 180 / H_BINS
+    s_step = 256 / S_BINS
+    ranges = []
+    explained = 0.0
+    for mass, label in blobs[:max_ranges]:
+        # stats columns: x (S bin), y (H bin), width, height
+        s0, h0, sw, hh = stats[label][:4]
+        ranges.append({
+            'hsv_min': [int(h0 * h_step), int(s0 * s_step), v_min],
+            'hsv_max': [min(179, int((h0 + hh) * h_step) - 1), min(255, int((s0 + sw) * s_step) - 1), v_max],
+        })
+        explained += mass
+        if explained / total >= coverage:
+            break
+    return ranges
+
+
+class CalibrationJob:
+    """
+    Collects a region of interest over several frames and fits a colour model.
+    The camera loop only calls offer(), which copies the small ROI crop; the
+    histogram work happens on the job's own thread so the stream never stalls.
+    start() launches that thread once the job is installed; cancel() ends a
+    job that will not be fed any more (timed out, or never installed).
+    """
+
+    def __init__(self, rect, n_frames=CALIBRATION_FRAMES_DEFAULT):
+        # rect: normalized (x0, y0, x1, y1) in frame coordinates
+        x0, y0, x1, y1 = rect
+        self.rect = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        self.n_frames = max(1, min(int(n_frames), CALIBRATION_FRAMES_MAX))
+        self.crops = []
+        self.result = None
+        self.error = None
+        self._collected = threading.Event()
+        self._cancelled = False
+        self.done = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def cancel(self):
+        self._cancelled = True
+        self._collected.set()
+
+    def offer(self, frame_bgr):
+        """Called from the camera loop; returns True once enough frames were taken."""
+        if self._collected.is_set():
+            return True
+        h, w = frame_bgr.shape[:2]
+        x0, y0, x1, y1 = self.rect
+        px0, py0 = int(x0 * w), int(y0 * h)
+        px1, py1 = max(px0 + 1, int(x1 * w)), max(py0 + 1, int(y1 * h))
+        self.crops.append(frame_bgr[py0:py1, px0:px1].copy())
+        if len(self.crops) >= self.n_frames:
+            self._collected.set()
+            return True
+        return False
+
+    def _run(self):
+        self._collected.wait()
+        if self._cancelled:
+            self.crops = []
+            self.error = 'Calibration cancelled'
+            self.done.set()
+            return
+        try:
+            hsv_crops = [cv2.cvtColor(c, cv2.COLOR_BGR2HSV) for c in self.crops]
+            hist = build_hs_histogram(hsv_crops)
+            v_min, v_max = _v_bounds(hsv_crops)
+            ranges = propose_color_ranges(hist, v_min, v_max)
+            model_hist = cv2.normalize(hist, None, 0, 255, cv2.NORM_MINMAX)
+            self.result = {
+                'color_ranges': ranges,
+                'model': BackprojectModel(model_hist, v_min, v_max),
+                'pixels': int(sum(c.shape[0] * c.shape[1] for c in self.crops)),
+            }
+        except Exception as err:
+            self.error = str(err)
+        finally:
+            self.crops = []
+            self.done.set()
@@ -2,125 +2,372 @@ import time
 import cv2
 import numpy as np
 
+from .effects import apply_effect
 from .processing import (
-    apply_effect,
     preprocess_frame,
-    refine_mask,
-    build_hsv_mask,
+    make_clahe,
+    RangeMaskEngine,
     temporal_smooth_mask,
+    to_alpha_u8,
+    combine_cloak_alpha,
+    combine_cloak_alpha_float,
+    blend_alpha,
+    blend_alpha_float,
 )
+from .backend import download, make_workspace, out, upload
+from .capture import get_cap
+from .mask_refine import feather_mask, harden_mask, morph_kernels, person_feather_radius, refine_mask_fast
+from .calibration import backproject_mask
 from .mediapipe_utils import segment_person_mask
+from .frame_graph import FrameGraph
+from .governor import BASE_SETTINGS
+from .memprof import no_span
+from .output import COMPOSITE_MODES, compose_output, publish_copy
+from .state import apply_temporal_reset, release_job
 
 
-def get_cap(state):
-    if state.get('cap') is None or not state['cap'].isOpened():
-        state['cap'] = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-        state['cap'].set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        state['cap'].set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-    return state['cap']
-
-
-def _temporal_window(state):
+def _temporal_window(cfg, quality=BASE_SETTINGS):
     try:
-        return max(1, int(state.get('temporal_window', 1)))
+        window = max(1, int(cfg.temporal_window))
     except (TypeError, ValueError):
         return 1
+    cap = quality['temporal_window_cap']
+    return min(window, cap) if cap else window
+
+
+def _segment(raw, state, segmentor, mp, quality):
+    # Under load the governor lets us reuse the previous segmentation result.
+    interval = quality['seg_interval']
+    idx = state.get('seg_frame_idx', 0)
+    state['seg_frame_idx'] = idx + 1
+    if interval > 1 and idx % interval and state.get('last_person_seg') is not None:
+        return state['last_person_seg']
+    mask = segment_person_mask(segmentor, mp, raw)
+    state['last_person_seg'] = mask
+    return mask
 
 
-def _get_person_mask(raw, state, segmentor, mp, mediapipe_available):
+def _get_person_mask(raw, state, cfg, segmentor, mp, mediapipe_available, quality=BASE_SETTINGS):
     if not mediapipe_available or segmentor is None or mp is None:
         return None
-    if not (state.get('bg_mode') == 'smart' or state.get('use_ai_refine', False)):
+    if not (cfg.bg_mode == 'smart' or cfg.use_ai_refine):
         return None
-    mask = segment_person_mask(segmentor, mp, raw)
+    mask = _segment(raw, state, segmentor, mp, quality)
     if mask is None:
         return None
-    window = _temporal_window(state)
-    mask = temporal_smooth_mask(mask.astype(np.float32), state.get('person_mask_history'), window)
-    mask = cv2.GaussianBlur(mask, (15, 15), 0)
+    window = _temporal_window(cfg, quality)
+    radius = person_feather_radius(cfg.feather_radius)
+    motion = _motion(state['person_mask_motion'], raw, mask, cfg, window)
+    if cfg.mask_precision == 'float':
+        mask = temporal_smooth_mask(mask.astype(np.float32), state['person_mask_history_float'], window, motion)
+        return feather_mask(mask, radius)
+    mask = state['person_mask_history'].push(to_alpha_u8(mask), window, motion)
+    return feather_mask(mask, radius)
+
+
+def _motion(estimator, raw, mask, cfg, window):
+    """Region motion for the smoothing history, or None when there is nothing to compensate."""
+    if not cfg.motion_compensation or window <= 1:
+        estimator.clear()
+        return None
+    if mask.dtype != np.uint8:
+        mask = to_alpha_u8(mask)
+    return estimator.estimate(raw, mask)
+
+
+def _virtual_bg_frame(state, w_frame, h_frame):
+    """Virtual background at frame size, pre-mirrored when the output gets mirrored."""
+    mirror = state['capture_config'].mirror
+    stream = state.get('virtual_bg_stream')
+    if stream is not None:
+        frame = stream.next_frame(w_frame, h_frame, mirror)
+        if frame is not None:
+            return frame
+    image = state['virtual_bg']
+    if image is None:
+        return None
+    # A still image is fitted once, not resized every frame.
+    fitted = state.get('virtual_bg_fitted')
+    if fitted is None or fitted[0] is not image or fitted[1] != (w_frame, h_frame, mirror):
+        frame = cv2.resize(image, (w_frame, h_frame))
+        if mirror:
+            frame = cv2.flip(frame, 1)
+        fitted = state['virtual_bg_fitted'] = (image, (w_frame, h_frame, mirror), frame)
+    return fitted[2]
+
+
+def _build_derived(cfg, previous=None):
+    """Per-config artifacts, rebuilt only when the config version changes."""
+    k = cfg.smart_blur_amount
+    # The range mask engine is carried over and recompiles only the ranges that changed.
+    engine = previous['mask_engine'] if previous is not None else RangeMaskEngine()
+    return {
+        # Pre-bound buffers survive config changes unless the backend changes.
+        'workspace': make_workspace(cfg.compute_backend, previous['workspace'] if previous else None),
+        'version': cfg.version,
+        'mask_engine': engine.update(cfg.color_ranges, cfg.mask_hysteresis),
+        'kernels': morph_kernels(cfg.morph_open, cfg.morph_close),
+        'bilateral': (cfg.bilateral_d, cfg.bilateral_sigma),
+        'clahe': make_clahe(cfg.clahe_clip),
+        'smart_blur_ksize': (k, k) if k % 2 == 1 else (k + 1, k + 1),
+        'solid_color': np.array(cfg.solid_color, np.uint8),
+    }
+
+
+def derived_for(cfg, derived=None):
+    if derived is None or derived['version'] != cfg.version:
+        return _build_derived(cfg, derived)
+    return derived
+
+
+def _stage_mask_src(g):
+    raw, ws, scale = g['raw'], g['derived']['workspace'], g['quality']['mask_scale']
+    if scale >= 1.0:
+        return raw
+    h_frame, w_frame = raw.shape[:2]
+    size = (max(1, int(round(w_frame * scale))), max(1, int(round(h_frame * scale))))
+    return cv2.resize(raw, size, dst=out(ws, 'mask_src', (size[1], size[0], 3), host=True),
+                      interpolation=cv2.INTER_AREA)
+
+
+def _stage_pp(g):
+    derived = g['derived']
+    return preprocess_frame(g['mask_src'], g['quality']['preprocess_mode'], derived['workspace'],
+                            derived['bilateral'], derived['clahe'])
+
+
+def _stage_pp_raw(g):
+    return download(g['pp'])
+
+
+def _stage_hsv(g):
+    return cv2.cvtColor(g['pp'], cv2.COLOR_BGR2HSV, dst=out(g['derived']['workspace'], 'hsv', g['mask_src'].shape))
+
+
+def _stage_cloak_mask(g):
+    """Refined cloak mask at full frame size (before person suppression and smoothing)."""
+    cfg, derived, raw, mask_src = g['cfg'], g['derived'], g['raw'], g['mask_src']
+    ws = derived['workspace']
+    if cfg.mask_model == 'backproject' and cfg.backproject_model is not None:
+        mask = backproject_mask(download(g['hsv']), cfg.backproject_model)
+    else:
+        mask = derived['mask_engine'].mask(g['hsv'], ws, mask_src.shape)
+    # Skip the extra downscale if the governor already halved the mask.
+    mask_scale = g['quality']['mask_scale']
+    morph_scale = 0.5 if mask_scale >= 1.0 else 1.0
+    mask = refine_mask_fast(mask, cfg.feather_radius, morph_scale, derived['kernels'], ws, mask_src.shape,
+                            mask_scale=min(1.0, mask_scale))
+    h_frame, w_frame = raw.shape[:2]
+    if mask_src.shape[:2] != (h_frame, w_frame):
+        mask = cv2.resize(mask, (w_frame, h_frame), dst=out(ws, 'mask_full', (h_frame, w_frame)),
+                          interpolation=cv2.INTER_LINEAR)
+        mask = harden_mask(mask, cfg.feather_radius)
     return mask
 
 
-def camera_thread_fn(state, segmentor, mp, mediapipe_available):
-    cap = get_cap(state)
-    while True:
-        ret, raw = cap.read()
-        if not ret:
-            time.sleep(0.03)
-            continue
-        raw = cv2.flip(raw, 1)
-        h_frame, w_frame = raw.shape[:2]
+def _stage_person_mask(g):
+    return _get_person_mask(g['raw'], g['state'], g['cfg'], g['segmentor'], g['mp'], g['mediapipe_available'],
+                            g['quality'])
 
-        pp_raw = preprocess_frame(raw)
-        processed = raw
 
-        if state['running']:
-            person_mask = _get_person_mask(raw, state, segmentor, mp, mediapipe_available)
-            window = _temporal_window(state)
-            mode = state['bg_mode']
+def _stage_blur_layer(g):
+    ws, raw = g['derived']['workspace'], g['raw']
+    return cv2.GaussianBlur(upload(ws, 'smart_src', raw), g['derived']['smart_blur_ksize'], 0,
+                            dst=out(ws, 'smart_blur', raw.shape))
 
-            if mode in ('invisible', 'virtual'):
-                if mode == 'virtual' and state['virtual_bg'] is not None:
-                    bg_src = cv2.resize(state['virtual_bg'], (w_frame, h_frame))
-                elif mode == 'invisible' and state['background'] is not None:
-                    bg_src = state['background']
-                else:
-                    bg_src = None
 
+# Per-frame stages (core.frame_graph): each runs only if something reads it.
+PIPELINE_STAGES = {
+    'mask_src': _stage_mask_src,
+    'pp': _stage_pp,
+    'pp_raw': _stage_pp_raw,
+    'hsv': _stage_hsv,
+    'cloak_mask': _stage_cloak_mask,
+    'person_mask': _stage_person_mask,
+    'blur_layer': _stage_blur_layer,
+}
+
+
+def process_frame(state, raw, cfg, derived, quality=BASE_SETTINGS, segmentor=None, mp=None,
+                  mediapipe_available=False):
+    """
+    Run one captured frame through the pipeline, in camera orientation.
+    Returns (output, graph): output is shaped by cfg.output_mode (see
+    core.output); graph is the frame's FrameGraph, from which callers can pull
+    further stages (e.g. 'pp_raw' for calibration) computed at most once.
+    Shared by the camera loop and core.trace replay, so both exercise the same
+    code. Mirroring is left to the camera loop, which folds it into the copy
+    it publishes.
+    """
+    apply_temporal_reset(state)
+    memprof = state.get('memprof')
+    stages = memprof.wrap(PIPELINE_STAGES) if memprof is not None else PIPELINE_STAGES
+    g = FrameGraph(stages, state=state, raw=raw, cfg=cfg, derived=derived, quality=quality,
+                   segmentor=segmentor, mp=mp, mediapipe_available=mediapipe_available)
+    ws = derived['workspace']
+    h_frame, w_frame = raw.shape[:2]
+    processed = raw
+    matte = None
+    output_mode = cfg.output_mode
+    # The mask-only modes never show a replacement, so they skip fetching the
+    # background, the blend and the effects.
+    composite = output_mode in COMPOSITE_MODES
+    run_effect = composite and cfg.effect != 'none' and cfg.effect not in quality['disabled_effects']
+    window = _temporal_window(cfg, quality)
+    mode = cfg.bg_mode
+
+    if cfg.running and mode in ('invisible', 'virtual'):
+        if not composite:
+            bg_src = None
+        elif mode == 'virtual':
+            bg_src = _virtual_bg_frame(state, w_frame, h_frame)
+        elif mode == 'invisible' and state['background'] is not None:
+            bg_src = state['background']
+            if bg_src.shape != raw.shape:
+                # Captured under another camera mode (see /set_capture); fitted
+                # once so the background model keeps updating the same array.
+                bg_src = state['background'] = cv2.resize(bg_src, (w_frame, h_frame))
+        else:
+            bg_src = None
+        if bg_src is not None and bg_src.shape != raw.shape:
+            bg_src = cv2.resize(bg_src, (w_frame, h_frame))
+
+        if bg_src is not None or not composite:
+            mask = g['cloak_mask']
+            person_mask = g['person_mask']
+            suppress = person_mask if cfg.use_ai_refine else None
+            motion = _motion(state['mask_motion'], raw, download(mask), cfg, window)
+            if cfg.mask_precision == 'float':
+                alpha_f = combine_cloak_alpha_float(download(mask), suppress, state['mask_history_float'],
+                                                    window, motion)
+                if bg_src is not None:
+                    processed = blend_alpha_float(raw, bg_src, alpha_f)
+                alpha = to_alpha_u8(alpha_f)
+            else:
+                alpha = combine_cloak_alpha(mask, suppress, state['mask_history'], window, ws, motion)
                 if bg_src is not None:
-                    hsv = cv2.cvtColor(pp_raw, cv2.COLOR_BGR2HSV)
-                    mask = build_hsv_mask(hsv, state['color_ranges'])
-                    mask = refine_mask(mask)
-
-                    mask_f = mask.astype(np.float32) / 255.0
-                    if state.get('use_ai_refine', False) and person_mask is not None:
-                        mask_f = mask_f * (1.0 - person_mask)
-                    mask_f = temporal_smooth_mask(mask_f, state.get('mask_history'), window)
-
-                    mask3 = np.stack([mask_f, mask_f, mask_f], axis=2)
-                    raw_f = raw.astype(np.float32)
-                    bg_f = bg_src.astype(np.float32)
-                    blended = raw_f * (1 - mask3) + bg_f * mask3
-                    processed = np.clip(blended, 0, 255).astype(np.uint8)
-                    processed = apply_effect(processed, state['effect'])
-
-            elif mode == 'smart' and mediapipe_available and segmentor is not None:
-                if person_mask is None:
-                    person_mask = _get_person_mask(raw, state, segmentor, mp, mediapipe_available)
-                if person_mask is not None:
-                    person_mask3 = np.stack([person_mask, person_mask, person_mask], axis=2)
-
-                    bg_type = state['smart_bg_type']
-                    if bg_type == 'blur':
-                        k = state['smart_blur_amount']
-                        k = k if k % 2 == 1 else k + 1
-                        bg_layer = cv2.GaussianBlur(raw, (k, k), 0)
-                    elif bg_type == 'virtual' and state['virtual_bg'] is not None:
-                        bg_layer = cv2.resize(state['virtual_bg'], (w_frame, h_frame))
-                    elif bg_type == 'solid':
-                        bg_layer = np.full_like(raw, state['solid_color'], dtype=np.uint8)
-                    else:
-                        bg_layer = cv2.GaussianBlur(raw, (25, 25), 0)
-
-                    raw_f = raw.astype(np.float32)
-                    bg_f = bg_layer.astype(np.float32)
-                    blended = raw_f * person_mask3 + bg_f * (1 - person_mask3)
-                    processed = np.clip(blended, 0, 255).astype(np.uint8)
-                    processed = apply_effect(processed, state['effect'])
-
-        with state['lock']:
-            state['raw_frame'] = raw.copy()
-            state['pp_frame'] = pp_raw.copy()
-            state['frame'] = processed.copy()
-
-
-def generate_frames(state):
-    while True:
-        with state['lock']:
-            frame = state.get('frame')
-        if frame is None:
+                    processed = download(blend_alpha(raw, bg_src, alpha, ws, raw.shape))
+            matte = alpha
+            if mode == 'invisible' and cfg.bg_adapt and bg_src is not None:
+                state['bg_model'].update(bg_src, raw, download(alpha), person_mask)
+            if run_effect:
+                region = alpha if cfg.effect_region == 'mask' else None
+                processed = apply_effect(processed, cfg.effect, region)
+
+    elif cfg.running and mode == 'smart' and mediapipe_available and segmentor is not None:
+        person_mask = g['person_mask']
+        if person_mask is not None:
+            bg_type = cfg.smart_bg_type
+            if not composite:
+                bg_layer = None
+            elif bg_type == 'blur':
+                bg_layer = g['blur_layer']
+            elif bg_type == 'virtual' and state['virtual_bg'] is not None:
+                bg_layer = _virtual_bg_frame(state, w_frame, h_frame)
+            elif bg_type == 'solid':
+                bg_layer = np.full_like(raw, derived['solid_color'], dtype=np.uint8)
+            else:
+                bg_layer = cv2.GaussianBlur(raw, (25, 25), 0)
+
+            if cfg.mask_precision == 'float':
+                if bg_layer is not None:
+                    processed = blend_alpha_float(bg_layer, raw, person_mask)
+                background_alpha = to_alpha_u8(1.0 - person_mask)
+            else:
+                if bg_layer is not None:
+                    processed = download(blend_alpha(bg_layer, raw, person_mask, ws, raw.shape))
+                background_alpha = cv2.bitwise_not(person_mask)
+            matte = background_alpha
+            if run_effect:
+                region = background_alpha if cfg.effect_region == 'mask' else None
+                processed = apply_effect(processed, cfg.effect, region)
+
+    if matte is not None:
+        matte = download(matte)
+    pp = g['pp_raw'] if output_mode == 'debug' else None
+    return compose_output(output_mode, processed, raw, pp, matte), g
+
+
+def latest_preprocessed(state):
+    """
+    Preprocessed copy of the latest frame, for /pick_color. Reuses the camera
+    loop's result when the mask path computed one; otherwise it is computed
+    here, once per frame, rather than by the loop on every frame.
+    """
+    with state['lock']:
+        pp, raw = state.get('pp_frame'), state.get('raw_frame')
+    if pp is not None or raw is None:
+        return pp
+    cfg = state['config'].current
+    governor = state.get('governor')
+    mode = governor.settings()['preprocess_mode'] if governor is not None else 'full'
+    pp = preprocess_frame(raw, mode, None, (cfg.bilateral_d, cfg.bilateral_sigma), make_clahe(cfg.clahe_clip))
+    with state['lock']:
+        if state.get('raw_frame') is raw:
+            state['pp_frame'] = pp
+    return pp
+
+
+def camera_thread_fn(state, segmentor, mp, mediapipe_available, stop=None):
+    """Capture, process and publish frames until `stop` (a threading.Event) is set."""
+    governor = state.get('governor')
+    config_store = state['config']
+    derived = None
+    while stop is None or not stop.is_set():
+        memprof = state.get('memprof')
+        span = memprof.span if memprof is not None else no_span
+        # Re-fetched per frame so /set_capture can renegotiate the camera.
+        cap = get_cap(state)
+        with span('capture'):
+            ret, raw = cap.read()
+        if not ret:
             time.sleep(0.03)
             continue
-        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-        time.sleep(0.01)
+        t_start = time.perf_counter()
+        # One config reference per frame: every read below sees the same snapshot.
+        cfg = config_store.current
+        derived = derived_for(cfg, derived)
+        quality = governor.settings() if governor is not None else BASE_SETTINGS
+        tracer = state.get('tracer')
+        if tracer is not None:
+            tracer.add_frame(raw, state, cfg, governor.level if governor is not None else 0)
+
+        with span('compose'):
+            processed, graph = process_frame(
+                state, raw, cfg, derived, quality, segmentor, mp, mediapipe_available)
+            calibration = state.get('calibration')
+            if calibration is not None and calibration.offer(graph['pp_raw']):
+                release_job(state, 'calibration', calibration)
+            # Kept only when some stage needed it; /pick_color computes it on demand otherwise.
+            pp_raw = graph['pp_raw'] if 'pp' in graph else None
+
+        with span('publish'):
+            # The published copy doubles as the mirror: no separate full-frame flip.
+            out = publish_copy(processed, cfg.output_mode, state['capture_config'].mirror)
+            with state['lock']:
+                state['raw_frame'] = raw.copy()
+                state['pp_frame'] = pp_raw.copy() if pp_raw is not None else None
+                state['frame'] = out
+                state['frames_processed'] += 1
+                state['stages_evaluated'] = graph.evaluated
+
+            recorder = state.get('recorder')
+            if recorder is not None:
+                recorder.submit(out)
+            ring = state.get('shm_ring')
+            if ring is not None:
+                ring.write(out)
+            broadcaster = state.get('broadcaster')
+            if broadcaster is not None:
+                broadcaster.submit(out)
+            on_frame = state.get('on_frame')
+            if on_frame is not None:
+                on_frame(out)
+
+        frame_ms = (time.perf_counter() - t_start) * 1000.0
+        if tracer is not None:
+            tracer.end_frame(frame_ms)
+        if governor is not None:
+            governor.record(frame_ms)
+        if memprof is not None:
+            memprof.end_frame(state, derived, frame_ms)
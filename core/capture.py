@@ -0,0 +1,131 @@
+import sys
+import time
+from dataclasses import dataclass
+
+import cv2
+
+CAPTURE_FORMATS = ('auto', 'MJPG', 'YUYV')
+CAPTURE_APIS = {
+    'any': cv2.CAP_ANY,
+    'v4l2': cv2.CAP_V4L2,
+    'dshow': cv2.CAP_DSHOW,
+    'msmf': cv2.CAP_MSMF,
+    'avfoundation': cv2.CAP_AVFOUNDATION,
+}
+CAPTURE_FPS_MAX = 120
+CAPTURE_BUFFER_MAX = 8
+# Seconds between attempts to reopen a camera that failed to open.
+CAPTURE_RETRY_SECONDS = 2.0
+# 'auto' asks for YUYV up to this many pixels and MJPG above it: raw YUYV at
+# 720p and up exceeds USB 2.0 bandwidth at 30 fps, so drivers cut the rate,
+# while below it skipping the JPEG decode is cheaper.
+YUYV_MAX_PIXELS = 640 * 480
+
+
+@dataclass(frozen=True)
+class CaptureConfig:
+    """
+    What to ask the camera driver for. Drivers are free to pick the nearest
+    mode they support; open_capture() reports what was actually negotiated.
+    `mirror` flips the published output (selfie view) once, at the end.
+    """
+    device: int = 0
+    api: str = 'auto'
+    width: int = 640
+    height: int = 480
+    fps: int = 30
+    fourcc: str = 'auto'
+    # Frames queued in the driver: 1 keeps latency low, more smooths jitter.
+    buffer_size: int = 1
+    mirror: bool = True
+
+
+def platform_api(name='auto'):
+    """OpenCV capture backend for `name`; 'auto' picks the native one for this OS."""
+    if name != 'auto':
+        return CAPTURE_APIS.get(name, cv2.CAP_ANY)
+    if sys.platform.startswith('linux'):
+        return cv2.CAP_V4L2
+    if sys.platform == 'win32':
+        return cv2.CAP_DSHOW
+    if sys.platform == 'darwin':
+        return cv2.CAP_AVFOUNDATION
+    return cv2.CAP_ANY
+
+
+def requested_fourcc(cc):
+    if cc.fourcc in ('MJPG', 'YUYV'):
+        return cc.fourcc
+    return 'YUYV' if cc.width * cc.height <= YUYV_MAX_PIXELS else 'MJPG'
+
+
+def _decode_fourcc(value):
+    value = int(value)
+    return ''.join(chr((value >> 8 * i) & 0xFF) for i in range(4)).strip('\x00') or None
+
+
+def open_capture(cc):
+    """
+    Open and negotiate a camera. Returns (cap, negotiated dict).
+    V4L2 applies properties in order, so the pixel format goes first (it
+    limits the available sizes), then the size, then the frame rate.
+    """
+    cap = cv2.VideoCapture(cc.device, platform_api(cc.api))
+    if not cap.isOpened() and cc.api == 'auto':
+        cap = cv2.VideoCapture(cc.device)
+    fourcc = requested_fourcc(cc)
+    if cap.isOpened():
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, cc.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, cc.height)
+        cap.set(cv2.CAP_PROP_FPS, cc.fps)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, cc.buffer_size)
+    return cap, describe_capture(cap, cc, fourcc)
+
+
+def describe_capture(cap, cc, fourcc=None):
+    """Requested vs. negotiated capture mode, for /capture_status."""
+    info = {
+        'requested': {
+            'device': cc.device,
+            'api': cc.api,
+            'width': cc.width,
+            'height': cc.height,
+            'fps': cc.fps,
+            'fourcc': fourcc or requested_fourcc(cc),
+            'buffer_size': cc.buffer_size,
+            'mirror': cc.mirror,
+        },
+        'opened': bool(cap is not None and cap.isOpened()),
+    }
+    if info['opened']:
+        info['negotiated'] = {
+            'backend': cap.getBackendName() if hasattr(cap, 'getBackendName') else None,
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': round(cap.get(cv2.CAP_PROP_FPS), 2),
+            'fourcc': _decode_fourcc(cap.get(cv2.CAP_PROP_FOURCC)),
+            'buffer_size': int(cap.get(cv2.CAP_PROP_BUFFERSIZE)),
+        }
+    return info
+
+
+def get_cap(state):
+    """
+    Camera for the current state['capture_config'], reopened when the config
+    object changes. A camera that failed to open is retried every
+    CAPTURE_RETRY_SECONDS instead of on every frame.
+    """
+    cc = state['capture_config']
+    cap = state.get('cap')
+    if cap is not None and state.get('cap_config') is cc:
+        if cap.isOpened() or time.monotonic() - state.get('cap_opened_at', 0.0) < CAPTURE_RETRY_SECONDS:
+            return cap
+    if cap is not None:
+        cap.release()
+    cap, info = open_capture(cc)
+    state['cap'] = cap
+    state['cap_config'] = cc
+    state['cap_opened_at'] = time.monotonic()
+    state['capture_info'] = info
+    return cap
@@ -0,0 +1,161 @@
+import threading
+from collections import namedtuple
+from dataclasses import dataclass, fields, replace
+
+from .backend import COMPUTE_BACKEND_DEFAULT
+
+TEMPORAL_WINDOW_DEFAULT = 4
+TEMPORAL_WINDOW_MAX = 12
+FEATHER_RADIUS_DEFAULT = 3
+FEATHER_RADIUS_MAX = 40
+CLAHE_CLIP_DEFAULT = 2.0
+# (diameter, sigma) of the preprocessing bilateral filter; diameter 0 skips it
+BILATERAL_D_DEFAULT = 9
+BILATERAL_SIGMA_DEFAULT = 75.0
+# Elliptical open/close kernel sizes, applied at the half-resolution morphology scale
+MORPH_OPEN_DEFAULT = 3
+MORPH_CLOSE_DEFAULT = 7
+# Hysteresis margin (HSV levels; half on hue) of the weak cloak bounds; 0 is off
+MASK_HYSTERESIS_DEFAULT = 0
+MASK_HYSTERESIS_MAX = 60
+
+# Numeric knobs that trade mask quality against latency: name -> (type, min, max).
+# Set through /set_pipeline, stored in profiles, searched by experiments/part3/pareto.py.
+TUNING_PARAMS = {
+    'temporal_window': (int, 1, TEMPORAL_WINDOW_MAX),
+    'feather_radius': (int, 0, FEATHER_RADIUS_MAX),
+    'clahe_clip': (float, 0.5, 8.0),
+    'bilateral_d': (int, 0, 15),
+    'bilateral_sigma': (float, 10.0, 150.0),
+    'morph_open': (int, 1, 15),
+    'morph_close': (int, 1, 25),
+    'mask_hysteresis': (int, 0, MASK_HYSTERESIS_MAX),
+}
+
+ColorRange = namedtuple('ColorRange', ['hsv_min', 'hsv_max'])
+
+
+def make_color_range(hsv_min, hsv_max):
+    return ColorRange(tuple(int(v) for v in hsv_min), tuple(int(v) for v in hsv_max))
+
+
+def freeze_color_ranges(color_ranges):
+    """List of {'hsv_min', 'hsv_max'} dicts (JSON/profile shape) -> tuple of ColorRange."""
+    return tuple(
+        cr if isinstance(cr, ColorRange) else make_color_range(cr['hsv_min'], cr['hsv_max'])
+        for cr in color_ranges
+    )
+
+
+def color_ranges_to_dicts(color_ranges):
+    return [{'hsv_min': list(cr.hsv_min), 'hsv_max': list(cr.hsv_max)} for cr in color_ranges]
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """
+    Immutable snapshot of everything the camera loop reads per frame.
+    Endpoints never mutate a config; they publish a new one through ConfigStore,
+    which bumps `version`. The loop grabs one reference per frame and rebuilds
+    derived artifacts (HSV bounds, kernels) only when the version changes.
+    """
+    version: int = 0
+    running: bool = False
+    # bg_mode: 'invisible' | 'virtual' | 'smart'
+    bg_mode: str = 'invisible'
+    color_ranges: tuple = (ColorRange((0, 0, 0), (0, 0, 0)),)
+    effect: str = 'none'
+    # effect_region: 'frame' | 'mask' (only the replaced region)
+    effect_region: str = 'frame'
+    # Keep the captured 'invisible' background current (core.background)
+    bg_adapt: bool = True
+    smart_bg_type: str = 'blur'
+    solid_color: tuple = (0, 177, 64)
+    smart_blur_amount: int = 25
+    # Temporal smoothing and AI refinement
+    temporal_window: int = TEMPORAL_WINDOW_DEFAULT
+    use_ai_refine: bool = True
+    # Warp the smoothing history along the cloak's motion (core.motion) so
+    # longer windows do not ghost
+    motion_compensation: bool = False
+    # Mask edge softening radius (constant cost, see core.mask_refine)
+    feather_radius: int = FEATHER_RADIUS_DEFAULT
+    # Preprocessing and morphology parameters (see TUNING_PARAMS)
+    clahe_clip: float = CLAHE_CLIP_DEFAULT
+    bilateral_d: int = BILATERAL_D_DEFAULT
+    bilateral_sigma: float = BILATERAL_SIGMA_DEFAULT
+    morph_open: int = MORPH_OPEN_DEFAULT
+    morph_close: int = MORPH_CLOSE_DEFAULT
+    # Weak bounds this much wider than each colour range, kept where connected
+    # to the strong (exact) range mask (see core.processing.RangeMaskEngine)
+    mask_hysteresis: int = MASK_HYSTERESIS_DEFAULT
+    # mask_precision: 'uint8' (default) | 'float' (reference path)
+    mask_precision: str = 'uint8'
+    # mask_model: 'ranges' (HSV inRange) | 'backproject' (calibrated H-S histogram)
+    mask_model: str = 'ranges'
+    backproject_model: object = None
+    # compute_backend: 'numpy' | 'dst' (pre-bound outputs) | 'umat' (OpenCL T-API), see core.backend
+    compute_backend: str = COMPUTE_BACKEND_DEFAULT
+    # output_mode: 'composite' | 'alpha' | 'bgra' | 'debug', see core.output
+    output_mode: str = 'composite'
+
+    def color_ranges_dicts(self):
+        return color_ranges_to_dicts(self.color_ranges)
+
+    def tuning(self):
+        return {name: getattr(self, name) for name in TUNING_PARAMS}
+
+
+def parse_tuning(data, cfg):
+    """Clamped TUNING_PARAMS values present in `data`; unparsable ones keep cfg's value."""
+    changes = {}
+    for name, (kind, lo, hi) in TUNING_PARAMS.items():
+        if name not in data:
+            continue
+        try:
+            value = kind(data[name])
+        except (TypeError, ValueError):
+            value = getattr(cfg, name)
+        changes[name] = max(lo, min(value, hi))
+    return changes
+
+
+def config_to_dict(cfg, model_file=None):
+    """
+    JSON-friendly PipelineConfig without `version`. The back-projection model
+    is not serializable; it is replaced by `model_file` (a reference or None).
+    """
+    data = {f.name: getattr(cfg, f.name) for f in fields(cfg) if f.name != 'version'}
+    data['color_ranges'] = color_ranges_to_dicts(cfg.color_ranges)
+    data['solid_color'] = list(cfg.solid_color)
+    data['backproject_model'] = model_file
+    return data
+
+
+class ConfigStore:
+    """
+    Single-writer publication point for PipelineConfig.
+    Writers serialize on a lock; readers just read `current`, which is a plain
+    attribute load and therefore never sees a half-applied update.
+    """
+
+    def __init__(self, config=None):
+        self._lock = threading.Lock()
+        self.current = config or PipelineConfig()
+
+    def update(self, **changes):
+        return self.transform(lambda cfg: changes)
+
+    def transform(self, fn):
+        """Apply fn(current) -> dict of changes atomically with respect to other writers."""
+        with self._lock:
+            cfg = self.current
+            changes = fn(cfg) or {}
+            if 'color_ranges' in changes:
+                changes['color_ranges'] = freeze_color_ranges(changes['color_ranges'])
+            if 'solid_color' in changes:
+                changes['solid_color'] = tuple(changes['solid_color'])
+            if all(getattr(cfg, k) == v for k, v in changes.items()):
+                return cfg
+            self.current = replace(cfg, version=cfg.version + 1, **changes)
+            return self.current
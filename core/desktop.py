@@ -0,0 +1,98 @@
+import threading
+
+from .calibration import pick_color_range
+from .camera import camera_thread_fn, latest_preprocessed
+from .config import make_color_range
+from .state import create_state, reset_temporal_state
+
+# Seconds stop() waits for the camera loop to finish its frame
+WORKER_JOIN_TIMEOUT = 2.0
+
+
+class PipelineWorker:
+    """
+    The web app's camera loop for in-process front-ends (invisible.py,
+    cloak_gui.py). Capture and processing run on a worker thread; the front
+    end changes settings through `config` and takes finished frames from
+    wait_frame() or from `on_frame(frame)`, which is called on the worker.
+    Frames are the published copies (already mirrored) and are never written
+    again, so they can be wrapped for display without copying.
+    """
+
+    def __init__(self, on_frame=None, segmentor=None, mp=None, mediapipe_available=False):
+        self.state = create_state()
+        self.config = self.state['config']
+        self.on_frame = on_frame
+        self.state['on_frame'] = self._publish
+        self._segmentation = (segmentor, mp, mediapipe_available)
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=camera_thread_fn,
+            args=(self.state, *self._segmentation),
+            kwargs={'stop': self._stop},
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(WORKER_JOIN_TIMEOUT)
+        cap = self.state.get('cap')
+        if cap is not None:
+            cap.release()
+        stream = self.state.get('virtual_bg_stream')
+        if stream is not None:
+            stream.stop()
+
+    def _publish(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+        if self.on_frame is not None:
+            self.on_frame(frame)
+
+    def wait_frame(self, after=0, timeout=1.0):
+        """(seq, frame) for the newest frame after `after`; frame is None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after, timeout):
+                return after, None
+            return self._seq, self._frame
+
+    def capture_background(self):
+        """Take the latest camera frame as the 'invisible' background; False before the first frame."""
+        with self.state['lock']:
+            raw = self.state['raw_frame']
+        if raw is None:
+            return False
+        self.state['background'] = raw.copy()
+        return True
+
+    def set_running(self, running):
+        if running and not self.config.current.running:
+            reset_temporal_state(self.state)
+        self.config.update(running=bool(running))
+
+    def set_color_range(self, hsv_min, hsv_max):
+        self.config.update(color_ranges=[make_color_range(hsv_min, hsv_max)])
+
+    def pick_color(self, x, y, sensitivity=20):
+        """
+        (hsv, hsv_min, hsv_max) around normalized (x, y) on the displayed
+        frame, or None before the first frame. Reads the frame the pipeline
+        already has instead of grabbing one from the camera.
+        """
+        frame = latest_preprocessed(self.state)
+        if frame is None:
+            return None
+        if self.state['capture_config'].mirror:
+            x = 1.0 - x
+        return pick_color_range(frame, x, y, sensitivity)
@@ -0,0 +1,109 @@
+from collections import OrderedDict, namedtuple
+
+import cv2
+import numpy as np
+
+# Relative per-frame cost, used by the quality governor to decide what to shed.
+COST_NONE = 0
+COST_LOW = 1
+COST_MEDIUM = 2
+COST_HIGH = 3
+
+# fast: the default implementation used by every front-end.
+# reference: the original full-resolution version, kept for comparison/benchmarks.
+Effect = namedtuple('Effect', ['name', 'cost', 'fast', 'reference'])
+
+EFFECT_REGISTRY = OrderedDict()
+
+
+def register_effect(name, cost, fast, reference=None):
+    EFFECT_REGISTRY[name] = Effect(name, cost, fast, reference or fast)
+
+
+def _identity(img):
+    return img
+
+
+def _pixelate(img):
+    h, w = img.shape[:2]
+    temp = cv2.resize(img, (max(1, w // 16), max(1, h // 16)), interpolation=cv2.INTER_LINEAR)
+    return cv2.resize(temp, (w, h), interpolation=cv2.INTER_NEAREST)
+
+
+def _blur_reference(img):
+    return cv2.GaussianBlur(img, (21, 21), 0)
+
+
+def _blur_fast(img):
+    # Stack blur runs in constant time per pixel regardless of kernel size.
+    if hasattr(cv2, 'stackBlur'):
+        return cv2.stackBlur(img, (21, 21))
+    # Two box passes approximate a Gaussian; cv2.blur is also O(1) in the radius.
+    return cv2.blur(cv2.blur(img, (11, 11)), (11, 11))
+
+
+def _cartoon_edges(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.medianBlur(gray, 7)
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 9, 9)
+
+
+def _cartoon_reference(img):
+    edges = _cartoon_edges(img)
+    color = cv2.bilateralFilter(img, 9, 250, 250)
+    return cv2.bitwise_and(color, color, mask=edges)
+
+
+def _cartoon_fast(img):
+    # The bilateral is the expensive part: run it at half resolution with a
+    # matching half-size window and upscale. Edges stay full resolution.
+    h, w = img.shape[:2]
+    small = cv2.resize(img, (max(1, w // 2), max(1, h // 2)), interpolation=cv2.INTER_AREA)
+    color = cv2.bilateralFilter(small, 5, 250, 250)
+    color = cv2.resize(color, (w, h), interpolation=cv2.INTER_LINEAR)
+    edges = _cartoon_edges(img)
+    return cv2.bitwise_and(color, color, mask=edges)
+
+
+register_effect('none', COST_NONE, _identity)
+register_effect('pixelate', COST_LOW, _pixelate)
+register_effect('blur', COST_MEDIUM, _blur_fast, _blur_reference)
+register_effect('cartoon', COST_HIGH, _cartoon_fast, _cartoon_reference)
+
+EFFECTS = list(EFFECT_REGISTRY)
+
+
+def costly_effects(min_cost=COST_HIGH):
+    return tuple(e.name for e in EFFECT_REGISTRY.values() if e.cost >= min_cost)
+
+
+def _mask_roi(mask, pad=8):
+    """Bounding box of the non-zero mask area, padded so filters see some context."""
+    points = cv2.findNonZero(mask)
+    if points is None:
+        return None
+    x, y, w, h = cv2.boundingRect(points)
+    H, W = mask.shape[:2]
+    x0, y0 = max(0, x - pad), max(0, y - pad)
+    x1, y1 = min(W, x + w + pad), min(H, y + h + pad)
+    return slice(y0, y1), slice(x0, x1)
+
+
+def apply_effect(img, effect, mask=None, fast=True):
+    """
+    Apply a registered effect. With `mask` (uint8, non-zero = apply) the filter
+    only runs on the mask's bounding box and is copied back under the mask.
+    """
+    entry = EFFECT_REGISTRY.get(effect)
+    if entry is None or entry.cost == COST_NONE:
+        return img
+    fn = entry.fast if fast else entry.reference
+    if mask is None:
+        return fn(img)
+    roi = _mask_roi(mask)
+    if roi is None:
+        return img
+    out = img.copy()
+    region = fn(np.ascontiguousarray(img[roi]))
+    np.copyto(out[roi], region, where=mask[roi][..., None] > 127)
+    return out
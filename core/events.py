@@ -0,0 +1,156 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+
+EVENT_QUEUE_SIZE = 64
+HEARTBEAT_SECONDS = 15.0
+
+
+def format_sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+def dict_diff(old, new):
+    """Keys of `new` whose values differ from `old` (or are missing there)."""
+    return {k: v for k, v in new.items() if k not in old or old[k] != v}
+
+
+class EventHub:
+    """
+    Fans server-side state out to Server-Sent-Events clients.
+
+    publish_state() diffs a fresh UI-state dict against the last one sent and
+    pushes only the changed keys as a 'state' event; publish() sends any other
+    event (e.g. 'metrics'). Each subscriber has a bounded queue: a client that
+    stops reading loses events and is re-sent a full snapshot instead of making
+    publishers wait. Subscribers created with an event loop are also woken on
+    that loop, for asyncio servers (astream).
+    """
+
+    def __init__(self, snapshot_fn, queue_size=EVENT_QUEUE_SIZE):
+        self.snapshot_fn = snapshot_fn
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._last_state = None
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self, loop=None):
+        sub = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if self._last_state is None:
+                self._last_state = self.snapshot_fn()
+            self._subscribers[sub] = None if loop is None else (loop, asyncio.Event())
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.pop(sub, None)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for sub, waker in subscribers:
+            try:
+                sub.put_nowait((event, data))
+            except queue.Full:
+                # Drop the backlog; the stream resynchronises with a snapshot.
+                with sub.mutex:
+                    sub.queue.clear()
+                sub.put_nowait(('resync', None))
+            if waker is not None:
+                loop, wake = waker
+                try:
+                    loop.call_soon_threadsafe(wake.set)
+                except RuntimeError:
+                    pass  # loop closed; the subscriber is going away
+
+    def publish_state(self):
+        if not self._subscribers:
+            self._last_state = None
+            return
+        with self._lock:
+            state = self.snapshot_fn()
+            changed = dict_diff(self._last_state or {}, state)
+            self._last_state = state
+        if changed:
+            self.publish('state', changed)
+
+    def stream(self, sub, heartbeat=HEARTBEAT_SECONDS):
+        """SSE generator for one subscriber; starts with a full snapshot."""
+        try:
+            yield format_sse('snapshot', self.snapshot_fn())
+            while True:
+                try:
+                    event, data = sub.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event == 'resync':
+                    yield format_sse('snapshot', self.snapshot_fn())
+                else:
+                    yield format_sse(event, data)
+        finally:
+            self.unsubscribe(sub)
+
+    async def astream(self, sub, heartbeat=HEARTBEAT_SECONDS):
+        """stream() for a subscriber created with subscribe(loop=...); never blocks the loop."""
+        _, wake = self._subscribers[sub]
+        try:
+            yield format_sse('snapshot', self.snapshot_fn())
+            while True:
+                try:
+                    event, data = sub.get_nowait()
+                except queue.Empty:
+                    wake.clear()
+                    if not sub.empty():
+                        continue
+                    try:
+                        await asyncio.wait_for(wake.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        yield ': keep-alive\n\n'
+                    continue
+                if event == 'resync':
+                    yield format_sse('snapshot', self.snapshot_fn())
+                else:
+                    yield format_sse(event, data)
+        finally:
+            self.unsubscribe(sub)
+
+
+class RequestStats:
+    """Request counts and control-request latency, for the metrics stream."""
+
+    def __init__(self, window_s=5.0, alpha=0.2):
+        self.window_s = window_s
+        self.alpha = alpha
+        self.total = 0
+        self.by_path = {}
+        self.control_ms = None
+        self._recent = []
+        self._lock = threading.Lock()
+
+    def record(self, path, ms=None):
+        now = time.monotonic()
+        with self._lock:
+            self.total += 1
+            self.by_path[path] = self.by_path.get(path, 0) + 1
+            self._recent.append(now)
+            if ms is not None:
+                self.control_ms = ms if self.control_ms is None else self.control_ms + self.alpha * (ms - self.control_ms)
+
+    def snapshot(self):
+        cutoff = time.monotonic() - self.window_s
+        with self._lock:
+            self._recent = [t for t in self._recent if t >= cutoff]
+            return {
+                'requests_total': self.total,
+                'requests_per_s': round(len(self._recent) / self.window_s, 2),
+                'control_ms': round(self.control_ms, 3) if self.control_ms is not None else None,
+                'requests_by_path': dict(self.by_path),
+            }
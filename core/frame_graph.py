@@ -0,0 +1,30 @@
+class FrameGraph:
+    """
+    One frame's pipeline as lazily evaluated, memoized stages.
+    `stages` maps a name to a function of the graph. A stage runs the first
+    time something reads it, pulling in the stages it reads in turn, and its
+    result is kept for the rest of the frame; stages nobody asks for never
+    run. Per-frame inputs are passed as keyword arguments and read the same way.
+    """
+
+    def __init__(self, stages, **inputs):
+        self._stages = stages
+        self._values = inputs
+        # Stages in the order they ran, for /pipeline_status and profiling.
+        self.evaluated = []
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        value = self._values[name] = self._stages[name](self)
+        self.evaluated.append(name)
+        return value
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def get(self, name, default=None):
+        """A value only if it was already computed; never runs a stage."""
+        return self._values.get(name, default)
@@ -0,0 +1,105 @@
+from .effects import costly_effects
+
+TARGET_FPS_DEFAULT = 24
+TARGET_FPS_MIN = 5
+TARGET_FPS_MAX = 60
+
+# Each rung keeps the degradations of the rungs before it.
+QUALITY_LADDER = [
+    ('full', {}),
+    ('short_temporal', {'temporal_window_cap': 3}),
+    ('fast_preprocess', {'preprocess_mode': 'fast'}),
+    ('half_res_mask', {'mask_scale': 0.5}),
+    ('skip_segmentation', {'seg_interval': 2}),
+    ('no_costly_effects', {'disabled_effects': costly_effects()}),
+]
+
+BASE_SETTINGS = {
+    'temporal_window_cap': None,
+    'preprocess_mode': 'full',
+    'mask_scale': 1.0,
+    'seg_interval': 1,
+    'disabled_effects': (),
+}
+
+
+def _build_level_settings():
+    levels = []
+    settings = dict(BASE_SETTINGS)
+    for _, overrides in QUALITY_LADDER:
+        settings = {**settings, **overrides}
+        levels.append(settings)
+    return levels
+
+
+LEVEL_SETTINGS = _build_level_settings()
+
+
+class QualityGovernor:
+    """
+    Holds the camera loop at a target frame rate by stepping through QUALITY_LADDER.
+    Per-frame processing latency is tracked as an EMA. Sustained overruns of the
+    budget degrade one rung; sustained headroom restores one rung. The asymmetric
+    frame counts keep it from oscillating around the threshold.
+    """
+
+    def __init__(self, target_fps=TARGET_FPS_DEFAULT, enabled=True,
+                 degrade_after=15, restore_after=60, headroom=0.7, alpha=0.1):
+        self.enabled = enabled
+        self.degrade_after = degrade_after
+        self.restore_after = restore_after
+        self.headroom = headroom
+        self.alpha = alpha
+        self.level = 0
+        self.frame_ms = None
+        self._over = 0
+        self._under = 0
+        self.set_target_fps(target_fps)
+
+    def set_target_fps(self, fps):
+        fps = max(TARGET_FPS_MIN, min(int(fps), TARGET_FPS_MAX))
+        self.target_fps = fps
+        self.budget_ms = 1000.0 / fps
+        self._over = self._under = 0
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        if not self.enabled:
+            self.level = 0
+        self._over = self._under = 0
+
+    def record(self, frame_ms):
+        if self.frame_ms is None:
+            self.frame_ms = frame_ms
+        else:
+            self.frame_ms += self.alpha * (frame_ms - self.frame_ms)
+        if not self.enabled:
+            return
+
+        if self.frame_ms > self.budget_ms:
+            self._over += 1
+            self._under = 0
+        elif self.frame_ms < self.budget_ms * self.headroom:
+            self._under += 1
+            self._over = 0
+        else:
+            self._over = self._under = 0
+
+        if self._over >= self.degrade_after and self.level < len(LEVEL_SETTINGS) - 1:
+            self.level += 1
+            self._over = 0
+        elif self._under >= self.restore_after and self.level > 0:
+            self.level -= 1
+            self._under = 0
+
+    def settings(self):
+        return LEVEL_SETTINGS[self.level]
+
+    def status(self):
+        return {
+            'adaptive_quality': self.enabled,
+            'target_fps': self.target_fps,
+            'quality_level': self.level,
+            'quality_stage': QUALITY_LADDER[self.level][0],
+            'frame_ms': round(self.frame_ms, 2) if self.frame_ms is not None else None,
+        }
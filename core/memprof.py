@@ -0,0 +1,275 @@
+import contextlib
+import gc
+import os
+import threading
+import time
+import tracemalloc
+
+# Seconds between tracemalloc snapshots; each is compared with the first one
+# to find the source lines whose retained memory keeps growing.
+MEMPROF_SNAPSHOT_INTERVAL_DEFAULT = 10.0
+MEMPROF_SNAPSHOT_INTERVAL_MIN = 1.0
+MEMPROF_TOP_LINES = 10
+# Allocation-heavy state that lives across frames, reported by buffer_bytes()
+HISTORY_KEYS = ('mask_history', 'person_mask_history', 'mask_history_float', 'person_mask_history_float')
+FRAME_KEYS = ('background', 'virtual_bg', 'raw_frame', 'pp_frame', 'frame')
+
+_NO_SPAN = contextlib.nullcontext()
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def no_span(name):
+    """Stand-in for MemoryProfiler.span when profiling is off."""
+    return _NO_SPAN
+
+
+def buffer_bytes(state, derived=None):
+    """Bytes held across frames: smoothing histories, kept frames and the compute workspace."""
+    sizes = {}
+    for key in HISTORY_KEYS:
+        history = state.get(key)
+        if history is not None:
+            sizes[key] = history.nbytes if hasattr(history, 'nbytes') else sum(m.nbytes for m in list(history))
+    for key in FRAME_KEYS:
+        frame = state.get(key)
+        sizes[key] = frame.nbytes if frame is not None else 0
+    workspace = derived.get('workspace') if derived is not None else None
+    sizes['workspace'] = workspace.nbytes if workspace is not None else 0
+    return sizes
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError, IndexError):
+        return None
+
+
+class MemoryProfiler:
+    """
+    Diagnostic mode for the camera loop. Each frame is split into spans
+    (capture, compose, publish and every FrameGraph stage that runs); for each
+    span it records time and, with tracemalloc on, the highest allocation
+    above the span's starting level (transient arrays) and the bytes it left
+    allocated (negative when it released what earlier frames held). All three
+    exclude nested spans, so a stage is not charged for the stages it pulled
+    in. Garbage-collector pauses are timed through gc.callbacks, buffer sizes
+    are sampled every frame and snapshots are diffed every `snapshot_interval`
+    seconds to locate steady growth. tracemalloc slows the loop down
+    considerably; `trace_allocations=False` keeps only timings, GC pauses and
+    buffer sizes. stop() may come from a request thread: it shares a lock with
+    the camera thread's tracemalloc calls, so tracing never ends mid-call.
+    """
+
+    def __init__(self, trace_allocations=True, snapshot_interval=MEMPROF_SNAPSHOT_INTERVAL_DEFAULT):
+        self.trace_allocations = bool(trace_allocations)
+        self.snapshot_interval = max(MEMPROF_SNAPSHOT_INTERVAL_MIN, float(snapshot_interval))
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.active = True
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.frame_ms = 0.0
+        # name -> [frames, ms, peak_sum, peak_max, net_sum]
+        self._stages = {}
+        self._frame = []
+        self._stack = []
+        self._wrapped = {}
+        self.buffers = {}
+        self.buffers_max = {}
+        # generation -> [pauses, seconds, max seconds, objects collected]
+        self._gc = {gen: [0, 0.0, 0.0, 0] for gen in range(3)}
+        self._gc_t0 = None
+        self._traced_start = None
+        self._baseline = None
+        self._last_snapshot = 0.0
+        self.top_growth = []
+        self._owns_tracemalloc = self.trace_allocations and not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+        gc.callbacks.append(self._on_gc)
+
+    def stop(self):
+        """Detach from the collector and tracemalloc; returns the final stats()."""
+        with self._lock:
+            if not self.active:
+                return self.stats()
+            stats = self.stats()
+            self.active = stats['active'] = False
+            gc.callbacks.remove(self._on_gc)
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+        return stats
+
+    def _on_gc(self, phase, info):
+        # No locks here: a collection can start while any lock is held.
+        if phase == 'start':
+            self._gc_t0 = time.perf_counter()
+            return
+        if self._gc_t0 is None:
+            return
+        pause = time.perf_counter() - self._gc_t0
+        self._gc_t0 = None
+        entry = self._gc[info['generation']]
+        entry[0] += 1
+        entry[1] += pause
+        entry[2] = max(entry[2], pause)
+        entry[3] += info.get('collected', 0)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Attribute the enclosed work to `name` (camera thread only)."""
+        if not self.active:
+            yield
+            return
+        start = 0
+        with self._lock:
+            tracing = self.active and self.trace_allocations and tracemalloc.is_tracing()
+            if tracing:
+                start, peak = tracemalloc.get_traced_memory()
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent[2] = max(parent[2], peak - parent[0])
+                tracemalloc.reset_peak()
+        # [start level, bytes left by nested spans, own peak so far, ms in nested spans]
+        entry = [start, 0, 0, 0.0]
+        self._stack.append(entry)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - t0) * 1000.0
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][3] += ms
+            peak = net = 0
+            with self._lock:
+                # stop() may have ended tracing while the span ran.
+                if tracing and self.active:
+                    end, top = tracemalloc.get_traced_memory()
+                    peak = max(entry[2], top - start)
+                    net = end - start
+                    if self._stack:
+                        self._stack[-1][1] += net
+                    tracemalloc.reset_peak()
+            self._frame.append((name, ms - entry[3], peak, net - entry[1]))
+
+    def wrap(self, stages):
+        """FrameGraph stage table whose stages each run in their own span."""
+        wrapped = self._wrapped.get(id(stages))
+        if wrapped is None:
+            wrapped = self._wrapped[id(stages)] = {name: self._wrap_stage(name, fn) for name, fn in stages.items()}
+        return wrapped
+
+    def _wrap_stage(self, name, fn):
+        def run(g):
+            with self.span(name):
+                return fn(g)
+        return run
+
+    def end_frame(self, state, derived=None, frame_ms=0.0):
+        with self._lock:
+            if self.active:
+                self._end_frame(state, derived, frame_ms)
+
+    def _end_frame(self, state, derived, frame_ms):
+        for name, ms, peak, net in self._frame:
+            entry = self._stages.get(name)
+            if entry is None:
+                # Complete before it is visible: stats() on a request thread divides by entry[0].
+                self._stages[name] = [1, ms, peak, peak, net]
+                continue
+            entry[0] += 1
+            entry[1] += ms
+            entry[2] += peak
+            entry[3] = max(entry[3], peak)
+            entry[4] += net
+        self._frame = []
+        self.frames += 1
+        self.frame_ms += frame_ms
+        self.buffers = buffer_bytes(state, derived)
+        for key, nbytes in self.buffers.items():
+            self.buffers_max[key] = max(self.buffers_max.get(key, 0), nbytes)
+        if self.trace_allocations and tracemalloc.is_tracing():
+            if self._traced_start is None:
+                self._traced_start = tracemalloc.get_traced_memory()[0]
+            now = time.perf_counter()
+            if now - self._last_snapshot >= self.snapshot_interval:
+                self._last_snapshot = now
+                self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        if self._baseline is None:
+            self._baseline = snapshot
+            return
+        top = []
+        for stat in snapshot.compare_to(self._baseline, 'lineno')[:MEMPROF_TOP_LINES]:
+            frame = stat.traceback[0]
+            top.append({
+                'where': f'{os.path.basename(frame.filename)}:{frame.lineno}',
+                'size_diff': stat.size_diff,
+                'count_diff': stat.count_diff,
+                'size': stat.size,
+                'count': stat.count,
+            })
+        self.top_growth = top
+
+    def stats(self):
+        frames = max(1, self.frames)
+        stages = {}
+        # Heaviest first (transient bytes, then time); list() snapshots the dict the camera thread grows.
+        for name, (n, ms, peak_sum, peak_max, net_sum) in sorted(
+                list(self._stages.items()), key=lambda item: (-item[1][2] / item[1][0], -item[1][1] / item[1][0])):
+            stages[name] = {
+                'frames': n,
+                'ms_mean': round(ms / n, 3),
+                'peak_bytes_mean': int(peak_sum / n),
+                'peak_bytes_max': peak_max,
+                'net_bytes_mean': int(net_sum / n),
+            }
+        generations = {}
+        pauses = total = 0
+        longest = 0.0
+        for gen, (count, seconds, max_seconds, collected) in self._gc.items():
+            generations[gen] = {
+                'pauses': count,
+                'total_ms': round(seconds * 1000.0, 3),
+                'max_ms': round(max_seconds * 1000.0, 3),
+                'collected': collected,
+            }
+            pauses += count
+            total += seconds
+            longest = max(longest, max_seconds)
+        report = {
+            'active': self.active,
+            'trace_allocations': self.trace_allocations,
+            'started_at': self.started_at,
+            'seconds': round(time.perf_counter() - self._t0, 3),
+            'frames': self.frames,
+            'frame_ms_mean': round(self.frame_ms / frames, 3),
+            'stages': stages,
+            'gc': {
+                'pauses': pauses,
+                'total_ms': round(total * 1000.0, 3),
+                'max_ms': round(longest * 1000.0, 3),
+                # Share of the loop's time spent stopped in the collector
+                'ms_per_frame': round(total * 1000.0 / frames, 4),
+                'generations': generations,
+            },
+            'buffers': self.buffers,
+            'buffers_max': self.buffers_max,
+            'rss_bytes': _rss_bytes(),
+        }
+        if self.trace_allocations and self.active and tracemalloc.is_tracing():
+            current = tracemalloc.get_traced_memory()[0]
+            report['traced_bytes'] = current
+            report['traced_growth_bytes'] = current - self._traced_start if self._traced_start is not None else 0
+            report['top_growth'] = self.top_growth
+        return report
@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+
+# Motion is estimated on a grayscale copy this wide: sparse LK flow at this
+# size costs well under a millisecond and still resolves sub-pixel shifts.
+MOTION_WIDTH = 160
+MOTION_MAX_CORNERS = 80
+MOTION_MIN_POINTS = 6
+# Features are picked in a band this wide (small-image pixels) around the mask,
+# so the silhouette's own corners are tracked as well as texture inside it.
+MOTION_REGION_MARGIN = 4
+# Shifts below this (full-resolution pixels) count as static.
+MOTION_MIN_SHIFT = 0.25
+
+
+class MotionEstimator:
+    """
+    Frame-to-frame shift of a masked region, for motion-compensated temporal
+    smoothing (see TemporalAccumulator.shift). Corners are picked on a small
+    grayscale copy of the previous frame inside the previous mask, tracked into
+    the current frame with pyramidal Lucas-Kanade and fitted with a RANSAC
+    similarity transform, which rejects static background corners caught at
+    the mask edge. estimate() returns the fit's translation at the centre of
+    its inliers as (dx, dy) full-frame pixels, or None when the region is
+    static or has too little to track.
+    """
+
+    def __init__(self, width=MOTION_WIDTH):
+        self.width = width
+        size = 2 * MOTION_REGION_MARGIN + 1
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+        self.clear()
+
+    def clear(self):
+        self._prev_gray = None
+        self._prev_region = None
+
+    def estimate(self, frame, mask):
+        """frame: BGR; mask: uint8 (255 = region) at frame size."""
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.width / w)
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        gray = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        region = cv2.dilate(cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST), self._kernel)
+        prev_gray, prev_region = self._prev_gray, self._prev_region
+        self._prev_gray, self._prev_region = gray, region
+        if prev_gray is None or prev_gray.shape != gray.shape:
+            return None
+
+        points = cv2.goodFeaturesToTrack(prev_gray, MOTION_MAX_CORNERS, 0.01, 3, mask=prev_region)
+        if points is None or len(points) < MOTION_MIN_POINTS:
+            return None
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, winSize=(15, 15),
+                                                    maxLevel=2)
+        tracked = status.ravel() == 1
+        if np.count_nonzero(tracked) < MOTION_MIN_POINTS:
+            return None
+        points = points[tracked].reshape(-1, 2)
+        matrix, inliers = cv2.estimateAffinePartial2D(points, moved[tracked].reshape(-1, 2),
+                                                      method=cv2.RANSAC, ransacReprojThreshold=1.0)
+        if matrix is None:
+            return None
+        centre = points[inliers.ravel() == 1].mean(axis=0)
+        dx, dy = (matrix[:, :2] @ centre + matrix[:, 2] - centre) / scale
+        if abs(dx) < MOTION_MIN_SHIFT and abs(dy) < MOTION_MIN_SHIFT:
+            return None
+        return float(dx), float(dy)
@@ -0,0 +1,110 @@
+import struct
+
+import cv2
+import numpy as np
+
+# output_mode: what the pipeline publishes on /video_feed (see compose_output)
+#   'composite' - the cloaked / replaced colour frame (default)
+#   'alpha'     - the matte alone: 255 where the background is shown through
+#   'bgra'      - the camera frame with the inverted matte as alpha, for compositors
+#   'debug'     - 2x2 grid of raw, preprocessed, matte and composite
+OUTPUT_MODES = ('composite', 'alpha', 'bgra', 'debug')
+# Modes that need the replacement background, blend and effects stages.
+COMPOSITE_MODES = ('composite', 'debug')
+
+# zlib level 1: mattes are mostly flat runs, so the fastest level already
+# gets most of the size reduction at a fraction of the default level's cost.
+PNG_COMPRESSION = 1
+DEBUG_LABELS = ('raw', 'preprocessed', 'matte', 'composite')
+
+# RLE layout: magic, uint16 height, uint16 width, uint32 run count, then the
+# run values (uint8) followed by the run lengths (uint32), little-endian.
+RLE_MAGIC = b'RLE1'
+_RLE_HEADER = struct.Struct('<4sHHI')
+
+
+def compose_output(mode, processed, raw, pp, matte):
+    """
+    Final frame for `mode`, in camera orientation. `matte` is the uint8
+    replaced-region mask (None when nothing was masked); `pp` may be at mask
+    resolution. 'composite' returns `processed` untouched.
+    """
+    if mode == 'composite':
+        return processed
+    h, w = raw.shape[:2]
+    if matte is None:
+        matte = np.zeros((h, w), np.uint8)
+    if mode == 'alpha':
+        return matte
+    if mode == 'bgra':
+        b, g, r = cv2.split(raw)
+        return cv2.merge((b, g, r, cv2.bitwise_not(matte)))
+    return debug_grid((raw, pp, matte, processed), w, h)
+
+
+def debug_grid(panes, width, height):
+    """Panes at half size in a 2x2 grid the size of one full frame."""
+    pw, ph = width // 2, height // 2
+    grid = np.zeros((ph * 2, pw * 2, 3), np.uint8)
+    for i, pane in enumerate(panes):
+        if pane.ndim == 2:
+            pane = cv2.cvtColor(pane, cv2.COLOR_GRAY2BGR)
+        y, x = (i // 2) * ph, (i % 2) * pw
+        grid[y:y + ph, x:x + pw] = cv2.resize(pane, (pw, ph), interpolation=cv2.INTER_AREA)
+    return grid
+
+
+def publish_copy(frame, mode, mirror):
+    """
+    The copy handed to viewers, mirrored if asked. A debug grid is mirrored
+    pane by pane, so panes keep their places, and labelled afterwards.
+    """
+    if mode != 'debug':
+        return cv2.flip(frame, 1) if mirror else frame.copy()
+    grid = frame.copy()
+    ph, pw = grid.shape[0] // 2, grid.shape[1] // 2
+    for i, label in enumerate(DEBUG_LABELS):
+        y, x = (i // 2) * ph, (i % 2) * pw
+        pane = grid[y:y + ph, x:x + pw]
+        if mirror:
+            pane[:] = pane[:, ::-1].copy()
+        cv2.putText(pane, label, (8, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1, cv2.LINE_AA)
+    return grid
+
+
+def as_bgr(frame):
+    """3-channel view of any published frame, for consumers that need colour (video files)."""
+    if frame.ndim == 2:
+        return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    if frame.shape[2] == 4:
+        return cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+    return frame
+
+
+def encode_frame(frame, jpeg_quality):
+    """(content type, bytes): JPEG for colour frames, fast PNG for mattes and BGRA."""
+    if frame.ndim == 2 or frame.shape[2] == 4:
+        ok, buffer = cv2.imencode('.png', frame, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+        return ('image/png', buffer.tobytes()) if ok else (None, None)
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    return ('image/jpeg', buffer.tobytes()) if ok else (None, None)
+
+
+def encode_rle(mask):
+    """Run-length encode a single-channel uint8 mask (layout above)."""
+    h, w = mask.shape
+    flat = np.ascontiguousarray(mask).ravel()
+    starts = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.append(starts, flat.size)).astype('<u4')
+    return (_RLE_HEADER.pack(RLE_MAGIC, h, w, len(starts)) + flat[starts].tobytes()
+            + lengths.tobytes())
+
+
+def decode_rle(data):
+    magic, h, w, n = _RLE_HEADER.unpack_from(data)
+    if magic != RLE_MAGIC:
+        raise ValueError('Not an RLE mask')
+    values = np.frombuffer(data, np.uint8, n, _RLE_HEADER.size)
+    lengths = np.frombuffer(data, '<u4', n, _RLE_HEADER.size + n)
+    return np.repeat(values, lengths).reshape(h, w)
@@ -1,63 +1,241 @@
+from collections import deque
+
 import cv2
 import numpy as np
 
+from .backend import out, upload, download
+from .config import BILATERAL_D_DEFAULT, BILATERAL_SIGMA_DEFAULT, CLAHE_CLIP_DEFAULT
+
+
+PREPROCESS_MODES = ('full', 'fast', 'off')
+# Ranges from which one bit-per-range table lookup beats an inRange per range
+# (about 0.9 ms flat against 0.3 ms per range at 640x480); a uint8 table holds 8.
+MASK_LUT_MIN_RANGES = 4
+MASK_LUT_MAX_RANGES = 8
+BILATERAL_DEFAULT = (BILATERAL_D_DEFAULT, BILATERAL_SIGMA_DEFAULT)
+
 
-def apply_effect(img, effect):
-    if effect == 'pixelate':
-        h, w = img.shape[:2]
-        temp = cv2.resize(img, (max(1, w // 16), max(1, h // 16)), interpolation=cv2.INTER_LINEAR)
-        return cv2.resize(temp, (w, h), interpolation=cv2.INTER_NEAREST)
-    if effect == 'blur':
-        return cv2.GaussianBlur(img, (21, 21), 0)
-    if effect == 'cartoon':
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        gray = cv2.medianBlur(gray, 7)
-        edges = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 9, 9
-        )
-        color = cv2.bilateralFilter(img, 9, 250, 250)
-        return cv2.bitwise_and(color, color, mask=edges)
-    return img
-
-
-def preprocess_frame(frame):
+def make_clahe(clip=CLAHE_CLIP_DEFAULT):
+    return cv2.createCLAHE(clipLimit=float(clip), tileGridSize=(8, 8))
+
+
+def preprocess_frame(frame, mode='full', ws=None, bilateral=BILATERAL_DEFAULT, clahe=None):
     """
     Advanced preprocessing for lighting and noise.
     1. Denoise with Bilateral Filter (preserves edges better than Gaussian)
     2. Normalize illumination using CLAHE in LAB color space
+    mode='fast' skips the bilateral filter (the dominant cost), 'off' skips both.
+    `bilateral` is (diameter, sigma), diameter 0 skipping the filter; `clahe`
+    is a make_clahe() object (default clip limit when None).
+    With a core.backend.Workspace every step writes into its pre-bound buffers
+    (and runs on UMat in umat mode); the result then lives in the workspace.
     """
-    denoised = cv2.bilateralFilter(frame, 9, 75, 75)
+    if ws is not None:
+        return _preprocess_ws(frame, mode, ws, bilateral, clahe or ws.clahe)
+    if mode == 'off':
+        return frame
+    d, sigma = bilateral
+    denoised = cv2.bilateralFilter(frame, d, sigma, sigma) if mode == 'full' and d > 0 else frame
     lab = cv2.cvtColor(denoised, cv2.COLOR_BGR2LAB)
     l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    cl = clahe.apply(l)
+    cl = (clahe or make_clahe()).apply(l)
     limg = cv2.merge((cl, a, b))
     enhanced = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
     return enhanced
 
 
-def refine_mask(mask):
+def _preprocess_ws(frame, mode, ws, bilateral, clahe):
+    shape = frame.shape
+    src = upload(ws, 'pp_src', frame)
+    if mode == 'off':
+        return src
+    d, sigma = bilateral
+    if mode == 'full' and d > 0:
+        src = cv2.bilateralFilter(src, d, sigma, sigma, dst=out(ws, 'pp_denoised', shape))
+    lab = cv2.cvtColor(src, cv2.COLOR_BGR2LAB, dst=out(ws, 'pp_lab', shape))
+    # Equalize L in place instead of split/merge of all three planes.
+    l_plane = cv2.extractChannel(lab, 0, dst=out(ws, 'pp_l', shape[:2]))
+    l_eq = clahe.apply(l_plane, dst=out(ws, 'pp_l_eq', shape[:2]))
+    cv2.insertChannel(l_eq, lab, 0)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=out(ws, 'pp_out', shape))
+
+
+def mask_kernels():
+    return (
+        cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)),
+        cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7)),
+    )
+
+
+def refine_mask(mask, kernels=None):
     """
     Advanced morphological cleanup for the binary cloak mask.
     Uses elliptical kernels for more organic shaping.
     """
-    kernel_small = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-    kernel_large = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+    kernel_small, kernel_large = kernels or mask_kernels()
     mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel_small, iterations=1)
     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel_large, iterations=2)
     mask = cv2.GaussianBlur(mask, (7, 7), 0)
     return mask
 
 
-def build_hsv_mask(hsv, color_ranges):
-    mask = np.zeros(hsv.shape[:2], np.uint8)
+def compile_hsv_bounds(color_ranges):
+    """Accepts {'hsv_min', 'hsv_max'} dicts or core.config.ColorRange tuples."""
+    bounds = []
     for cr in color_ranges:
-        _m = cv2.inRange(hsv, np.array(cr['hsv_min']), np.array(cr['hsv_max']))
-        mask = cv2.bitwise_or(mask, _m)
+        lo, hi = (cr['hsv_min'], cr['hsv_max']) if isinstance(cr, dict) else cr
+        bounds.append((np.array(lo, np.uint8), np.array(hi, np.uint8)))
+    return bounds
+
+
+def mask_from_bounds(hsv, bounds, ws=None, shape=None, name='mask'):
+    # shape: needed when hsv is a UMat (see core.backend)
+    shape = (shape or hsv.shape)[:2]
+    if not bounds:
+        return np.zeros(shape, np.uint8)
+    mask = None
+    for lo, hi in bounds:
+        if mask is None:
+            mask = cv2.inRange(hsv, lo, hi, dst=out(ws, name, shape))
+        else:
+            cv2.bitwise_or(mask, cv2.inRange(hsv, lo, hi, dst=out(ws, name + '_part', shape)), dst=mask)
     return mask
 
 
-def temporal_smooth_mask(mask_f, history, window):
+def hysteresis_mask(strong, weak):
+    """Weak pixels 8-connected to at least one strong pixel; uint8 host masks, strong within weak."""
+    n, labels = cv2.connectedComponents(weak, connectivity=8, ltype=cv2.CV_32S)
+    keep = np.zeros(n, np.uint8)
+    keep[labels[strong > 0]] = 255
+    keep[0] = 0
+    return np.take(keep, labels)
+
+
+def _range_key(cr):
+    lo, hi = (cr['hsv_min'], cr['hsv_max']) if isinstance(cr, dict) else cr
+    return tuple(int(v) for v in lo), tuple(int(v) for v in hi)
+
+
+def _weak_bounds(lo, hi, margin):
+    """Bounds widened by `margin` on S and V and by half of it on H (hue only spans 0-179)."""
+    widen = (margin // 2, margin, margin)
+    top = (179, 255, 255)
+    return (tuple(max(0, v - d) for v, d in zip(lo, widen)),
+            tuple(min(t, v + d) for v, d, t in zip(hi, widen, top)))
+
+
+class RangeMaskEngine:
+    """
+    Cloak mask for a list of HSV ranges, kept in step with the config one
+    range at a time: update() recompiles only the ranges that differ from the
+    previous call, so dragging one range's slider leaves the others' bounds
+    and table bits alone. mask() runs an inRange per range or, from
+    MASK_LUT_MIN_RANGES ranges on, a single lookup where bit i of each
+    channel's table marks range i, which costs the same for any number of
+    ranges. With a hysteresis margin every range also gets weak bounds,
+    widened by the margin; weak pixels count only when 8-connected to a
+    strong pixel. That keeps shadowed parts of the cloak and drops stray
+    background specks without another morphology pass.
+    """
+
+    def __init__(self):
+        self.ranges = ()
+        self.margin = 0
+        self._strong = []
+        self._weak = []
+        self._lut_strong = np.zeros((256, 1, 3), np.uint8)
+        self._lut_weak = np.zeros((256, 1, 3), np.uint8)
+        # Ranges compiled since creation: one per changed range, not per update
+        self.compiled = 0
+
+    def update(self, color_ranges, margin=0):
+        keys = tuple(_range_key(cr) for cr in color_ranges)
+        margin = max(0, int(margin))
+        previous = len(self.ranges)
+        if margin != self.margin:
+            # Every range's weak bounds move with the margin.
+            self.ranges = ()
+        for i, key in enumerate(keys):
+            if i >= len(self.ranges) or self.ranges[i] != key:
+                self._compile(i, key, margin)
+        for i in range(len(keys), previous):
+            self._set_bit(self._lut_strong, i, None)
+            self._set_bit(self._lut_weak, i, None)
+        del self._strong[len(keys):]
+        del self._weak[len(keys):]
+        self.ranges, self.margin = keys, margin
+        return self
+
+    def _compile(self, i, key, margin):
+        lo, hi = key
+        weak = _weak_bounds(lo, hi, margin)
+        bounds = ((np.array(lo, np.uint8), np.array(hi, np.uint8)),
+                  (np.array(weak[0], np.uint8), np.array(weak[1], np.uint8)))
+        for store, b in zip((self._strong, self._weak), bounds):
+            if i < len(store):
+                store[i] = b
+            else:
+                store.append(b)
+        self._set_bit(self._lut_strong, i, key)
+        self._set_bit(self._lut_weak, i, weak)
+        self.compiled += 1
+
+    @staticmethod
+    def _set_bit(lut, i, bounds):
+        if i >= MASK_LUT_MAX_RANGES:
+            return
+        bit = np.uint8(1 << i)
+        lut &= ~bit
+        if bounds is not None:
+            lo, hi = bounds
+            for c in range(3):
+                lut[lo[c]:hi[c] + 1, 0, c] |= bit
+
+    def _union(self, hsv, bounds, lut, ws, shape, name):
+        if not MASK_LUT_MIN_RANGES <= len(bounds) <= MASK_LUT_MAX_RANGES:
+            return mask_from_bounds(hsv, bounds, ws, shape, name)
+        h, s, v = cv2.split(cv2.LUT(hsv, lut, dst=out(ws, name + '_bits', shape + (3,))))
+        cv2.bitwise_and(h, s, dst=h)
+        cv2.bitwise_and(h, v, dst=h)
+        return cv2.compare(h, 0, cv2.CMP_GT, dst=out(ws, name, shape))
+
+    def mask(self, hsv, ws=None, shape=None):
+        # shape: needed when hsv is a UMat (see core.backend)
+        shape = tuple((shape or hsv.shape)[:2])
+        if not self._strong:
+            return np.zeros(shape, np.uint8)
+        strong = self._union(hsv, self._strong, self._lut_strong, ws, shape, 'mask')
+        if not self.margin:
+            return strong
+        weak = self._union(hsv, self._weak, self._lut_weak, ws, shape, 'mask_weak')
+        return upload(ws, 'mask_hysteresis', hysteresis_mask(download(strong), download(weak)))
+
+
+def build_hsv_mask(hsv, color_ranges):
+    return mask_from_bounds(hsv, compile_hsv_bounds(color_ranges))
+
+
+def shift_mask(mask, dx, dy):
+    """
+    Shift a 2-D array in place by whole pixels (dx, dy); the uncovered border
+    repeats the edge. Shifting several masks and their sum agrees exactly.
+    """
+    h, w = mask.shape[:2]
+    if dx > 0:
+        mask[:, dx:] = mask[:, :w - dx]
+        mask[:, :dx] = mask[:, dx:dx + 1]
+    elif dx < 0:
+        mask[:, :w + dx] = mask[:, -dx:]
+        mask[:, w + dx:] = mask[:, w + dx - 1:w + dx]
+    if dy > 0:
+        mask[dy:] = mask[:h - dy]
+        mask[:dy] = mask[dy:dy + 1]
+    elif dy < 0:
+        mask[:h + dy] = mask[-dy:]
+        mask[h + dy:] = mask[h + dy - 1:h + dy]
+
+
+def temporal_smooth_mask(mask_f, history, window, motion=None):
     if history is None:
         return mask_f
     try:
@@ -66,8 +244,141 @@ def temporal_smooth_mask(mask_f, history, window):
         window = 1
     if window <= 1:
         return mask_f
+    if motion is not None:
+        # Reference path: exact sub-pixel translation of every stored mask.
+        h, w = mask_f.shape[:2]
+        shift = np.float32([[1, 0, motion[0]], [0, 1, motion[1]]])
+        for i in range(len(history)):
+            history[i] = cv2.warpAffine(history[i], shift, (w, h), flags=cv2.INTER_LINEAR,
+                                        borderMode=cv2.BORDER_REPLICATE)
     history.append(mask_f)
     if len(history) < window:
         return mask_f
-    stacked = np.stack(list(history), axis=2)
+    stacked = np.stack(list(history)[-window:], axis=2)
     return np.mean(stacked, axis=2).astype(np.float32)
+
+
+class TemporalAccumulator:
+    """
+    uint8 temporal smoothing with a running uint16 sum.
+    Each push adds the new mask and subtracts the one leaving the window, so the
+    cost is constant in the window size and nothing is ever promoted to float.
+    12 * 255 = 3060 fits comfortably in uint16.
+    Pushed masks are copied into recycled slots, so callers may pass buffers
+    they overwrite next frame (see core.backend.Workspace).
+    With `motion` (dx, dy from core.motion) the history is first shifted into
+    the new frame's coordinates, so a moving cloak is averaged with itself
+    instead of ghosting. Shifts are whole pixels applied to every slot and to
+    the sum alike, so the sum stays exact; the fractions carry over to the
+    next shift, keeping the history within half a pixel of the true motion.
+    Not thread-safe: other threads reset it through core.state.reset_temporal_state.
+    """
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._masks = deque()
+        self._spare = []
+        self._sum = None
+        self._out = None
+        self._carry = (0.0, 0.0)
+
+    def clear(self):
+        self._masks.clear()
+        self._spare = []
+        self._sum = None
+        self._out = None
+        self._carry = (0.0, 0.0)
+
+    def __len__(self):
+        return len(self._masks)
+
+    @property
+    def nbytes(self):
+        total = sum(m.nbytes for m in self._masks)
+        return total + (self._sum.nbytes if self._sum is not None else 0)
+
+    def shift(self, dx, dy):
+        """Move the history by (dx, dy) pixels."""
+        masks, total = self._masks, self._sum
+        if not masks or total is None:
+            return
+        h, w = total.shape
+        fx, fy = self._carry[0] + dx, self._carry[1] + dy
+        ix, iy = int(round(fx)), int(round(fy))
+        if abs(ix) >= w or abs(iy) >= h:
+            self.clear()
+            return
+        self._carry = (fx - ix, fy - iy)
+        if ix or iy:
+            for mask in masks:
+                shift_mask(mask, ix, iy)
+            shift_mask(total, ix, iy)
+
+    def push(self, mask, window, motion=None):
+        window = max(1, min(int(window), self.maxlen))
+        if window <= 1:
+            self.clear()
+            return mask
+        if self._sum is None or self._sum.shape != mask.shape:
+            self.clear()
+            self._sum = np.zeros(mask.shape, np.uint16)
+            self._out = np.empty(mask.shape, np.uint8)
+        elif motion is not None:
+            self.shift(*motion)
+        slot = self._spare.pop() if self._spare else np.empty_like(mask)
+        np.copyto(slot, mask)
+        self._masks.append(slot)
+        cv2.add(self._sum, slot, dst=self._sum, dtype=cv2.CV_16U)
+        while len(self._masks) > window:
+            old = self._masks.popleft()
+            cv2.subtract(self._sum, old, dst=self._sum, dtype=cv2.CV_16U)
+            self._spare.append(old)
+        if len(self._masks) < window:
+            return mask
+        return cv2.convertScaleAbs(self._sum, dst=self._out, alpha=1.0 / len(self._masks))
+
+
+def to_alpha_u8(mask_f):
+    """float32 [0, 1] confidence mask -> uint8 alpha."""
+    return cv2.convertScaleAbs(mask_f, alpha=255.0)
+
+
+def combine_cloak_alpha(mask, person_mask, history, window, ws=None, motion=None):
+    """
+    uint8 cloak alpha: suppress the person area, then smooth over time.
+    mask, person_mask: uint8 (255 = cloak / person). history: TemporalAccumulator.
+    motion: optional (dx, dy) from core.motion to align the history first.
+    The history lives on the host, so in umat mode the mask is downloaded here.
+    """
+    if person_mask is not None:
+        shape = person_mask.shape
+        keep = cv2.bitwise_not(upload(ws, 'person', person_mask), dst=out(ws, 'person_inv', shape))
+        mask = cv2.multiply(mask, keep, dst=out(ws, 'cloak_keep', shape), scale=1.0 / 255)
+    return history.push(download(mask), window, motion)
+
+
+def combine_cloak_alpha_float(mask, person_mask_f, history, window, motion=None):
+    """Reference float32 version of combine_cloak_alpha (history: deque)."""
+    mask_f = mask.astype(np.float32) / 255.0
+    if person_mask_f is not None:
+        mask_f = mask_f * (1.0 - person_mask_f)
+    return temporal_smooth_mask(mask_f, history, window, motion)
+
+
+def blend_alpha(fg, bg, alpha, ws=None, shape=None):
+    """Per-pixel fg * (1 - a) + bg * a with a uint8 alpha (255 = bg), all in uint8."""
+    shape = shape or fg.shape
+    fg, bg, alpha = upload(ws, 'blend_fg', fg), upload(ws, 'blend_bg', bg), upload(ws, 'blend_alpha', alpha)
+    alpha3 = cv2.merge((alpha, alpha, alpha), dst=out(ws, 'blend_alpha3', shape))
+    result = cv2.multiply(bg, alpha3, dst=out(ws, 'blend_out', shape), scale=1.0 / 255)
+    inv = cv2.bitwise_not(alpha3, dst=out(ws, 'blend_inv', shape))
+    fg_part = cv2.multiply(fg, inv, dst=out(ws, 'blend_fg_part', shape), scale=1.0 / 255)
+    cv2.add(result, fg_part, dst=result)
+    return result
+
+
+def blend_alpha_float(fg, bg, alpha_f):
+    """Reference float32 version of blend_alpha (alpha_f in [0, 1])."""
+    alpha3 = np.stack([alpha_f, alpha_f, alpha_f], axis=2)
+    blended = fg.astype(np.float32) * (1 - alpha3) + bg.astype(np.float32) * alpha3
+    return np.clip(blended, 0, 255).astype(np.uint8)
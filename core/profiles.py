@@ -0,0 +1,130 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+_MISSING = object()
+
+
+class ProfileStore:
+    """
+    Profiles cached in memory and persisted to a JSON file.
+    Reads never touch the disk after the first load. Writes go to a temp file in
+    the same directory which is fsync'ed and atomically renamed over the old file,
+    so a crash or concurrent request can never leave a half-written profiles.json.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._profiles = None
+
+    def _load(self):
+        if self._profiles is None:
+            profiles = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path) as f:
+                        profiles = json.load(f)
+                except (OSError, ValueError) as err:
+                    print(f'[WARN] Could not read {self.path}: {err}')
+            self._profiles = profiles
+        return self._profiles
+
+    def _persist(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.profiles-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._profiles, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def all(self):
+        with self._lock:
+            return dict(self._load())
+
+    def get(self, name):
+        with self._lock:
+            return self._load().get(name)
+
+    def save(self, name, profile):
+        with self._lock:
+            profiles = self._load()
+            previous = profiles.get(name, _MISSING)
+            profiles[name] = profile
+            try:
+                self._persist()
+            except BaseException:
+                if previous is _MISSING:
+                    del profiles[name]
+                else:
+                    profiles[name] = previous
+                raise
+
+    def delete(self, name):
+        with self._lock:
+            profiles = self._load()
+            if name not in profiles:
+                return False
+            previous = profiles.pop(name)
+            try:
+                self._persist()
+            except BaseException:
+                profiles[name] = previous
+                raise
+            return True
+
+
+class SqliteProfileStore(ProfileStore):
+    """
+    Same interface backed by SQLite (WAL mode). Each save/delete touches only one
+    row, so write cost stays flat with thousands of profiles.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS profiles (name TEXT PRIMARY KEY, data TEXT NOT NULL)'
+        )
+        self._conn.commit()
+
+    def _load(self):
+        if self._profiles is None:
+            rows = self._conn.execute('SELECT name, data FROM profiles').fetchall()
+            self._profiles = {name: json.loads(data) for name, data in rows}
+        return self._profiles
+
+    def save(self, name, profile):
+        with self._lock:
+            self._load()
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO profiles (name, data) VALUES (?, ?)',
+                    (name, json.dumps(profile)),
+                )
+            self._profiles[name] = profile
+
+    def delete(self, name):
+        with self._lock:
+            profiles = self._load()
+            if name not in profiles:
+                return False
+            with self._conn:
+                self._conn.execute('DELETE FROM profiles WHERE name = ?', (name,))
+            del profiles[name]
+            return True
+
+
+def open_profile_store(path):
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SqliteProfileStore(path)
+    return ProfileStore(path)
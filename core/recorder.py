@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from .output import as_bgr
+
+RECORD_QUEUE_SIZE = 32
+
+
+class FrameRecorder:
+    """
+    Writes processed frames to disk on a background encoder thread.
+    The camera loop hands frames over with submit(), which never blocks: when the
+    bounded queue is full (disk or encoder falling behind) the frame is dropped and
+    counted instead of stalling the pipeline. Frames are timestamped on submit and
+    the file is held at a constant `fps`: a frame is repeated when the loop runs
+    slower and skipped when it runs faster, so playback matches real time. A new
+    segment file starts when the frame size changes and, optionally, every
+    `segment_seconds`.
+    """
+
+    def __init__(self, base_path, fps=20.0, fourcc='mp4v', segment_seconds=None,
+                 queue_size=RECORD_QUEUE_SIZE):
+        self.base_path = base_path
+        self.fps = float(fps)
+        self.fourcc = fourcc
+        self.segment_frames = int(segment_seconds * self.fps) if segment_seconds else None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.frames_submitted = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.frames_repeated = 0
+        self.frames_skipped = 0
+        self.bytes_written = 0
+        self.files = []
+        self.started_at = time.time()
+        self.error = None
+        self._closed_bytes = 0
+        self._thread.start()
+
+    def submit(self, frame):
+        self.frames_submitted += 1
+        try:
+            self._queue.put_nowait((time.monotonic(), frame))
+            return True
+        except queue.Full:
+            self.frames_dropped += 1
+            return False
+
+    def stop(self, timeout=5.0):
+        # The sentinel must get through even if the queue is full.
+        while True:
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.frames_dropped += 1
+                except queue.Empty:
+                    pass
+        self._thread.join(timeout)
+        return self.stats()
+
+    def stats(self):
+        return {
+            'recording': self._thread.is_alive(),
+            'files': list(self.files),
+            'frames_submitted': self.frames_submitted,
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'frames_repeated': self.frames_repeated,
+            'frames_skipped': self.frames_skipped,
+            'bytes_written': self.bytes_written,
+            'duration_s': round(time.time() - self.started_at, 2),
+            'error': self.error,
+        }
+
+    def _segment_path(self, index):
+        if self.segment_frames is None and index == 0:
+            return self.base_path
+        root, ext = os.path.splitext(self.base_path)
+        return f'{root}_{index:04d}{ext}'
+
+    def _open(self, index, frame):
+        path = self._segment_path(index)
+        h, w = frame.shape[:2]
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (w, h))
+        if not writer.isOpened():
+            raise IOError(f'Could not open video writer for {path}')
+        self.files.append(path)
+        return writer, path
+
+    def _close(self, writer, path):
+        writer.release()
+        if os.path.exists(path):
+            self._closed_bytes += os.path.getsize(path)
+        self.bytes_written = self._closed_bytes
+
+    def _run(self):
+        writer = path = size = None
+        segment = -1
+        in_segment = 0
+        # Output slots (1/fps apart) filled so far, counted from the first frame
+        t0 = None
+        slots = 0
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                ts, frame = item
+                if t0 is None:
+                    t0 = ts
+                # Slots that have started by this frame's capture time
+                due = int((ts - t0) * self.fps) + 1 - slots
+                if due <= 0:
+                    self.frames_skipped += 1
+                    continue
+                self.frames_repeated += due - 1
+                slots += due
+                frame = as_bgr(frame)
+                # VideoWriter silently rejects frames of another size: start a new file instead.
+                if writer is not None and frame.shape[:2] != size:
+                    self._close(writer, path)
+                    writer = None
+                for _ in range(due):
+                    if writer is not None and self.segment_frames and in_segment >= self.segment_frames:
+                        self._close(writer, path)
+                        writer = None
+                    if writer is None:
+                        segment += 1
+                        writer, path = self._open(segment, frame)
+                        size = frame.shape[:2]
+                        in_segment = 0
+                    writer.write(frame)
+                    in_segment += 1
+                    self.frames_written += 1
+                    if self.frames_written % 30 == 0 and os.path.exists(path):
+                        self.bytes_written = self._closed_bytes + os.path.getsize(path)
+        except Exception as err:
+            self.error = str(err)
+            print(f'[WARN] Recording stopped: {err}')
+        finally:
+            if writer is not None:
+                self._close(writer, path)
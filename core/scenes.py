@@ -37,6 +37,41 @@ def make_space(h=480, w=640):
     return img
 
 
+def make_space_animation(h=480, w=640, n_stars=300):
+    """
+    Returns a frame function for an animated space scene.
+    The gradient and planet are rendered once; each frame only copies the base
+    and stamps the drifting, twinkling stars with vectorized indexing.
+    """
+    base = np.zeros((h, w, 3), np.uint8)
+    t = np.linspace(0.0, 1.0, h, endpoint=False).reshape(h, 1)
+    base[:, :, 0] = (40 + 20 * t).astype(np.uint8)
+    base[:, :, 1] = (5 + 10 * t).astype(np.uint8)
+    base[:, :, 2] = (20 + 10 * t).astype(np.uint8)
+    rng = np.random.default_rng(42)
+    xs = rng.uniform(0, w, n_stars).astype(np.float32)
+    ys = rng.integers(0, h - 1, n_stars)
+    speed = rng.uniform(0.3, 2.0, n_stars).astype(np.float32)
+    phase = rng.uniform(0, 2 * np.pi, n_stars).astype(np.float32)
+    brightness = rng.integers(150, 255, n_stars).astype(np.float32)
+    planet = (w // 4, h // 3)
+
+    def frame(idx):
+        img = base.copy()
+        sx = ((xs + speed * idx) % (w - 1)).astype(np.intp)
+        level = brightness * (0.75 + 0.25 * np.sin(phase + idx * 0.15))
+        level = level.astype(np.uint8)[:, None]
+        for dy in (0, 1):
+            for dx in (0, 1):
+                img[ys + dy, sx + dx] = level
+        cv2.circle(img, planet, 55, (20, 60, 160), -1)
+        cv2.circle(img, planet, 55, (40, 80, 200), 3)
+        cv2.ellipse(img, planet, (85, 18), -20 + (idx * 0.2) % 360, 0, 360, (30, 70, 180), 3)
+        return img
+
+    return frame
+
+
 def make_forest(h=480, w=640):
     img = np.zeros((h, w, 3), np.uint8)
     for y in range(h // 3):
@@ -108,8 +143,18 @@ def get_scene_factories():
     }
 
 
-def generate_builtin_backgrounds(bg_dir, scene_factories):
+def get_animated_scene_factories():
+    return {
+        'space_live': make_space_animation,
+    }
+
+
+def generate_builtin_backgrounds(bg_dir, scene_factories, animated_factories=None):
     for name, fn in scene_factories.items():
         path = os.path.join(bg_dir, f'{name}.jpg')
         if not os.path.exists(path):
             cv2.imwrite(path, fn())
+    for name, fn in (animated_factories or {}).items():
+        path = os.path.join(bg_dir, f'{name}.jpg')
+        if not os.path.exists(path):
+            cv2.imwrite(path, fn()(0))
@@ -0,0 +1,240 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# Only stdlib + numpy here so external consumers can import (or copy) this
+# module without pulling in OpenCV or the rest of the pipeline.
+
+RING_MAGIC = b'CLKRING1'
+RING_SLOTS_DEFAULT = 4
+RING_PATH_DEFAULT = os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'invisible_cloak.ring')
+
+# File header: magic, slot count, slot payload bytes, layout generation, latest
+# published sequence. The generation is odd while the writer is re-laying out
+# the file for larger frames; readers remap whenever it changes.
+_HEADER = struct.Struct('<8sIIQQ')
+_HEADER_SIZE = 64
+_GENERATION_OFFSET = 16
+_LATEST_OFFSET = 24
+# Slot header: seq at write start, seq at write end, timestamp, height, width, channels.
+_SLOT = struct.Struct('<QQdIII')
+_SLOT_HEADER_SIZE = 64
+_SEQ = struct.Struct('<Q')
+
+
+def _slot_offset(index, slot_bytes):
+    return _HEADER_SIZE + index * (_SLOT_HEADER_SIZE + slot_bytes)
+
+
+class FrameRingWriter:
+    """
+    Publishes raw BGR frames into a memory-mapped ring for local consumers.
+
+    Each slot is guarded like a seqlock: the writer stamps `seq_begin`, copies
+    the pixels, then stamps `seq_end` and finally the header's `latest`. A reader
+    that sees begin == end == the sequence it asked for has a consistent frame.
+    The writer never waits for readers; slow readers simply skip frames. The
+    mapping is sized from the first frame; a larger frame later (alpha matte
+    to BGRA, a capture resolution increase) grows the file and bumps the
+    header's generation so readers remap before their next read.
+    """
+
+    def __init__(self, path=RING_PATH_DEFAULT, slots=RING_SLOTS_DEFAULT):
+        self.path = path
+        self.slots = max(2, int(slots))
+        self.slot_bytes = None
+        self.generation = 0
+        self.seq = 0
+        self.resizes = 0
+        self.bytes_written = 0
+        self.started_at = time.time()
+        self._file = None
+        self._map = None
+        self._closed = False
+        # write() runs on the camera thread, close() on a request thread.
+        self._lock = threading.Lock()
+
+    def _open(self, nbytes):
+        self._file = open(self.path, 'w+b')
+        self._layout(nbytes)
+
+    def _layout(self, nbytes):
+        self.slot_bytes = nbytes
+        size = _slot_offset(self.slots, nbytes)
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        for i in range(self.slots):
+            _SLOT.pack_into(self._map, _slot_offset(i, nbytes), 0, 0, 0.0, 0, 0, 0)
+        # Generation last: readers only trust the layout once it is even again.
+        _HEADER.pack_into(self._map, 0, RING_MAGIC, self.slots, nbytes, self.generation | 1, self.seq)
+        _SEQ.pack_into(self._map, _GENERATION_OFFSET, self.generation)
+
+    def _grow(self, nbytes):
+        # Odd generation: readers treat the ring as empty until the new layout is in place.
+        self.generation += 1
+        _SEQ.pack_into(self._map, _GENERATION_OFFSET, self.generation)
+        self._map.close()
+        self.generation += 1
+        self._layout(nbytes)
+        self.resizes += 1
+
+    def write(self, frame):
+        with self._lock:
+            if self._closed:
+                return None
+            return self._write(np.ascontiguousarray(frame))
+
+    def _write(self, frame):
+        if self._map is None:
+            self._open(frame.nbytes)
+        elif frame.nbytes > self.slot_bytes:
+            self._grow(frame.nbytes)
+        seq = self.seq + 1
+        off = _slot_offset(seq % self.slots, self.slot_bytes)
+        h, w = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        _SEQ.pack_into(self._map, off, seq)
+        data = off + _SLOT_HEADER_SIZE
+        self._map[data:data + frame.nbytes] = memoryview(frame).cast('B')
+        _SLOT.pack_into(self._map, off, seq, seq, time.time(), h, w, channels)
+        _SEQ.pack_into(self._map, _LATEST_OFFSET, seq)
+        self.seq = seq
+        self.bytes_written += frame.nbytes
+        return seq
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'slots': self.slots,
+            'slot_bytes': self.slot_bytes,
+            'generation': self.generation,
+            'resizes': self.resizes,
+            'frames_written': self.seq,
+            'bytes_written': self.bytes_written,
+            'duration_s': round(time.time() - self.started_at, 2),
+        }
+
+    def close(self, unlink=True):
+        with self._lock:
+            self._closed = True
+            if self._map is not None:
+                self._map.close()
+                self._file.close()
+                self._map = self._file = None
+        if unlink:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        return self.stats()
+
+
+class FrameRingReader:
+    """
+    Client for a FrameRingWriter ring, usable from any local process.
+
+        reader = FrameRingReader()
+        while True:
+            seq, ts, frame = reader.wait_next()
+
+    read()/wait_next() return a private copy. view() returns a zero-copy numpy
+    view into the mapping; it stays valid until the writer laps the ring, which
+    valid(seq) checks after use. When the writer grows the ring for larger
+    frames the reader remaps on its next call; views taken before that keep
+    the old mapping alive and simply stop being valid.
+    """
+
+    def __init__(self, path=RING_PATH_DEFAULT):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = None
+        self.generation = 0
+        if _HEADER.unpack_from(self._file.read(_HEADER.size))[0] != RING_MAGIC:
+            self._file.close()
+            raise ValueError(f'{path} is not a frame ring')
+        self.last_seq = 0
+        self.frames_torn = 0
+        self._remap()
+
+    def _remap(self):
+        self._release()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, self.slots, self.slot_bytes, self.generation, _ = _HEADER.unpack_from(self._map, 0)
+
+    def _current(self):
+        """True when the mapping matches the writer's layout, remapping if it moved on."""
+        generation = _SEQ.unpack_from(self._map, _GENERATION_OFFSET)[0]
+        if generation & 1:
+            return False
+        if generation != self.generation:
+            self._remap()
+            # The writer may have started another resize while we remapped.
+            return not self.generation & 1 and _slot_offset(self.slots, self.slot_bytes) <= len(self._map)
+        return True
+
+    def latest_seq(self):
+        return _SEQ.unpack_from(self._map, _LATEST_OFFSET)[0]
+
+    def view(self, seq=None):
+        """(seq, timestamp, array view) of frame `seq` (default: latest), or None if unavailable."""
+        if not self._current():
+            return None
+        seq = self.latest_seq() if seq is None else seq
+        if seq == 0:
+            return None
+        off = _slot_offset(seq % self.slots, self.slot_bytes)
+        begin, end, ts, h, w, channels = _SLOT.unpack_from(self._map, off)
+        if begin != seq or end != seq:
+            return None
+        shape = (h, w, channels) if channels > 1 else (h, w)
+        frame = np.frombuffer(self._map, np.uint8, h * w * channels, off + _SLOT_HEADER_SIZE).reshape(shape)
+        return seq, ts, frame
+
+    def valid(self, seq):
+        if _SEQ.unpack_from(self._map, _GENERATION_OFFSET)[0] != self.generation:
+            return False
+        begin, end = struct.unpack_from('<QQ', self._map, _slot_offset(seq % self.slots, self.slot_bytes))
+        return begin == end == seq
+
+    def read(self, seq=None):
+        """Consistent copy of frame `seq` (default: latest), or None if it was overwritten."""
+        got = self.view(seq)
+        if got is None:
+            return None
+        seq, ts, frame = got
+        frame = frame.copy()
+        if not self.valid(seq):
+            self.frames_torn += 1
+            return None
+        self.last_seq = seq
+        return seq, ts, frame
+
+    def wait_next(self, timeout=1.0, poll=0.002):
+        """Block until a frame newer than the last one read is available."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.latest_seq() > self.last_seq:
+                got = self.read()
+                if got is not None:
+                    return got
+            time.sleep(poll)
+        return None
+
+    def _release(self):
+        if self._map is None:
+            return
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # views from view() are still alive; the mapping goes with them
+        self._map = None
+
+    def close(self):
+        self._release()
+        self._file.close()
@@ -2,49 +2,137 @@ import os
 import threading
 from collections import deque
 
-EFFECTS = ['none', 'pixelate', 'blur', 'cartoon']
-PROFILES_FILE = 'profiles.json'
+from .capture import CaptureConfig
+from .broadcast import STREAM_IDLE_TIMEOUT_DEFAULT, STREAM_MAX_VIEWERS_DEFAULT
+from .config import ConfigStore, TEMPORAL_WINDOW_MAX
+from .governor import QualityGovernor
+from .background import BackgroundModel
+from .motion import MotionEstimator
+from .processing import TemporalAccumulator
+
+# A .db/.sqlite path switches the profile store to SQLite
+PROFILES_FILE = os.environ.get('CLOAK_PROFILES_FILE', 'profiles.json')
+# /video_feed limits: concurrent viewers, and seconds without a frame before a stream closes
+STREAM_MAX_VIEWERS = int(os.environ.get('CLOAK_MAX_VIEWERS', STREAM_MAX_VIEWERS_DEFAULT))
+STREAM_IDLE_TIMEOUT = float(os.environ.get('CLOAK_STREAM_IDLE_S', STREAM_IDLE_TIMEOUT_DEFAULT))
 BG_DIR = os.path.join('static', 'backgrounds')
 UPLOAD_DIR = os.path.join('static', 'uploads')
-TEMPORAL_WINDOW_DEFAULT = 4
-TEMPORAL_WINDOW_MAX = 12
+MAX_COLOR_RANGES = 6
+RECORD_DIR = 'recordings'
+TRACE_DIR = 'traces'
 
 
 def ensure_storage_dirs():
     os.makedirs(BG_DIR, exist_ok=True)
     os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(RECORD_DIR, exist_ok=True)
+    os.makedirs(TRACE_DIR, exist_ok=True)
 
 
 def create_state():
     return {
         'cap': None,
+        # Requested camera mode (core.capture.CaptureConfig); get_cap reopens the
+        # camera when this is replaced and records the negotiated mode in 'capture_info'.
+        'capture_config': CaptureConfig(),
+        'capture_info': None,
+        # Pipeline settings (mode, ranges, effect, ...) live in an immutable
+        # core.config.PipelineConfig published through this store.
+        'config': ConfigStore(),
         'background': None,
-        'running': False,
-        'color_ranges': [
-            {'hsv_min': [0, 0, 0], 'hsv_max': [0, 0, 0]},
-        ],
+        # Online update of 'background' (core.background.BackgroundModel)
+        'bg_model': BackgroundModel(),
         'active_range_idx': 0,
-        'effect': 'none',
         'frame': None,
         'raw_frame': None,
+        # Pipeline stages the last frame actually ran (core.frame_graph)
+        'stages_evaluated': [],
+        # Frames through the camera loop (for the fps metric)
+        'frames_processed': 0,
         'lock': threading.Lock(),
-        # bg_mode: 'invisible' | 'virtual' | 'smart'
-        'bg_mode': 'invisible',
         'virtual_bg': None,
         'virtual_bg_name': None,
-        'smart_bg_type': 'blur',
-        'solid_color': [0, 177, 64],
-        'smart_blur_amount': 25,
-        # Temporal smoothing and AI refinement
-        'mask_history': deque(maxlen=TEMPORAL_WINDOW_MAX),
-        'person_mask_history': deque(maxlen=TEMPORAL_WINDOW_MAX),
-        'temporal_window': TEMPORAL_WINDOW_DEFAULT,
-        'use_ai_refine': True,
+        # Animated/video background decoder (core.bg_stream.BackgroundStream)
+        'virtual_bg_stream': None,
+        # Temporal smoothing history: uint8 masks with uint16 running sums
+        'mask_history': TemporalAccumulator(TEMPORAL_WINDOW_MAX),
+        'person_mask_history': TemporalAccumulator(TEMPORAL_WINDOW_MAX),
+        # float32 history for the opt-in mask_precision='float' reference path
+        'mask_history_float': deque(maxlen=TEMPORAL_WINDOW_MAX),
+        'person_mask_history_float': deque(maxlen=TEMPORAL_WINDOW_MAX),
+        # Cloak / person motion for motion-compensated smoothing (cfg.motion_compensation)
+        'mask_motion': MotionEstimator(),
+        'person_mask_motion': MotionEstimator(),
+        # Temporal resets requested by request threads / applied by the frame loop
+        # (reset_temporal_state, apply_temporal_reset)
+        'temporal_reset': 0,
+        'temporal_reset_applied': 0,
+        # Adaptive quality: degrades pipeline stages to hold the target fps
+        'governor': QualityGovernor(),
+        # Active core.recorder.FrameRecorder, if any
+        'recorder': None,
+        # Pending core.calibration.CalibrationJob fed by the camera loop
+        'calibration': None,
+        # Active core.trace.TraceWriter (raw frames + control events), if any
+        'tracer': None,
+        # Active core.shm_ring.FrameRingWriter for local zero-copy consumers, if any
+        'shm_ring': None,
+        # core.broadcast.FrameBroadcaster shared by every /video_feed viewer
+        'broadcaster': None,
+        # Active core.memprof.MemoryProfiler (per-stage allocations, GC pauses), if any
+        'memprof': None,
+        # Callback(frame) for in-process front-ends (core.desktop.PipelineWorker), if any
+        'on_frame': None,
     }
 
 
+def claim_job(state, key, make_job):
+    """
+    Install make_job() under state[key] unless a job is already there.
+    Returns the new job, or None if the slot was taken; make_job is only
+    called once the slot is known to be free, so a request that loses the
+    race never opens files or starts threads.
+    """
+    with state['lock']:
+        if state[key] is not None:
+            return None
+        job = state[key] = make_job()
+        return job
+
+
+def release_job(state, key, job):
+    """Clear state[key] if it still holds `job` (a newer job is left alone)."""
+    with state['lock']:
+        if state[key] is job:
+            state[key] = None
+
+
+def take_job(state, key):
+    """Swap the job in state[key] out for None and return it (None if there was none)."""
+    with state['lock']:
+        job, state[key] = state[key], None
+        return job
+
+
 def reset_temporal_state(state):
-    if 'mask_history' in state:
-        state['mask_history'].clear()
-    if 'person_mask_history' in state:
-        state['person_mask_history'].clear()
+    """
+    Drop the smoothing histories and motion state before the next frame.
+    Safe from any thread: only the thread processing frames touches the
+    histories, in apply_temporal_reset().
+    """
+    tracer = state.get('tracer')
+    if tracer is not None:
+        tracer.note('reset_temporal')
+    with state['lock']:
+        state['temporal_reset'] += 1
+
+
+def apply_temporal_reset(state):
+    """Carry out pending reset_temporal_state() calls (frame-processing thread only)."""
+    requested = state['temporal_reset']
+    if requested == state['temporal_reset_applied']:
+        return
+    state['temporal_reset_applied'] = requested
+    for key in ('mask_history', 'person_mask_history', 'mask_history_float', 'person_mask_history_float',
+                'mask_motion', 'person_mask_motion'):
+        state[key].clear()
@@ -0,0 +1,384 @@
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from .calibration import BackprojectModel
+from .camera import derived_for, process_frame
+from .config import config_to_dict
+from .governor import LEVEL_SETTINGS
+from .state import create_state, reset_temporal_state
+
+TRACE_FORMAT_VERSION = 1
+TRACE_CHUNK_FRAMES = 32
+TRACE_MAX_SECONDS_DEFAULT = 30
+TRACE_MAX_SECONDS_MAX = 300
+
+FRAMES_FILE = 'frames.bin'
+META_FILE = 'frames_meta.npy'
+EVENTS_FILE = 'events.jsonl'
+MANIFEST_FILE = 'trace.json'
+
+# Per traced frame: capture time (s since trace start), the governor rung the
+# live loop ran at, and the live processing time.
+FRAME_META_DTYPE = np.dtype([('t', '<f8'), ('quality_level', '<i1'), ('frame_ms', '<f4')])
+
+class TraceWriter:
+    """
+    Records raw camera frames and control events for deterministic replay.
+
+    Layout of a trace directory:
+      frames.bin       raw uint8 BGR frames back to back, as captured (unmirrored);
+                       np.memmap-able as (frames, h, w, 3)
+      frames_meta.npy  FRAME_META_DTYPE record per frame
+      events.jsonl     one JSON object per event, keyed by the traced frame index
+      trace.json       manifest (shape, frame count, drops, ...)
+      *.png / *.npz    backgrounds and calibration models referenced by events
+
+    The camera loop copies each frame into a preallocated chunk; full chunks go
+    to a writer thread in one write() each. If the disk falls behind and no
+    chunk buffer is free, frames are dropped and counted, never waited on.
+    Config, background and calibration-model changes are detected in the camera
+    loop by identity, so they line up exactly with the frame that first saw them.
+    HTTP requests are logged with their latency through note_request().
+    """
+
+    def __init__(self, path, max_seconds=TRACE_MAX_SECONDS_DEFAULT, chunk_frames=TRACE_CHUNK_FRAMES,
+                 n_buffers=3):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.max_seconds = float(max_seconds)
+        self.chunk_frames = int(chunk_frames)
+        self.n_buffers = int(n_buffers)
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.shape = None
+        self.frames = 0
+        self.frames_dropped = 0
+        self.bytes_written = 0
+        self.events = 0
+        self.error = None
+        self.full = False
+
+        self._free = queue.Queue()
+        self._queue = queue.Queue()
+        self._chunk = None
+        self._chunk_len = 0
+        self._meta = []
+        self._in_frame = False
+        self._frame_lock = threading.Lock()
+        self._events_lock = threading.Lock()
+        self._events_file = open(os.path.join(path, EVENTS_FILE), 'w', encoding='utf-8')
+        self._frames_file = open(os.path.join(path, FRAMES_FILE), 'wb')
+        self._last = {'config': None, 'background': None, 'virtual_bg': None, 'model': None}
+        self._files = {'background': 0, 'virtual_bg': 0, 'model': 0}
+        self._model_file = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # ── camera thread ─────────────────────────────────────────────
+
+    def add_frame(self, raw, state, cfg, quality_level=0):
+        """Called once per captured frame, before processing. Returns the frame index or None."""
+        with self._frame_lock:
+            if self._closed or self.full:
+                return None
+            return self._add_frame(raw, state, cfg, quality_level)
+
+    def _add_frame(self, raw, state, cfg, quality_level):
+        t = time.perf_counter() - self._t0
+        if t > self.max_seconds:
+            self.full = True
+            return None
+        if self.shape is None:
+            self.shape = raw.shape
+        elif raw.shape != self.shape:
+            self.frames_dropped += 1
+            return None
+        if self._chunk is None:
+            self._chunk = self._take_buffer()
+            if self._chunk is None:
+                self.frames_dropped += 1
+                return None
+            self._chunk_len = 0
+
+        index = self.frames
+        self._sync_state(index, state, cfg)
+        np.copyto(self._chunk[self._chunk_len], raw)
+        self._chunk_len += 1
+        self._meta.append((t, quality_level, 0.0))
+        self._in_frame = True
+        self.frames += 1
+        if self._chunk_len == self.chunk_frames:
+            self._queue.put(('chunk', self._chunk, self._chunk_len))
+            self._chunk = None
+        return index
+
+    def end_frame(self, frame_ms):
+        with self._frame_lock:
+            if self._in_frame:
+                self._in_frame = False
+                t, level, _ = self._meta[-1]
+                self._meta[-1] = (t, level, frame_ms)
+
+    def _take_buffer(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        if self.n_buffers > 0:
+            self.n_buffers -= 1
+            return np.empty((self.chunk_frames,) + tuple(self.shape), np.uint8)
+        return None
+
+    def _sync_state(self, index, state, cfg):
+        model = cfg.backproject_model
+        if model is not None and model is not self._last['model']:
+            self._last['model'] = model
+            self._model_file = self._next_file('model', 'npz')
+            self._queue.put(('model', self._model_file, model))
+        if cfg is not self._last['config']:
+            self._last['config'] = cfg
+            self.note('config', frame=index, config=config_to_dict(cfg, self._model_file))
+        for key in ('background', 'virtual_bg'):
+            img = state.get(key)
+            if img is self._last[key]:
+                continue
+            self._last[key] = img
+            name = None
+            if img is not None:
+                name = self._next_file(key, 'png')
+                # Copied: the live background is updated in place (core.background).
+                self._queue.put(('image', name, img.copy()))
+            self.note(key, frame=index, file=name)
+
+    def _next_file(self, key, ext):
+        self._files[key] += 1
+        return f'{key}_{self._files[key]:04d}.{ext}'
+
+    # ── any thread ────────────────────────────────────────────────
+
+    def note(self, kind, frame=None, **data):
+        """Append an event. `frame` defaults to the next frame to be traced; dropped once the trace is full."""
+        if self._closed or self.full:
+            return
+        event = {
+            'kind': kind,
+            'frame': self.frames if frame is None else frame,
+            't': round(time.perf_counter() - self._t0, 6),
+            **data,
+        }
+        line = json.dumps(event, default=str)
+        with self._events_lock:
+            if not self._closed and not self.full:
+                self._events_file.write(line + '\n')
+                self.events += 1
+
+    def note_request(self, method, path, body, status_code, ms):
+        self.note('request', method=method, path=path, body=body, status_code=status_code, ms=round(ms, 3))
+
+    def stop(self, timeout=10.0):
+        with self._frame_lock:
+            if self._closed:
+                return self.stats()
+            self._closed = True
+            if self._chunk is not None and self._chunk_len:
+                self._queue.put(('chunk', self._chunk, self._chunk_len))
+                self._chunk = None
+        self._queue.put(None)
+        self._thread.join(timeout)
+        with self._events_lock:
+            self._events_file.close()
+        # A writer error can leave fewer frames on disk than were accepted.
+        frame_bytes = int(np.prod(self.shape)) if self.shape else 1
+        self.frames = min(self.frames, self.bytes_written // frame_bytes)
+        meta = np.array(self._meta[:self.frames], dtype=FRAME_META_DTYPE)
+        np.save(os.path.join(self.path, META_FILE), meta)
+        manifest = {
+            'format': TRACE_FORMAT_VERSION,
+            'started_at': self.started_at,
+            'shape': list(self.shape) if self.shape else None,
+            'dtype': 'uint8',
+            'frames': self.frames,
+            'frames_dropped': self.frames_dropped,
+            'chunk_frames': self.chunk_frames,
+            'events': self.events,
+            'duration_s': round(float(meta['t'][-1]) if len(meta) else 0.0, 3),
+        }
+        with open(os.path.join(self.path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        return self.stats()
+
+    def stats(self):
+        return {
+            'tracing': not self._closed and not self.full,
+            'path': self.path,
+            'frames': self.frames,
+            'frames_dropped': self.frames_dropped,
+            'events': self.events,
+            'bytes_written': self.bytes_written,
+            'duration_s': round(time.time() - self.started_at, 2),
+            'error': self.error,
+        }
+
+    # ── writer thread ─────────────────────────────────────────────
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                kind, a, b = item
+                if kind == 'chunk':
+                    data = memoryview(a[:b]).cast('B')
+                    self._frames_file.write(data)
+                    self.bytes_written += data.nbytes
+                    self._free.put(a)
+                elif kind == 'image':
+                    cv2.imwrite(os.path.join(self.path, a), b)
+                elif kind == 'model':
+                    np.savez(os.path.join(self.path, a), hist=b.hist, v_min=b.v_min, v_max=b.v_max,
+                             threshold=b.threshold)
+        except Exception as err:
+            self.error = str(err)
+            self.full = True
+            print(f'[WARN] Trace stopped: {err}')
+        finally:
+            self._frames_file.close()
+
+
+class TraceReader:
+    """Read-only view of a trace directory; frames are memory-mapped, not loaded."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.meta = np.load(os.path.join(path, META_FILE))
+        n = int(self.manifest['frames'])
+        shape = tuple(self.manifest['shape'] or (0, 0, 3))
+        if n:
+            self.frames = np.memmap(os.path.join(path, FRAMES_FILE), np.uint8, 'r', shape=(n,) + shape)
+        else:
+            self.frames = np.empty((0,) + shape, np.uint8)
+        with open(os.path.join(path, EVENTS_FILE), encoding='utf-8') as f:
+            self.events = [json.loads(line) for line in f if line.strip()]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def requests(self):
+        return [e for e in self.events if e['kind'] == 'request']
+
+    def load_image(self, name):
+        return cv2.imread(os.path.join(self.path, name)) if name else None
+
+    def load_model(self, name):
+        if not name:
+            return None
+        with np.load(os.path.join(self.path, name)) as data:
+            return BackprojectModel(data['hist'].copy(), data['v_min'], data['v_max'], data['threshold'])
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return {'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    values = np.asarray(values, np.float64)
+    return {
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'max': float(values.max()),
+    }
+
+
+def request_latency_summary(events):
+    by_path = {}
+    for e in events:
+        if e['kind'] == 'request':
+            by_path.setdefault(e['path'], []).append(e['ms'])
+    return {path: {'count': len(ms), **_percentiles(ms)} for path, ms in sorted(by_path.items())}
+
+
+def replay_trace(reader, segmentor=None, mp=None, mediapipe_available=False, realtime=False,
+                 recorded_quality=True, on_frame=None):
+    """
+    Feed a trace back through camera.process_frame on a fresh state.
+    Events are applied before the frame index they were recorded at. With
+    `recorded_quality` each frame runs at the governor rung the live loop used,
+    so timings compare like for like; `realtime` paces frames at their original
+    timestamps instead of running flat out. Returns per-frame processing times
+    and a CRC32 digest of every output frame for cross-build comparison.
+    Video backgrounds replay as the still image the state held at the time.
+    """
+    state = create_state()
+    store = state['config']
+    events = sorted(reader.events, key=lambda e: e['frame'])
+    models = {}
+    derived = None
+    ev = 0
+    times_ms = np.zeros(len(reader), np.float32)
+    digests = []
+    t_wall = time.perf_counter()
+
+    for i in range(len(reader)):
+        while ev < len(events) and events[ev]['frame'] <= i:
+            event = events[ev]
+            ev += 1
+            kind = event['kind']
+            if kind == 'config':
+                changes = dict(event['config'])
+                model_file = changes.pop('backproject_model', None)
+                if model_file and model_file not in models:
+                    models[model_file] = reader.load_model(model_file)
+                store.update(backproject_model=models.get(model_file), **changes)
+            elif kind in ('background', 'virtual_bg'):
+                state[kind] = reader.load_image(event.get('file'))
+            elif kind == 'reset_temporal':
+                reset_temporal_state(state)
+
+        if realtime:
+            delay = float(reader.meta['t'][i]) - (time.perf_counter() - t_wall)
+            if delay > 0:
+                time.sleep(delay)
+        level = int(reader.meta['quality_level'][i]) if recorded_quality else 0
+        quality = LEVEL_SETTINGS[max(0, min(level, len(LEVEL_SETTINGS) - 1))]
+
+        t0 = time.perf_counter()
+        cfg = store.current
+        derived = derived_for(cfg, derived)
+        out, _ = process_frame(state, np.asarray(reader.frames[i]), cfg, derived, quality,
+                               segmentor, mp, mediapipe_available)
+        times_ms[i] = (time.perf_counter() - t0) * 1000.0
+        digests.append(zlib.crc32(np.ascontiguousarray(out)) & 0xFFFFFFFF)
+        if on_frame is not None:
+            on_frame(i, out)
+
+    return {
+        'frames': len(reader),
+        'replay_ms': _percentiles(times_ms),
+        'live_ms': _percentiles(reader.meta['frame_ms']),
+        'requests': request_latency_summary(reader.events),
+        'frame_ms': times_ms.tolist(),
+        'digests': digests,
+    }
+
+
+def compare_replays(current, baseline):
+    """Output and timing differences between two replay_trace() results of the same trace."""
+    n = min(len(current['digests']), len(baseline['digests']))
+    mismatched = [i for i in range(n) if current['digests'][i] != baseline['digests'][i]]
+    return {
+        'frames_compared': n,
+        'frames_differing': len(mismatched),
+        'first_difference': mismatched[0] if mismatched else None,
+        'replay_p50_delta_ms': current['replay_ms']['p50'] - baseline['replay_ms']['p50'],
+        'replay_p95_delta_ms': current['replay_ms']['p95'] - baseline['replay_ms']['p95'],
+    }
@@ -0,0 +1,236 @@
+import hashlib
+import itertools
+import os
+import queue
+import struct
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from .bg_stream import BackgroundStream, is_video_file
+
+# Decoded, pre-scaled upload images kept for instant switching.
+UPLOAD_CACHE_SIZE = 8
+# Finished jobs remembered for /upload_status.
+UPLOAD_JOBS_KEPT = 32
+# Uploads listed by /uploads.
+UPLOAD_RECENT = 12
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+# JPEG start-of-frame markers (all but DHT, JPG and DAC, which share the range).
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def image_size(data):
+    """(width, height) from a PNG or JPEG header without decoding, else None."""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in _JPEG_SOF:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+    return None
+
+
+def _url(path):
+    return f'/static/uploads/{os.path.basename(path)}'
+
+
+def decode_scaled(data, size):
+    """
+    Decode image bytes straight to `size` (w, h). JPEGs are decoded at 1/2, 1/4
+    or 1/8 scale when that still covers `size`, which skips most of the IDCT
+    work; whatever is left is an INTER_AREA resize. None if undecodable.
+    """
+    flag = cv2.IMREAD_COLOR
+    dims = image_size(data)
+    if dims is not None:
+        for factor, reduced in _REDUCED_FLAGS:
+            if dims[0] // factor >= size[0] and dims[1] // factor >= size[1]:
+                flag = reduced
+                break
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if image is None:
+        return None
+    if (image.shape[1], image.shape[0]) != tuple(size):
+        image = cv2.resize(image, tuple(size), interpolation=cv2.INTER_AREA)
+    return image
+
+
+class UploadProcessor:
+    """
+    Turns uploaded backgrounds into ready-to-composite frames on a worker
+    thread, so the request only hands over the bytes. Uploads are identified
+    by content hash: a file already on disk is not written again, and the last
+    UPLOAD_CACHE_SIZE decoded images (at the size they were scaled to) stay
+    in an LRU, so switching back to a recent upload needs no decode.
+    `on_ready(entry)` runs on the worker for each finished background; entry
+    has 'id', 'name', 'url', 'image' and, for videos, 'stream'.
+    """
+
+    def __init__(self, upload_dir, on_ready, cache_size=UPLOAD_CACHE_SIZE):
+        self.upload_dir = upload_dir
+        self.on_ready = on_ready
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._jobs = OrderedDict()
+        self._cache = OrderedDict()
+        self._files = OrderedDict()
+        self.cache_hits = 0
+        self.decodes = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, filename, data, size):
+        """Queue an upload; returns a job id for job()."""
+        return self._add_job({'filename': filename, 'data': data, 'size': tuple(size)})
+
+    def select(self, upload_id, size):
+        """Switch to a recent upload: applied at once from the LRU, else re-decoded from disk."""
+        size = tuple(size)
+        with self._lock:
+            entry = self._cache.get((upload_id, size))
+            if entry is not None:
+                self._cache.move_to_end((upload_id, size))
+                self.cache_hits += 1
+            known = self._files.get(upload_id)
+            if known is not None:
+                self._files.move_to_end(upload_id)
+        if entry is not None:
+            self.on_ready(entry)
+            return {'status': 'ok', 'id': upload_id, 'name': entry['name'], 'url': entry['url']}
+        if known is None:
+            return {'status': 'error', 'message': 'Unknown upload'}
+        job_id = self._add_job({'filename': known['name'], 'path': known['path'], 'id': upload_id,
+                                'size': size})
+        return {'status': 'pending', 'job': job_id}
+
+    def job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job['result'])
+
+    def recent(self):
+        """Uploads on disk, most recently used first."""
+        with self._lock:
+            items = list(reversed(self._files.items()))[:UPLOAD_RECENT]
+        return [{'id': upload_id, 'name': f['name'], 'url': f['url'], 'animated': f['animated']}
+                for upload_id, f in items]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached': len(self._cache),
+                'cache_size': self.cache_size,
+                'cache_hits': self.cache_hits,
+                'decodes': self.decodes,
+                'pending': self._queue.qsize(),
+            }
+
+    def _add_job(self, job):
+        with self._lock:
+            job_id = next(self._ids)
+            job['result'] = {'status': 'pending', 'job': job_id}
+            self._jobs[job_id] = job
+            while len(self._jobs) > UPLOAD_JOBS_KEPT:
+                self._jobs.popitem(last=False)
+        self._queue.put(job)
+        return job_id
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                result = self._process(job)
+            except Exception as err:
+                result = {'status': 'error', 'message': str(err)}
+            result['job'] = job['result']['job']
+            with self._lock:
+                job['result'] = result
+                job.pop('data', None)
+
+    def _process(self, job):
+        name, size, data = job['filename'], job['size'], job.get('data')
+        if data is not None:
+            upload_id = hashlib.sha1(data).hexdigest()[:16]
+            path = None
+        else:
+            upload_id, path = job['id'], job['path']
+
+        if is_video_file(name):
+            path = path or self._store(upload_id, name, data)
+            stream = BackgroundStream(path, size=size).start()
+            poster = stream.poster()
+            if poster is None:
+                stream.stop()
+                self._forget(upload_id)
+                return {'status': 'error', 'message': 'Invalid video file'}
+            entry = {'id': upload_id, 'name': name, 'url': _url(path), 'image': poster, 'stream': stream}
+            self.on_ready(entry)
+            return {'status': 'ok', 'id': upload_id, 'name': name, 'url': entry['url'], 'animated': True}
+
+        with self._lock:
+            entry = self._cache.get((upload_id, size))
+            if entry is not None:
+                self._cache.move_to_end((upload_id, size))
+                self.cache_hits += 1
+        if entry is None:
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            image = decode_scaled(data, size)
+            if image is None:
+                return {'status': 'error', 'message': 'Invalid image file'}
+            # Only images that decode are kept on disk.
+            path = path or self._store(upload_id, name, data)
+            entry = {'id': upload_id, 'name': name, 'url': _url(path), 'image': image}
+            with self._lock:
+                self.decodes += 1
+                self._cache[(upload_id, size)] = entry
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        else:
+            if path is None:
+                self._store(upload_id, name, data)
+            entry = dict(entry, name=name)
+        self.on_ready(entry)
+        return {'status': 'ok', 'id': upload_id, 'name': name, 'url': entry['url']}
+
+    def _forget(self, upload_id):
+        with self._lock:
+            known = self._files.pop(upload_id, None)
+        if known is not None and os.path.exists(known['path']):
+            os.remove(known['path'])
+
+    def _store(self, upload_id, name, data):
+        """Write the upload once per content hash; the same bytes reuse the existing file."""
+        with self._lock:
+            known = self._files.get(upload_id)
+        if known is not None and os.path.exists(known['path']):
+            path = known['path']
+        else:
+            root, ext = os.path.splitext(name)
+            path = os.path.join(self.upload_dir, f'{root}_{upload_id[:8]}{ext}')
+            with open(path, 'wb') as f:
+                f.write(data)
+        with self._lock:
+            self._files.pop(upload_id, None)
+            self._files[upload_id] = {'name': name, 'path': path, 'url': _url(path), 'animated': is_video_file(name)}
+        return path
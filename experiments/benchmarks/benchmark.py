@@ -0,0 +1,295 @@
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+from collections import deque
+import numpy as np
+import cv2
+
+# Add repository root to path so we can import core modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from core.effects import EFFECT_REGISTRY, apply_effect
+from core.shm_ring import FrameRingWriter, FrameRingReader
+from core.backend import COMPUTE_BACKENDS, Workspace, opencl_available, download
+from core.mask_refine import refine_mask_fast, morph_kernels
+from core.camera import derived_for, process_frame
+from core.memprof import MemoryProfiler
+from core.state import create_state
+from core.processing import (
+    TemporalAccumulator,
+    preprocess_frame,
+    compile_hsv_bounds,
+    mask_from_bounds,
+    combine_cloak_alpha,
+    combine_cloak_alpha_float,
+    blend_alpha,
+    blend_alpha_float,
+)
+
+
+def make_test_frame(width=640, height=480, seed=0):
+    """Textured frame with a green 'cloak' disc so filters do realistic work."""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (7, 7), 0)
+    cv2.circle(frame, (width // 2, height // 2), min(width, height) // 4, (20, 220, 20), -1)
+    mask = np.zeros((height, width), np.uint8)
+    cv2.circle(mask, (width // 2, height // 2), min(width, height) // 4, 255, -1)
+    return frame, mask
+
+
+def time_ms(fn, repeats):
+    fn()  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - t0) * 1000.0 / repeats
+
+
+def bench_effects(frame, mask, repeats):
+    """Per-effect timings: reference vs fast path, full frame vs masked region."""
+    results = {}
+    for name, entry in EFFECT_REGISTRY.items():
+        if name == 'none':
+            continue
+        results[name] = {
+            'cost': entry.cost,
+            'reference_ms': time_ms(lambda: apply_effect(frame, name, fast=False), repeats),
+            'fast_ms': time_ms(lambda: apply_effect(frame, name), repeats),
+            'fast_masked_ms': time_ms(lambda: apply_effect(frame, name, mask), repeats),
+        }
+    return results
+
+
+def _history_bytes(history):
+    if isinstance(history, TemporalAccumulator):
+        return history.nbytes
+    return sum(m.nbytes for m in history)
+
+
+def bench_mask_precision(frame, mask, repeats, window=8):
+    """uint8 vs float32 mask chain: person suppress, temporal smoothing, blend."""
+    bg = cv2.flip(frame, 0)
+    person_f = np.zeros(mask.shape, np.float32)
+    cv2.rectangle(person_f, (0, 0), (mask.shape[1] // 3, mask.shape[0]), 1.0, -1)
+    person_u8 = (person_f * 255).astype(np.uint8)
+
+    def run_u8(history):
+        alpha = combine_cloak_alpha(mask, person_u8, history, window)
+        return blend_alpha(frame, bg, alpha)
+
+    def run_float(history):
+        alpha = combine_cloak_alpha_float(mask, person_f, history, window)
+        return blend_alpha_float(frame, bg, alpha)
+
+    results = {}
+    for name, fn, history in (
+        ('uint8', run_u8, TemporalAccumulator(window)),
+        ('float32', run_float, deque(maxlen=window)),
+    ):
+        for _ in range(window):
+            fn(history)  # fill the window so every timed frame averages
+        ms = time_ms(lambda: fn(history), repeats)
+        tracemalloc.start()
+        fn(history)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {
+            'ms': ms,
+            'peak_alloc_bytes_per_frame': peak,
+            'history_bytes': _history_bytes(history),
+        }
+    results['savings'] = {
+        'peak_alloc_ratio': results['float32']['peak_alloc_bytes_per_frame']
+        / max(1, results['uint8']['peak_alloc_bytes_per_frame']),
+        'history_ratio': results['float32']['history_bytes'] / max(1, results['uint8']['history_bytes']),
+    }
+    return results
+
+
+def _ring_consumer(path, n_frames, result):
+    reader = FrameRingReader(path)
+    got = 0
+    t0 = time.perf_counter()
+    while got < n_frames and reader.wait_next(timeout=2.0) is not None:
+        got += 1
+    result.put((got, time.perf_counter() - t0, reader.frames_torn))
+    reader.close()
+
+
+def bench_shm_ring(frame, mask, repeats, n_frames=300):
+    """Raw-frame ring vs MJPEG: per-frame producer/consumer cost and cross-process throughput."""
+    path = os.path.join(tempfile.gettempdir(), f'bench_{os.getpid()}.ring')
+    writer = FrameRingWriter(path, slots=4)
+    writer.write(frame)
+    reader = FrameRingReader(path)
+    results = {
+        'jpeg': {
+            'encode_ms': time_ms(lambda: cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85]), repeats),
+        },
+        'ring': {
+            'write_ms': time_ms(lambda: writer.write(frame), repeats),
+            'read_copy_ms': time_ms(lambda: reader.read(), repeats),
+            'view_ms': time_ms(lambda: reader.view(), repeats),
+        },
+    }
+    jpg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])[1]
+    results['jpeg']['decode_ms'] = time_ms(lambda: cv2.imdecode(jpg, cv2.IMREAD_COLOR), repeats)
+    reader.close()
+
+    # A separate process reads while this one publishes as fast as it can.
+    result = multiprocessing.Queue()
+    consumer = multiprocessing.Process(target=_ring_consumer, args=(path, n_frames, result))
+    consumer.start()
+    time.sleep(0.5)
+    t0 = time.perf_counter()
+    while consumer.is_alive() and time.perf_counter() - t0 < 10.0:
+        writer.write(frame)
+        time.sleep(0.001)
+    got, elapsed, torn = result.get(timeout=5.0)
+    consumer.join()
+    writer.close()
+    results['cross_process'] = {
+        'frames_read': got,
+        'fps': got / elapsed if elapsed else 0.0,
+        'frames_torn': torn,
+    }
+    return results
+
+
+def bench_compute_backend(frame, mask, repeats, window=4):
+    """numpy vs pre-bound dst buffers vs UMat for the cloak chain, stage by stage."""
+    bg = cv2.flip(frame, 0)
+    shape = frame.shape
+    bounds = compile_hsv_bounds([{'hsv_min': [35, 80, 80], 'hsv_max': [85, 255, 255]}])
+    kernels = morph_kernels()
+    person = np.zeros(shape[:2], np.uint8)
+    cv2.rectangle(person, (0, 0), (shape[1] // 3, shape[0]), 255, -1)
+
+    results = {'opencl_available': opencl_available()}
+    for backend in COMPUTE_BACKENDS:
+        ws = None if backend == 'numpy' else Workspace(backend)
+        history = TemporalAccumulator(window)
+
+        def preprocess():
+            return preprocess_frame(frame, 'full', ws)
+
+        pp = preprocess()
+
+        def hsv_mask():
+            hsv = cv2.cvtColor(pp, cv2.COLOR_BGR2HSV, dst=ws.buf('hsv', shape) if ws else None)
+            return mask_from_bounds(hsv, bounds, ws, shape)
+
+        raw_mask = hsv_mask()
+
+        def refine():
+            return refine_mask_fast(raw_mask, 3, 0.5, kernels, ws, shape)
+
+        refined = refine()
+
+        def composite():
+            alpha = combine_cloak_alpha(refined, person, history, window, ws)
+            return download(blend_alpha(frame, bg, alpha, ws, shape))
+
+        def chain():
+            p = preprocess_frame(frame, 'full', ws)
+            hsv = cv2.cvtColor(p, cv2.COLOR_BGR2HSV, dst=ws.buf('hsv', shape) if ws else None)
+            m = refine_mask_fast(mask_from_bounds(hsv, bounds, ws, shape), 3, 0.5, kernels, ws, shape)
+            alpha = combine_cloak_alpha(m, person, history, window, ws)
+            return download(blend_alpha(frame, bg, alpha, ws, shape))
+
+        results[backend] = {
+            'preprocess_ms': time_ms(preprocess, repeats),
+            'hsv_mask_ms': time_ms(hsv_mask, repeats),
+            'refine_ms': time_ms(refine, repeats),
+            'composite_ms': time_ms(composite, repeats),
+            'chain_ms': time_ms(chain, repeats),
+            'workspace_bytes': ws.nbytes if ws else 0,
+        }
+        if backend == 'umat' and not results['opencl_available']:
+            # Still measured: without an OpenCL device UMat runs on the CPU.
+            results[backend]['note'] = 'no OpenCL runtime; T-API CPU fallback'
+    return results
+
+
+def bench_memory(frame, mask, repeats, window=8):
+    """Per-stage transient/retained bytes, GC pauses and buffer sizes of process_frame, uint8 vs float masks."""
+    results = {}
+    for precision in ('uint8', 'float'):
+        state = create_state()
+        state['background'] = cv2.flip(frame, 0)
+        cfg = state['config'].update(
+            running=True, mask_precision=precision, temporal_window=window,
+            color_ranges=[{'hsv_min': [35, 80, 80], 'hsv_max': [85, 255, 255]}])
+        derived = derived_for(cfg)
+        for _ in range(window):
+            process_frame(state, frame, cfg, derived)  # fill the history and the workspace
+        profiler = state['memprof'] = MemoryProfiler(snapshot_interval=3600)
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            with profiler.span('compose'):
+                process_frame(state, frame, cfg, derived)
+            profiler.end_frame(state, derived, (time.perf_counter() - t0) * 1000.0)
+        stats = profiler.stop()
+        for stage, row in stats['stages'].items():
+            results[f'{precision}/{stage}'] = row
+        results[f'{precision}/gc'] = {k: v for k, v in stats['gc'].items() if k != 'generations'}
+        results[f'{precision}/buffers'] = stats['buffers']
+    return results
+
+
+SECTIONS = {
+    'effects': bench_effects,
+    'mask_precision': bench_mask_precision,
+    'shm_ring': bench_shm_ring,
+    'compute_backend': bench_compute_backend,
+    'memory': bench_memory,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Invisible Cloak pipeline benchmarks')
+    parser.add_argument('--sections', default=','.join(SECTIONS), help='comma-separated sections to run')
+    parser.add_argument('--size', default='640x480', help='frame size WxH')
+    parser.add_argument('--repeats', type=int, default=30)
+    parser.add_argument('--out', help='optional JSON output path')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    frame, mask = make_test_frame(width, height)
+
+    report = {'size': [width, height], 'opencv': cv2.__version__}
+    for section in args.sections.split(','):
+        section = section.strip()
+        if section not in SECTIONS:
+            parser.error(f'unknown section: {section}')
+        print(f'Running {section}...')
+        report[section] = SECTIONS[section](frame, mask, args.repeats)
+
+    print('\n================ BENCHMARK SUMMARY ================')
+    for section, rows in report.items():
+        if not isinstance(rows, dict):
+            continue
+        print(f'\n{section.upper()}')
+        for name, metrics in rows.items():
+            if isinstance(metrics, dict):
+                values = ', '.join(
+                    f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}' for k, v in metrics.items()
+                )
+                print(f'  {name}: {values}')
+            else:
+                print(f'  {name}: {metrics}')
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'\nResults written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,87 +1,136 @@
 import os
 import sys
 import time
-import numpy as np
-import cv2
 import json
+import argparse
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
 
 # Add parent directory to path so we can import core modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
-from core.processing import preprocess_frame, refine_mask, build_hsv_mask, temporal_smooth_mask
+from core.backend import make_workspace
+from core.config import PipelineConfig, TEMPORAL_WINDOW_MAX
+from core.mask_refine import morph_kernels, refine_mask_fast
+from core.motion import MotionEstimator
+from core.processing import (
+    preprocess_frame,
+    refine_mask,
+    build_hsv_mask,
+    temporal_smooth_mask,
+    make_clahe,
+    combine_cloak_alpha,
+    RangeMaskEngine,
+    TemporalAccumulator,
+)
+
+CONDITIONS = ('perfect', 'shadow', 'noise', 'temporal', 'moving')
+METHODS = ('baseline', 'him', 'live', 'live_mc', 'live_hyst')
 
-def generate_synthetic_test_suite(num_frames=30):
+# Green color range: H in [35, 85], S in [80, 255], V in [80, 255]
+COLOR_RANGES = [{'hsv_min': [35, 80, 80], 'hsv_max': [85, 255, 255]}]
+
+BG_BGR = (40, 60, 80)      # brown / wooden background
+CLOAK_BGR = (20, 220, 20)  # bright green cloak
+
+
+def iter_condition_frames(condition, num_frames=30, width=640, height=480, seed=0):
     """
-    Generates a synthetic sequence of frames simulating a green cloak with different DIP challenges:
-    1. Perfect conditions (constant green, clean background)
-    2. Shadow/Highlight (illumination gradient across the frame)
-    3. Sensor Noise (additive Gaussian noise)
-    4. Motion & Temporal Jitter (flicker on mask edges)
+    Yields (frame, gt_mask) for one synthetic sequence simulating a green cloak
+    under a DIP challenge:
+    1. perfect:  constant green, clean background
+    2. shadow:   illumination gradient across the frame
+    3. noise:    additive Gaussian sensor noise (std 25)
+    4. temporal: edge jitter (radius flicker) plus light noise
+    5. moving:   a folded (textured) cloak sweeping across a textured
+                 background, up to ~13 px per frame at 480 p
+    Frames are produced one at a time so sequences of any length stay in
+    bounded memory; `seed` makes every run (and every worker) reproducible.
+    Geometry scales with the frame height (radius 120 px at 480 p).
     """
-    width, height = 640, 480
-    bg = np.zeros((height, width, 3), dtype=np.uint8)
-    # Background is a wooden texture / brown color
-    bg[:] = [40, 60, 80] # BGR
-    
-    # Define a static person shape and a green cloak shape
-    # Ground truth cloak mask (a central circle of radius 100)
+    rng = np.random.default_rng(seed)
+    center = (width // 2, height // 2)
+    radius = int(round(height * 0.25))
+    jitter_scale = height / 480.0
+
+    bg = np.empty((height, width, 3), dtype=np.uint8)
+    bg[:] = BG_BGR
     gt_mask = np.zeros((height, width), dtype=np.uint8)
-    cv2.circle(gt_mask, (width // 2, height // 2), 120, 255, -1)
-    
-    # Green cloak base color (HSV: H=60, S=200, V=200)
-    green_bgr = np.uint8([[[0, 200, 0]]])
-    green_hsv = cv2.cvtColor(green_bgr, cv2.COLOR_BGR2HSV)[0][0]
-    
-    frames_perfect = []
-    frames_shadow = []
-    frames_noise = []
-    frames_temporal = []
-    
-    # Green color range: H in [35, 85], S in [100, 255], V in [100, 255]
-    color_ranges = [{'hsv_min': [35, 80, 80], 'hsv_max': [85, 255, 255]}]
-    
+    cv2.circle(gt_mask, center, radius, 255, -1)
+    clean = bg.copy()
+    clean[gt_mask == 255] = CLOAK_BGR
+    shadow_grad = np.linspace(0.4, 1.2, width, dtype=np.float32).reshape(1, width, 1)
+    shadowed = np.clip(clean * shadow_grad, 0, 255).astype(np.uint8)
+    if condition == 'moving':
+        moving = _MovingCloak(rng, width, height, radius)
+
     for idx in range(num_frames):
-        # 1. Perfect Frame
-        frame = bg.copy()
-        frame[gt_mask == 255] = [20, 220, 20] # bright green
-        frames_perfect.append(frame)
-        
-        # 2. Shadow/Highlight Frame (simulate gradient shadow from left to right)
-        shadow_frame = frame.copy().astype(np.float32)
-        shadow_grad = np.linspace(0.4, 1.2, width).reshape(1, width, 1)
-        shadow_frame = shadow_frame * shadow_grad
-        shadow_frame = np.clip(shadow_frame, 0, 255).astype(np.uint8)
-        frames_shadow.append(shadow_frame)
-        
-        # 3. Noise Frame (simulate sensor noise, std_dev = 25)
-        noise = np.random.normal(0, 25, frame.shape).astype(np.float32)
-        noise_frame = frame.astype(np.float32) + noise
-        noise_frame = np.clip(noise_frame, 0, 255).astype(np.uint8)
-        frames_noise.append(noise_frame)
-        
-        # 4. Temporal Jitter Frame (simulate edge flicker and moving noise)
-        temp_mask = np.zeros((height, width), dtype=np.uint8)
-        # Random radius perturbation to simulate edge jitter
-        jitter_radius = 120 + int(5 * np.sin(idx * 0.5) + np.random.normal(0, 2))
-        cv2.circle(temp_mask, (width // 2, height // 2), jitter_radius, 255, -1)
-        
-        temp_frame = bg.copy()
-        temp_frame[temp_mask == 255] = [20, 220, 20]
-        # Add slight noise
-        noise_t = np.random.normal(0, 10, temp_frame.shape).astype(np.float32)
-        temp_frame = np.clip(temp_frame.astype(np.float32) + noise_t, 0, 255).astype(np.uint8)
-        frames_temporal.append((temp_frame, temp_mask))
-        
-    return {
-        'perfect': (frames_perfect, gt_mask),
-        'shadow': (frames_shadow, gt_mask),
-        'noise': (frames_noise, gt_mask),
-        'temporal': frames_temporal, # contains a tuple of (frame, mask_gt) per frame
-        'color_ranges': color_ranges
-    }
-
-def evaluate_baseline(frames, color_ranges):
+        if condition == 'perfect':
+            yield clean, gt_mask
+        elif condition == 'shadow':
+            yield shadowed, gt_mask
+        elif condition == 'noise':
+            noise = rng.standard_normal(clean.shape, dtype=np.float32) * 25
+            yield np.clip(clean + noise, 0, 255).astype(np.uint8), gt_mask
+        elif condition == 'temporal':
+            jitter_radius = radius + int(jitter_scale * (5 * np.sin(idx * 0.5) + rng.normal(0, 2)))
+            temp_mask = np.zeros((height, width), dtype=np.uint8)
+            cv2.circle(temp_mask, center, jitter_radius, 255, -1)
+            frame = bg.copy()
+            frame[temp_mask == 255] = CLOAK_BGR
+            noise = rng.standard_normal(frame.shape, dtype=np.float32) * 10
+            yield np.clip(frame + noise, 0, 255).astype(np.uint8), temp_mask
+        elif condition == 'moving':
+            frame, mask = moving.frame(idx)
+            noise = rng.standard_normal(frame.shape, dtype=np.float32) * 5
+            yield np.clip(frame + noise, 0, 255).astype(np.uint8), mask
+        else:
+            raise ValueError(f'Unknown condition: {condition}')
+
+
+def _smooth_noise(rng, shape, sigma, lo, hi):
+    """Low-pass random field scaled to [lo, hi]: fabric folds, wood grain."""
+    field = cv2.GaussianBlur(rng.random(shape, dtype=np.float32), (0, 0), sigma)
+    field = (field - field.min()) / max(float(field.max() - field.min()), 1e-6)
+    return lo + field * (hi - lo)
+
+
+class _MovingCloak:
+    """The 'moving' condition: a textured cloak on a sine path over a textured background."""
+
+    PERIOD = 60  # frames per horizontal sweep
+
+    def __init__(self, rng, width, height, radius):
+        scale = height / 480.0
+        self.width, self.height, self.radius = width, height, radius
+        grain = _smooth_noise(rng, (height, width), 4 * scale, 0.8, 1.1)
+        self.bg = np.clip(np.array(BG_BGR, np.float32) * grain[..., None], 0, 255).astype(np.uint8)
+        size = 2 * radius + 1
+        # Brightness-only folds keep the hue and saturation inside COLOR_RANGES.
+        folds = _smooth_noise(rng, (size, size), 3 * scale, 0.55, 1.0)
+        self.patch = (np.array(CLOAK_BGR, np.float32) * folds[..., None]).astype(np.uint8)
+        self.disc = np.zeros((size, size), np.uint8)
+        cv2.circle(self.disc, (radius, radius), radius, 255, -1)
+        self.amplitude = (width * 0.2, height * 0.05)
+
+    def frame(self, idx):
+        phase = 2 * np.pi * idx / self.PERIOD
+        r = self.radius
+        cx = int(round(self.width / 2 + self.amplitude[0] * np.sin(phase)))
+        cy = int(round(self.height / 2 + self.amplitude[1] * np.sin(2 * phase)))
+        cx = min(max(cx, r), self.width - r - 1)
+        cy = min(max(cy, r), self.height - r - 1)
+        frame = self.bg.copy()
+        mask = np.zeros((self.height, self.width), np.uint8)
+        window = (slice(cy - r, cy + r + 1), slice(cx - r, cx + r + 1))
+        np.copyto(frame[window], self.patch, where=self.disc[..., None] > 0)
+        mask[window] = self.disc
+        return frame, mask
+
+
+def make_baseline(color_ranges):
     """
     Standard HSV Masking:
     - No preprocessing
@@ -89,28 +138,20 @@ def evaluate_baseline(frames, color_ranges):
     - Basic morphological open (3x3 rect) and dilate (3x3 rect)
     - No temporal smoothing, no feathering
     """
-    masks = []
-    times = []
-    
     lower = np.array(color_ranges[0]['hsv_min'])
     upper = np.array(color_ranges[0]['hsv_max'])
     kernel = np.ones((3, 3), np.uint8)
-    
-    for frame in frames:
-        t0 = time.perf_counter()
+
+    def step(frame):
         hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
         mask = cv2.inRange(hsv, lower, upper)
         # Basic morphology matching invisible.py
         mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_DILATE, kernel)
-        t1 = time.perf_counter()
-        
-        masks.append(mask)
-        times.append((t1 - t0) * 1000.0) # ms
-        
-    return masks, np.mean(times)
-
-def evaluate_him(frames, color_ranges, window_size=5):
+        return cv2.morphologyEx(mask, cv2.MORPH_DILATE, kernel)
+    return step
+
+
+def make_him(color_ranges, window_size=5):
     """
     Hybrid Intelligence Masking (HIM):
     - Bilateral filter & CLAHE in LAB
@@ -118,174 +159,242 @@ def evaluate_him(frames, color_ranges, window_size=5):
     - Elliptical morphology (Open 3x3, Close 7x7) + Gaussian blur (7x7)
     - Temporal smoothing with mask history
     """
-    masks = []
-    times = []
     history = deque(maxlen=window_size)
-    
-    for frame in frames:
-        t0 = time.perf_counter()
-        
-        # Stage 1: Preprocess (Denoise + CLAHE)
+
+    def step(frame):
         pp_frame = preprocess_frame(frame)
-        
-        # Stage 2: HSV threshold
         hsv = cv2.cvtColor(pp_frame, cv2.COLOR_BGR2HSV)
-        mask = build_hsv_mask(hsv, color_ranges)
-        
-        # Stage 3: Morphology & Edge Refinement
-        mask = refine_mask(mask)
-        
-        # Stage 5: Temporal Smoothing
-        mask_f = mask.astype(np.float32) / 255.0
-        mask_f = temporal_smooth_mask(mask_f, history, window_size)
-        
+        mask = refine_mask(build_hsv_mask(hsv, color_ranges))
+        mask_f = temporal_smooth_mask(mask.astype(np.float32) / 255.0, history, window_size)
         # Rescale back to 0-255 for comparison
-        refined_mask = (mask_f * 255.0).astype(np.uint8)
-        
-        t1 = time.perf_counter()
-        
-        masks.append(refined_mask)
-        times.append((t1 - t0) * 1000.0) # ms
-        
-    return masks, np.mean(times)
-
-def calculate_iou(pred_mask, gt_mask):
-    """Calculates Intersection over Union (IoU) for binary masks."""
-    pred_bin = (pred_mask > 127).astype(np.uint8)
-    gt_bin = (gt_mask > 127).astype(np.uint8)
-    
-    intersection = np.logical_and(pred_bin, gt_bin).sum()
-    union = np.logical_or(pred_bin, gt_bin).sum()
-    
-    if union == 0:
-        return 1.0 if intersection == 0 else 0.0
-    return intersection / union
-
-def calculate_temporal_variance(mask_sequence):
-    """Calculates average variance per pixel across the mask sequence to measure flicker."""
-    stacked = np.stack(mask_sequence, axis=2).astype(np.float32) / 255.0
-    variance = np.var(stacked, axis=2)
-    return float(np.mean(variance))
-
-def calculate_edge_gradient_smoothness(mask):
+        return (mask_f * 255.0).astype(np.uint8)
+    return step
+
+
+def make_live(color_ranges, params=None):
     """
-    Measures edge smoothness. A feathered mask will have a smooth gradient transition
-    from 0 to 255, whereas a hard mask will have sharp 0 to 255 changes.
-    We compute the spatial gradient magnitude of the mask and analyze its distribution.
-    For soft/feathered masks, the gradients are spread out, meaning a higher standard deviation of
-    gradients in the transition zone or a broader transition band.
-    Specifically, we measure the percentage of pixels in transition (values between 10 and 245).
+    The web app's cloak mask chain (core.camera.process_frame) at full quality:
+    workspace preprocessing, range mask (with hysteresis if set),
+    half-resolution morphology + feathering, uint8 temporal smoothing.
+    `params` overrides PipelineConfig fields (core.config.TUNING_PARAMS,
+    motion_compensation).
     """
-    transition_pixels = np.logical_and(mask > 10, mask < 245).sum()
-    total_pixels = mask.size
-    return (transition_pixels / total_pixels) * 100.0
+    cfg = PipelineConfig(**(params or {}))
+    ws = make_workspace(cfg.compute_backend)
+    engine = RangeMaskEngine().update(color_ranges, cfg.mask_hysteresis)
+    kernels = morph_kernels(cfg.morph_open, cfg.morph_close)
+    bilateral = (cfg.bilateral_d, cfg.bilateral_sigma)
+    clahe = make_clahe(cfg.clahe_clip)
+    history = TemporalAccumulator(TEMPORAL_WINDOW_MAX)
+    estimator = MotionEstimator()
 
-def main():
-    print("Initializing synthetic test suite...")
-    suite = generate_synthetic_test_suite(num_frames=30)
-    color_ranges = suite['color_ranges']
-    
-    results = {}
-    
-    # ------------------ TEST 1: PERFECT CONDITIONS ------------------
-    frames, gt = suite['perfect']
-    m_base, t_base = evaluate_baseline(frames, color_ranges)
-    m_him, t_him = evaluate_him(frames, color_ranges)
-    
-    results['perfect'] = {
-        'baseline': {
-            'iou': float(np.mean([calculate_iou(m, gt) for m in m_base])),
-            'fps': float(1000.0 / t_base),
-            'latency_ms': float(t_base),
-            'transition_percent': float(np.mean([calculate_edge_gradient_smoothness(m) for m in m_base])),
-            'temporal_variance': calculate_temporal_variance(m_base)
-        },
-        'him': {
-            'iou': float(np.mean([calculate_iou(m, gt) for m in m_him])),
-            'fps': float(1000.0 / t_him),
-            'latency_ms': float(t_him),
-            'transition_percent': float(np.mean([calculate_edge_gradient_smoothness(m) for m in m_him])),
-            'temporal_variance': calculate_temporal_variance(m_him)
-        }
-    }
-    
-    # ------------------ TEST 2: SHADOW / LIGHTING GRADIENT ------------------
-    frames, gt = suite['shadow']
-    m_base, t_base = evaluate_baseline(frames, color_ranges)
-    m_him, t_him = evaluate_him(frames, color_ranges)
-    
-    results['shadow'] = {
-        'baseline': {
-            'iou': float(np.mean([calculate_iou(m, gt) for m in m_base])),
-            'latency_ms': float(t_base),
-            'temporal_variance': calculate_temporal_variance(m_base)
-        },
-        'him': {
-            'iou': float(np.mean([calculate_iou(m, gt) for m in m_him])),
-            'latency_ms': float(t_him),
-            'temporal_variance': calculate_temporal_variance(m_him)
-        }
-    }
-    
-    # ------------------ TEST 3: NOISY ENVIRONMENT ------------------
-    frames, gt = suite['noise']
-    m_base, t_base = evaluate_baseline(frames, color_ranges)
-    m_him, t_him = evaluate_him(frames, color_ranges)
-    
-    results['noise'] = {
-        'baseline': {
-            'iou': float(np.mean([calculate_iou(m, gt) for m in m_base])),
-            'latency_ms': float(t_base),
-            'temporal_variance': calculate_temporal_variance(m_base)
-        },
-        'him': {
-            'iou': float(np.mean([calculate_iou(m, gt) for m in m_him])),
-            'latency_ms': float(t_him),
-            'temporal_variance': calculate_temporal_variance(m_him)
-        }
-    }
-    
-    # ------------------ TEST 4: TEMPORAL JITTER & FLICKER ------------------
-    temp_frames = [f[0] for f in suite['temporal']]
-    temp_gts = [f[1] for f in suite['temporal']]
-    m_base, t_base = evaluate_baseline(temp_frames, color_ranges)
-    m_him, t_him = evaluate_him(temp_frames, color_ranges)
-    
-    results['temporal'] = {
-        'baseline': {
-            'iou': float(np.mean([calculate_iou(m_base[i], temp_gts[i]) for i in range(len(m_base))])),
-            'latency_ms': float(t_base),
-            'temporal_variance': calculate_temporal_variance(m_base)
-        },
-        'him': {
-            'iou': float(np.mean([calculate_iou(m_him[i], temp_gts[i]) for i in range(len(m_him))])),
-            'latency_ms': float(t_him),
-            'temporal_variance': calculate_temporal_variance(m_him)
+    def step(frame):
+        pp = preprocess_frame(frame, 'full', ws, bilateral, clahe)
+        hsv = cv2.cvtColor(pp, cv2.COLOR_BGR2HSV)
+        mask = engine.mask(hsv, ws, frame.shape)
+        mask = refine_mask_fast(mask, cfg.feather_radius, 0.5, kernels, ws, frame.shape)
+        motion = estimator.estimate(frame, mask) if cfg.motion_compensation else None
+        return combine_cloak_alpha(mask, None, history, cfg.temporal_window, ws, motion)
+    return step
+
+
+def make_live_mc(color_ranges, params=None):
+    """make_live with motion-compensated temporal smoothing (core.motion)."""
+    return make_live(color_ranges, {**(params or {}), 'motion_compensation': True})
+
+
+def make_live_hyst(color_ranges, params=None):
+    """make_live with hysteresis thresholds on the range mask."""
+    return make_live(color_ranges, {'mask_hysteresis': 20, **(params or {})})
+
+
+METHOD_FACTORIES = {'baseline': make_baseline, 'him': make_him, 'live': make_live, 'live_mc': make_live_mc,
+                    'live_hyst': make_live_hyst}
+
+
+def batch_iou(pred_masks, gt_masks):
+    """IoU per mask for stacked (N, H, W) predictions against (N, H, W) or shared (H, W) ground truth."""
+    pred_bin = pred_masks > 127
+    gt_bin = gt_masks > 127
+    intersection = np.count_nonzero(pred_bin & gt_bin, axis=(-2, -1))
+    union = np.count_nonzero(pred_bin | gt_bin, axis=(-2, -1))
+    empty = union == 0
+    return np.where(empty, (intersection == 0).astype(np.float64), intersection / np.maximum(union, 1))
+
+
+def batch_transition_percent(masks):
+    """
+    Edge smoothness per mask: the percentage of pixels in transition (values
+    between 10 and 245). A feathered mask spreads its 0->255 change over a
+    band of such pixels; a hard mask has none.
+    """
+    transition = np.count_nonzero((masks > 10) & (masks < 245), axis=(-2, -1))
+    return transition * (100.0 / (masks.shape[-2] * masks.shape[-1]))
+
+
+class MetricAccumulator:
+    """
+    Streaming metrics over a mask sequence. Masks are staged in a fixed
+    (batch, H, W) buffer and reduced a batch at a time, so memory does not
+    grow with sequence length. Temporal variance (mean per-pixel variance of
+    mask/255 over time, i.e. flicker) comes from running per-pixel integer
+    sums, which keeps it exact however long the sequence is.
+    """
+
+    def __init__(self, shape, batch_size=16):
+        self.batch_size = batch_size
+        self._masks = np.empty((batch_size,) + shape, np.uint8)
+        self._gts = np.empty((batch_size,) + shape, np.uint8)
+        self._squares = np.empty((batch_size,) + shape, np.uint16)
+        self._shared_gt = None
+        self._n = 0
+        self._sum = np.zeros(shape, np.int64)
+        self._sum_sq = np.zeros(shape, np.int64)
+        self.frames = 0
+        self.iou_sum = 0.0
+        self.transition_sum = 0.0
+        self.latencies = []
+
+    def add(self, mask, gt, latency_ms):
+        # Static conditions reuse one ground-truth array; only stage it when it changes.
+        if self._n == 0:
+            self._shared_gt = gt
+        elif self._shared_gt is not None and self._shared_gt is not gt:
+            self._gts[:self._n] = self._shared_gt
+            self._shared_gt = None
+        if self._shared_gt is None:
+            self._gts[self._n] = gt
+        self._masks[self._n] = mask
+        self.latencies.append(latency_ms)
+        self._n += 1
+        if self._n == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        n = self._n
+        if not n:
+            return
+        masks = self._masks[:n]
+        gts = self._shared_gt if self._shared_gt is not None else self._gts[:n]
+        self.iou_sum += float(batch_iou(masks, gts).sum())
+        self.transition_sum += float(batch_transition_percent(masks).sum())
+        squares = np.square(masks, out=self._squares[:n], dtype=np.uint16)
+        self._sum += masks.sum(axis=0, dtype=np.uint32)
+        self._sum_sq += squares.sum(axis=0, dtype=np.uint32)
+        self.frames += n
+        self._n = 0
+        self._shared_gt = None
+
+    def result(self):
+        self.flush()
+        n = max(self.frames, 1)
+        # Var = (n*sum(x^2) - sum(x)^2) / n^2, in integers, then scaled to mask/255.
+        variance = (n * self._sum_sq - self._sum * self._sum) / (float(n * n) * 255.0 * 255.0)
+        latencies = np.asarray(self.latencies)
+        latency = float(latencies.mean()) if latencies.size else 0.0
+        return {
+            'iou': self.iou_sum / n,
+            'fps': 1000.0 / latency if latency else 0.0,
+            'latency_ms': latency,
+            'latency_p95_ms': float(np.percentile(latencies, 95)) if latencies.size else 0.0,
+            'transition_percent': self.transition_sum / n,
+            'temporal_variance': float(variance.mean()),
+            'frames': self.frames,
         }
-    }
-    
-    # Save visual snapshots of the test conditions for user inspection
-    dir_path = os.path.dirname(__file__)
-    cv2.imwrite(os.path.join(dir_path, 'frame_1_perfect.png'), suite['perfect'][0][0])
-    cv2.imwrite(os.path.join(dir_path, 'frame_2_shadow.png'), suite['shadow'][0][0])
-    cv2.imwrite(os.path.join(dir_path, 'frame_3_noise.png'), suite['noise'][0][0])
-    cv2.imwrite(os.path.join(dir_path, 'frame_4_temporal.png'), suite['temporal'][0][0])
+
+
+def evaluate(task):
+    """Run one (condition, method, resolution) cell; executed in a worker process."""
+    condition, method, (width, height), num_frames, batch_size, seed = task
+    step = METHOD_FACTORIES[method](COLOR_RANGES)
+    acc = MetricAccumulator((height, width), batch_size)
+    # Same seed for every method so they see identical frames.
+    for frame, gt in iter_condition_frames(condition, num_frames, width, height, seed + CONDITIONS.index(condition)):
+        t0 = time.perf_counter()
+        mask = step(frame)
+        acc.add(mask, gt, (time.perf_counter() - t0) * 1000.0)
+    return condition, method, (width, height), acc.result()
+
+
+def _init_worker():
+    # Conditions already run in parallel; OpenCV's own thread pool would oversubscribe.
+    cv2.setNumThreads(1)
+
+
+def parse_resolution(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def save_sample_frames(dir_path, width, height, seed):
+    for i, condition in enumerate(CONDITIONS, start=1):
+        frame, _ = next(iter_condition_frames(condition, 1, width, height, seed + CONDITIONS.index(condition)))
+        cv2.imwrite(os.path.join(dir_path, f'frame_{i}_{condition}.png'), frame)
     print(f"Saved sample test frames to {dir_path}")
 
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate baseline vs. HIM masking on synthetic sequences')
+    parser.add_argument('--frames', type=int, default=30, help='frames per sequence')
+    parser.add_argument('--resolutions', default='640x480', help='comma-separated WxH list, e.g. 640x480,1280x720')
+    parser.add_argument('--conditions', default=','.join(CONDITIONS))
+    parser.add_argument('--methods', default=','.join(METHODS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (use 1 for uncontended latency figures)')
+    parser.add_argument('--batch', type=int, default=16, help='masks reduced per metric batch')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='results JSON (default: results.json next to this script)')
+    parser.add_argument('--no-samples', action='store_true', help='skip writing sample frame PNGs')
+    args = parser.parse_args()
+
+    resolutions = [parse_resolution(r) for r in args.resolutions.split(',') if r]
+    conditions = [c for c in args.conditions.split(',') if c]
+    methods = [m for m in args.methods.split(',') if m]
+    for c in conditions:
+        if c not in CONDITIONS:
+            parser.error(f'unknown condition {c!r}; choose from {", ".join(CONDITIONS)}')
+    for m in methods:
+        if m not in METHODS:
+            parser.error(f'unknown method {m!r}; choose from {", ".join(METHODS)}')
+
+    tasks = [(c, m, res, args.frames, args.batch, args.seed)
+             for res in resolutions for c in conditions for m in methods]
+    workers = max(1, min(args.workers, len(tasks)))
+    print(f"Evaluating {len(tasks)} sequences of {args.frames} frames on {workers} worker(s)...")
+    t_start = time.perf_counter()
+    if workers == 1:
+        outputs = map(evaluate, tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        outputs = pool.map(evaluate, tasks)
+
+    # Keyed by condition; with several resolutions the key carries the size too.
+    results = {}
+    for condition, method, (width, height), metrics in outputs:
+        key = condition if len(resolutions) == 1 else f'{condition}@{width}x{height}'
+        results.setdefault(key, {})[method] = metrics
+    if workers > 1:
+        pool.shutdown()
+    print(f"Done in {time.perf_counter() - t_start:.1f}s")
+
+    dir_path = os.path.dirname(os.path.abspath(__file__))
+    if not args.no_samples:
+        save_sample_frames(dir_path, *resolutions[0], args.seed)
+
     # Print results to stdout and write to file
     print("\n================ EVALUATION SUMMARY ================")
-    for condition, methods in results.items():
+    for condition, method_results in results.items():
         print(f"\nCondition: {condition.upper()}")
-        for method_name, metrics in methods.items():
+        for method_name, metrics in method_results.items():
             print(f"  {method_name.upper()}:")
             for metric_name, val in metrics.items():
-                print(f"    {metric_name}: {val:.5f}")
-                
-    output_path = os.path.join(dir_path, 'results.json')
+                print(f"    {metric_name}: {val:.5f}" if isinstance(val, float) else f"    {metric_name}: {val}")
+
+    output_path = args.out or os.path.join(dir_path, 'results.json')
     with open(output_path, 'w') as f:
         json.dump(results, f, indent=4)
     print(f"\nResults successfully written to {output_path}")
 
+
 if __name__ == '__main__':
     main()
-
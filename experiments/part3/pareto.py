@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import itertools
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+# Add repository root to path so we can import core modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from core.config import PipelineConfig, TUNING_PARAMS
+from core.state import PROFILES_FILE
+from core.profiles import open_profile_store
+from evaluate_pipeline import CONDITIONS, COLOR_RANGES, MetricAccumulator, _init_worker, iter_condition_frames, make_live
+
+DIR_PATH = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = os.path.join(DIR_PATH, 'pareto_cache.jsonl')
+
+# Candidate values per parameter (see core.config.TUNING_PARAMS for the live ranges).
+PARAM_SPACE = {
+    'temporal_window': [1, 2, 4, 6],
+    'feather_radius': [0, 2, 3, 6],
+    'clahe_clip': [1.0, 2.0, 4.0],
+    'bilateral_d': [0, 5, 9],
+    'bilateral_sigma': [50.0, 75.0],
+    'morph_open': [3, 5],
+    'morph_close': [5, 7, 11],
+    'mask_hysteresis': [0, 20],
+}
+
+
+def default_params():
+    return PipelineConfig().tuning()
+
+
+def sample_space(n, seed=0):
+    """Up to `n` distinct configurations from PARAM_SPACE, always including the defaults."""
+    names = list(PARAM_SPACE)
+    grid = list(itertools.product(*(PARAM_SPACE[k] for k in names)))
+    random.Random(seed).shuffle(grid)
+    configs = [default_params()]
+    seen = {json.dumps(configs[0], sort_keys=True)}
+    for values in grid:
+        if len(configs) >= n:
+            break
+        params = dict(zip(names, values))
+        # sigma is irrelevant without the filter; keep one variant
+        if params['bilateral_d'] == 0:
+            params['bilateral_sigma'] = PARAM_SPACE['bilateral_sigma'][0]
+        key = json.dumps(params, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            configs.append(params)
+    return configs
+
+
+def config_key(params, suite):
+    """Cache key: the configuration plus everything about the suite that affects its metrics."""
+    blob = json.dumps({'params': params, 'suite': suite}, sort_keys=True)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+def load_cache(path):
+    cache = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                cache[entry['key']] = entry
+    return cache
+
+
+def evaluate_config(task):
+    """Run the live mask chain with `params` over every condition; one worker task."""
+    params, suite = task
+    width, height = suite['resolution']
+    iou, latency, variance = [], [], []
+    for condition in suite['conditions']:
+        step = make_live(COLOR_RANGES, params)
+        acc = MetricAccumulator((height, width), suite['batch'])
+        frames = iter_condition_frames(condition, suite['frames'], width, height,
+                                       suite['seed'] + CONDITIONS.index(condition))
+        for frame, gt in frames:
+            t0 = time.perf_counter()
+            mask = step(frame)
+            acc.add(mask, gt, (time.perf_counter() - t0) * 1000.0)
+        metrics = acc.result()
+        iou.append(metrics['iou'])
+        latency.append(metrics['latency_ms'])
+        variance.append(metrics['temporal_variance'])
+    return {
+        'params': params,
+        'iou': sum(iou) / len(iou),
+        'latency_ms': sum(latency) / len(latency),
+        'temporal_variance': sum(variance) / len(variance),
+        'iou_by_condition': dict(zip(suite['conditions'], iou)),
+    }
+
+
+def pareto_front(points):
+    """Points not dominated in (higher IoU, lower latency), fastest first."""
+    front = []
+    best_iou = -1.0
+    for p in sorted(points, key=lambda p: (p['latency_ms'], -p['iou'])):
+        if p['iou'] > best_iou:
+            front.append(p)
+            best_iou = p['iou']
+    return front
+
+
+def save_profile(name, params, server=None, profiles_file=PROFILES_FILE):
+    """Store `params` as a tuning-only profile, through a running server if given."""
+    if server:
+        body = json.dumps({'name': name, 'pipeline': params}).encode()
+        req = urllib.request.Request(server.rstrip('/') + '/save_profile', data=body,
+                                     headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return json.load(resp).get('status') == 'ok'
+    open_profile_store(profiles_file).save(name, {'pipeline': params})
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search pipeline parameters for the IoU / latency Pareto front')
+    parser.add_argument('--samples', type=int, default=40, help='configurations to evaluate')
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--resolution', default='640x480')
+    parser.add_argument('--conditions', default=','.join(CONDITIONS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', default=CACHE_FILE, help='JSONL cache of evaluated configurations')
+    parser.add_argument('--fresh', action='store_true', help='re-evaluate cached configurations')
+    parser.add_argument('--out', default=os.path.join(DIR_PATH, 'pareto.json'))
+    parser.add_argument('--save-profile', metavar='NAME', help='save a point of the front as a profile')
+    parser.add_argument('--pick', type=int, help='index on the printed front to save')
+    parser.add_argument('--max-latency-ms', type=float,
+                        help='without --pick, save the best-IoU point under this latency')
+    parser.add_argument('--server', help='running app URL (e.g. http://127.0.0.1:5000) to save through')
+    parser.add_argument('--profiles', default=PROFILES_FILE, help='profile file when no --server is given')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.resolution.lower().split('x'))
+    suite = {
+        'resolution': [width, height],
+        'frames': args.frames,
+        'conditions': [c for c in args.conditions.split(',') if c],
+        'batch': args.batch,
+        'seed': args.seed,
+    }
+    configs = sample_space(args.samples, args.seed)
+    cache = {} if args.fresh else load_cache(args.cache)
+    points, todo = [], []
+    for params in configs:
+        entry = cache.get(config_key(params, suite))
+        if entry is not None:
+            points.append(entry['result'])
+        else:
+            todo.append(params)
+    print(f'{len(configs)} configurations: {len(points)} cached, {len(todo)} to evaluate')
+
+    if todo:
+        workers = max(1, min(args.workers, len(todo)))
+        t_start = time.perf_counter()
+        tasks = [(params, suite) for params in todo]
+        with open(args.cache, 'a') as cache_file:
+            if workers == 1:
+                results = map(evaluate_config, tasks)
+            else:
+                pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+                results = pool.map(evaluate_config, tasks)
+            for i, result in enumerate(results, 1):
+                points.append(result)
+                # Appended as they finish, so an interrupted search keeps its progress.
+                cache_file.write(json.dumps({'key': config_key(result['params'], suite), 'result': result}) + '\n')
+                cache_file.flush()
+                print(f'  [{i}/{len(todo)}] iou={result["iou"]:.4f} latency={result["latency_ms"]:.2f} ms')
+            if workers > 1:
+                pool.shutdown()
+        print(f'Evaluated in {time.perf_counter() - t_start:.1f}s')
+
+    front = pareto_front(points)
+    defaults = default_params()
+    print('\n================ PARETO FRONT (IoU vs latency) ================')
+    for i, p in enumerate(front):
+        tag = '  (defaults)' if p['params'] == defaults else ''
+        values = ' '.join(f'{k}={v}' for k, v in p['params'].items())
+        print(f'  [{i}] iou={p["iou"]:.4f} latency={p["latency_ms"]:.2f} ms  {values}{tag}')
+
+    with open(args.out, 'w') as f:
+        json.dump({'suite': suite, 'points': points, 'front': front}, f, indent=2)
+    print(f'\nAll points and the front written to {args.out}')
+
+    if args.save_profile:
+        if args.pick is not None:
+            if not 0 <= args.pick < len(front):
+                parser.error(f'--pick must be between 0 and {len(front) - 1}')
+            chosen = front[args.pick]
+        elif args.max_latency_ms is not None:
+            within = [p for p in front if p['latency_ms'] <= args.max_latency_ms]
+            if not within:
+                parser.error(f'no point on the front is under {args.max_latency_ms} ms')
+            chosen = within[-1]
+        else:
+            parser.error('--save-profile needs --pick or --max-latency-ms')
+        params = {k: v for k, v in chosen['params'].items() if k in TUNING_PARAMS}
+        if save_profile(args.save_profile, params, args.server, args.profiles):
+            print(f'Saved profile "{args.save_profile}": {params}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import argparse
+
+# Add repository root to path so we can import core modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from core.trace import TraceReader, replay_trace, compare_replays
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded Invisible Cloak trace through the pipeline')
+    parser.add_argument('trace', help='trace directory (see POST /trace/start)')
+    parser.add_argument('--realtime', action='store_true', help='pace frames at their recorded timestamps')
+    parser.add_argument('--ignore-recorded-quality', action='store_true',
+                        help='run every frame at full quality instead of the live governor rung')
+    parser.add_argument('--ai', action='store_true', help='load MediaPipe segmentation for person masks')
+    parser.add_argument('--out', help='write replay results (timings + output digests) as JSON')
+    parser.add_argument('--baseline', help='results JSON from another build to compare against')
+    args = parser.parse_args()
+
+    segmentor = mp = None
+    mediapipe_available = False
+    if args.ai:
+        from core.mediapipe_utils import init_segmentor
+        segmentor, mediapipe_available, mp = init_segmentor()
+
+    reader = TraceReader(args.trace)
+    print(f'Replaying {len(reader)} frames, {len(reader.events)} events from {args.trace}...')
+    results = replay_trace(
+        reader,
+        segmentor,
+        mp,
+        mediapipe_available,
+        realtime=args.realtime,
+        recorded_quality=not args.ignore_recorded_quality,
+    )
+
+    print('\n================ REPLAY SUMMARY ================')
+    for key in ('live_ms', 'replay_ms'):
+        values = ', '.join(f'{k}={v:.3f}' for k, v in results[key].items())
+        print(f'  {key}: {values}')
+    if results['requests']:
+        print('\nREQUEST LATENCY (live)')
+        for path, metrics in results['requests'].items():
+            values = ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}' for k, v in metrics.items())
+            print(f'  {path}: {values}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        diff = compare_replays(results, baseline)
+        print('\nVS BASELINE')
+        for k, v in diff.items():
+            print(f'  {k}: {v:.3f}' if isinstance(v, float) else f'  {k}: {v}')
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f)
+        print(f'\nResults written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
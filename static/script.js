@@ -2,9 +2,7 @@
   const $ = id => document.getElementById(id);
 
   const sliderIds = ['h_min', 'h_max', 's_min', 's_max', 'v_min', 'v_max'];
-  let debounceTimer = null;
   let currentRangeIdx = 0;
-  let pipelineDebounce = null;
 
   // ─── Utility ────────────────────────────────────────────────────
   function showMsg(text, isError = false) {
@@ -24,6 +22,32 @@
     return res.json();
   }
 
+  // ─── Batched Controls ───────────────────────────────────────────
+  // Rapid changes (slider drags) are coalesced per endpoint and flushed as
+  // one /batch request every FLUSH_MS instead of one POST per change.
+  const FLUSH_MS = 60;
+  const pendingControls = new Map();
+  let flushTimer = null;
+  let lastLocalEdit = 0;
+
+  function queueControl(path, body, merge = false) {
+    const prev = pendingControls.get(path);
+    pendingControls.set(path, merge && prev ? { ...prev, ...body } : body);
+    lastLocalEdit = performance.now();
+    if (!flushTimer) flushTimer = setTimeout(flushControls, FLUSH_MS);
+  }
+
+  function flushControls() {
+    flushTimer = null;
+    if (!pendingControls.size) return;
+    const ops = [...pendingControls].map(([path, body]) => ({ path, body }));
+    pendingControls.clear();
+    return post('/batch', { ops });
+  }
+
+  // Server echoes of values the user is still dragging would make sliders jump.
+  const editingLocally = () => performance.now() - lastLocalEdit < 400;
+
   // ─── Sliders ────────────────────────────────────────────────────
   sliderIds.forEach(id => {
     const slider = $(id);
@@ -31,13 +55,12 @@
     if (!slider || !lbl) return;
     slider.addEventListener('input', () => {
       lbl.textContent = slider.value;
-      clearTimeout(debounceTimer);
-      debounceTimer = setTimeout(pushHSV, 200);
+      pushHSV();
     });
   });
 
   function pushHSV() {
-    post('/set_hsv', {
+    queueControl('/set_hsv', {
       idx: currentRangeIdx,
       h_min: +$('h_min').value, h_max: +$('h_max').value,
       s_min: +$('s_min').value, s_max: +$('s_max').value,
@@ -144,8 +167,11 @@
 
   // ─── Pipeline Controls ─────────────────────────────────────────
   const aiRefineToggle = $('toggle-ai-refine');
+  const motionToggle = $('toggle-motion-comp');
   const temporalWindow = $('temporal-window');
   const temporalLabel = $('lbl-temporal-window');
+  const featherRadius = $('feather-radius');
+  const featherLabel = $('lbl-feather-radius');
   const pipelineControls = $('pipeline-controls');
 
   function updatePipelineVisibility() {
@@ -157,6 +183,7 @@
   function setPipelineDisabled(isDisabled) {
     if (aiRefineToggle) aiRefineToggle.disabled = isDisabled || aiRefineToggle.dataset.forceDisabled === 'true';
     if (temporalWindow) temporalWindow.disabled = isDisabled;
+    if (motionToggle) motionToggle.disabled = isDisabled;
   }
 
   async function initPipelineControls() {
@@ -165,6 +192,11 @@
       temporalWindow.value = d.temporal_window;
       temporalLabel.textContent = d.temporal_window;
     }
+    if (featherRadius && featherLabel) {
+      featherRadius.value = d.feather_radius;
+      featherLabel.textContent = d.feather_radius;
+    }
+    if (motionToggle) motionToggle.checked = !!d.motion_compensation;
     if (aiRefineToggle) {
       aiRefineToggle.checked = !!d.use_ai_refine;
       if (!d.mediapipe_available) {
@@ -182,14 +214,25 @@
     });
   }
 
+  if (motionToggle) {
+    motionToggle.addEventListener('change', () => {
+      post('/set_pipeline', { motion_compensation: motionToggle.checked });
+    });
+  }
+
   if (temporalWindow) {
     temporalWindow.addEventListener('input', () => {
       const value = +temporalWindow.value;
       if (temporalLabel) temporalLabel.textContent = value;
-      clearTimeout(pipelineDebounce);
-      pipelineDebounce = setTimeout(() => {
-        post('/set_pipeline', { temporal_window: value });
-      }, 150);
+      queueControl('/set_pipeline', { temporal_window: value }, true);
+    });
+  }
+
+  if (featherRadius) {
+    featherRadius.addEventListener('input', () => {
+      const value = +featherRadius.value;
+      if (featherLabel) featherLabel.textContent = value;
+      queueControl('/set_pipeline', { feather_radius: value }, true);
     });
   }
 
@@ -215,15 +258,7 @@
       updatePipelineVisibility();
       setPipelineDisabled(false);
       // stop if running
-      if (running) {
-        running = false;
-        $('toggle-icon').textContent = '▶';
-        $('toggle-text').textContent = 'Initialize System';
-        $('btn-toggle').className = 'btn btn-primary';
-        const badge = $('status-badge');
-        badge.textContent = 'System Standby'; 
-        badge.className = 'badge badge-off';
-      }
+      if (running) setRunningUi(false);
       await post('/set_bg_mode', { mode: currentMode });
     });
   });
@@ -243,13 +278,24 @@
   });
 
   // ─── Upload Custom Background ────────────────────────────────────
+  // The server decodes and scales uploads on a worker; poll until applied.
+  const UPLOAD_POLL_MS = 200;
+
+  async function uploadBackground(file) {
+    const form = new FormData();
+    form.append('file', file);
+    let d = await (await fetch('/upload_bg', { method: 'POST', body: form })).json();
+    while (d.status === 'pending') {
+      await new Promise(r => setTimeout(r, UPLOAD_POLL_MS));
+      d = await (await fetch('/upload_status?job=' + d.job)).json();
+    }
+    return d;
+  }
+
   $('upload-bg').addEventListener('change', async e => {
     const file = e.target.files[0];
     if (!file) return;
-    const form = new FormData();
-    form.append('file', file);
-    const res = await fetch('/upload_bg', { method: 'POST', body: form });
-    const d = await res.json();
+    const d = await uploadBackground(file);
     if (d.status === 'ok') {
       document.querySelectorAll('.bg-tile').forEach(t => t.classList.remove('active'));
       $('selected-bg-name').textContent = '✓ ' + d.name;
@@ -279,10 +325,7 @@
   $('blur-amount').addEventListener('input', () => {
     const v = $('blur-amount').value;
     $('lbl-blur').textContent = v;
-    clearTimeout(debounceTimer);
-    debounceTimer = setTimeout(() => {
-      post('/set_smart_bg_type', { type: currentSmartType, blur_amount: +v });
-    }, 150);
+    queueControl('/set_smart_bg_type', { type: currentSmartType, blur_amount: +v }, true);
   });
 
   // Smart scene tiles (inside smart panel)
@@ -302,10 +345,7 @@
   $('upload-bg-smart').addEventListener('change', async e => {
     const file = e.target.files[0];
     if (!file) return;
-    const form = new FormData();
-    form.append('file', file);
-    const res = await fetch('/upload_bg', { method: 'POST', body: form });
-    const d = await res.json();
+    const d = await uploadBackground(file);
     if (d.status === 'ok') {
       document.querySelectorAll('.smart-scene-tile').forEach(t => t.classList.remove('active'));
       $('selected-bg-name-smart').textContent = '✓ ' + d.name;
@@ -336,8 +376,7 @@
     const b = parseInt(hex.slice(5,7), 16);
     document.querySelectorAll('.color-preset').forEach(p => p.classList.remove('active'));
     $('solid-color-name').textContent = hex;
-    clearTimeout(debounceTimer);
-    debounceTimer = setTimeout(() => post('/set_solid_color', { r, g, b }), 150);
+    queueControl('/set_solid_color', { r, g, b });
   });
 
   // ─── Fullscreen ──────────────────────────────────────────────────
@@ -373,10 +412,9 @@
 
   // ─── Toggle Invisibility ─────────────────────────────────────────
   let running = false;
-  $('btn-toggle').addEventListener('click', async () => {
-    const d = await post('/toggle', {});
-    if (d.status === 'error') { showMsg(d.message, true); return; }
-    running = d.running;
+
+  function setRunningUi(isRunning) {
+    running = isRunning;
     setPipelineDisabled(running);
     $('toggle-icon').textContent = running ? '⏹' : '▶';
     $('toggle-text').textContent = running ? 'Terminate Feed' : 'Initialize System';
@@ -384,6 +422,12 @@
     const badge = $('status-badge');
     badge.textContent = running ? 'Active Feed' : 'System Standby';
     badge.className = 'badge ' + (running ? 'badge-on' : 'badge-off');
+  }
+
+  $('btn-toggle').addEventListener('click', async () => {
+    const d = await post('/toggle', {});
+    if (d.status === 'error') { showMsg(d.message, true); return; }
+    setRunningUi(d.running);
   });
 
   // ─── Effects ────────────────────────────────────────────────────
@@ -399,7 +443,47 @@
   const videoImg = $('video-feed');
   const tooltip  = $('pick-tooltip');
 
+  // Drag a rectangle over the cloak to calibrate from a region instead
+  let dragStart = null;
+  let suppressClick = false;
+  const normPoint = e => {
+    const rect = videoImg.getBoundingClientRect();
+    return {
+      x: Math.min(Math.max((e.clientX - rect.left) / rect.width, 0), 1),
+      y: Math.min(Math.max((e.clientY - rect.top) / rect.height, 0), 1),
+    };
+  };
+
+  videoImg.addEventListener('mousedown', e => {
+    e.preventDefault();
+    dragStart = normPoint(e);
+  });
+
+  videoImg.addEventListener('mouseup', async e => {
+    if (!dragStart) return;
+    const start = dragStart, end = normPoint(e);
+    dragStart = null;
+    if (Math.abs(end.x - start.x) < 0.02 || Math.abs(end.y - start.y) < 0.02) return;
+    suppressClick = true;
+    tooltip.innerHTML = '⏳ Calibrating…';
+    const d = await post('/calibrate', { x0: start.x, y0: start.y, x1: end.x, y1: end.y });
+    if (d.status === 'ok') {
+      renderColorRanges(d.ranges, d.active_idx);
+      const r = d.ranges[0];
+      applySliders({
+        h_min: r.hsv_min[0], s_min: r.hsv_min[1], v_min: r.hsv_min[2],
+        h_max: r.hsv_max[0], s_max: r.hsv_max[1], v_max: r.hsv_max[2],
+      });
+      tooltip.innerHTML = `Calibrated ${d.ranges.length} color${d.ranges.length > 1 ? 's' : ''} from region`;
+    } else {
+      tooltip.innerHTML = d.message || 'Calibration failed';
+    }
+    clearTimeout(tooltip._t);
+    tooltip._t = setTimeout(() => { tooltip.innerHTML = '🎯 Aim & Click to Select Color'; }, 3000);
+  });
+
   videoImg.addEventListener('click', async e => {
+    if (suppressClick) { suppressClick = false; return; }
     const rect = videoImg.getBoundingClientRect();
     const x = (e.clientX - rect.left) / rect.width;
     const y = (e.clientY - rect.top)  / rect.height;
@@ -407,11 +491,11 @@
     const d = await post('/pick_color', { x, y, sensitivity: sens });
     if (d.status === 'ok') {
       applySliders(d);
-      // Refresh the chip swatch for the active color slot
-      (async () => {
+      // With /events the chip swatch refreshes from the pushed state diff
+      if (!liveEvents) {
         const rd = await (await fetch('/color_ranges')).json();
         renderColorRanges(rd.ranges, rd.active_idx);
-      })();
+      }
       // Show color dot in tooltip
       const hue = Math.round(d.hsv[0] * 2); // OpenCV H is 0-179 → CSS hue 0-360
       tooltip.innerHTML = `<span style="display:inline-block;width:10px;height:10px;border-radius:50%;background:hsl(${hue},${d.hsv[1]/255*100|0}%,${d.hsv[2]/255*60+20|0}%);vertical-align:middle;margin-right:5px;border:1px solid #aaa"></span>Color ${currentRangeIdx + 1} picked!`;
@@ -488,8 +572,87 @@
     }
   });
 
+  // ─── Server Push ─────────────────────────────────────────────────
+  // /events sends a full snapshot, then only the keys that changed, plus
+  // live metrics; nothing is polled.
+  const uiState = {};
+  let liveEvents = null;
+
+  function activeRangeSliders(ranges, idx) {
+    const ar = ranges[idx];
+    return {
+      h_min: ar.hsv_min[0], s_min: ar.hsv_min[1], v_min: ar.hsv_min[2],
+      h_max: ar.hsv_max[0], s_max: ar.hsv_max[1], v_max: ar.hsv_max[2],
+    };
+  }
+
+  function applyState(changed) {
+    Object.assign(uiState, changed);
+    const local = editingLocally();
+    if ('color_ranges' in changed || 'active_range_idx' in changed) {
+      const idx = Math.min(uiState.active_range_idx, uiState.color_ranges.length - 1);
+      renderColorRanges(uiState.color_ranges, idx);
+      if (!local) applySliders(activeRangeSliders(uiState.color_ranges, idx));
+    }
+    if ('running' in changed && changed.running !== running) setRunningUi(changed.running);
+    if (!local) {
+      if ('temporal_window' in changed && temporalWindow) {
+        temporalWindow.value = changed.temporal_window;
+        if (temporalLabel) temporalLabel.textContent = changed.temporal_window;
+      }
+      if ('feather_radius' in changed && featherRadius) {
+        featherRadius.value = changed.feather_radius;
+        if (featherLabel) featherLabel.textContent = changed.feather_radius;
+      }
+    }
+    if ('use_ai_refine' in changed && aiRefineToggle && aiRefineToggle.dataset.forceDisabled !== 'true') {
+      aiRefineToggle.checked = !!changed.use_ai_refine;
+    }
+    if ('motion_compensation' in changed && motionToggle) {
+      motionToggle.checked = !!changed.motion_compensation;
+    }
+    if ('effect' in changed) {
+      document.querySelectorAll('.effect-btn').forEach(b => {
+        b.classList.toggle('active', b.dataset.effect === changed.effect);
+      });
+    }
+    if ('profiles' in changed) renderProfiles(changed.profiles);
+  }
+
+  // /video_feed closes after an idle timeout when frames stop; reopen it
+  // once the camera delivers again.
+  let feedStalled = false;
+
+  function renderMetrics(m) {
+    if (m.fps === 0) feedStalled = true;
+    else if (feedStalled) {
+      feedStalled = false;
+      videoImg.src = '/video_feed?t=' + Date.now();
+    }
+    const el = $('perf-stats');
+    if (!el) return;
+    el.style.display = '';
+    el.textContent = `${m.fps} fps · ${m.frame_ms ?? '–'} ms · ${m.requests_per_s} req/s`;
+    el.title = `Quality: ${m.quality_stage} · control latency ${m.control_ms ?? '–'} ms · ${m.requests_total} requests`;
+  }
+
+  function connectEvents() {
+    liveEvents = new EventSource('/events');
+    liveEvents.addEventListener('snapshot', e => {
+      const snap = JSON.parse(e.data);
+      for (const k of Object.keys(uiState)) delete uiState[k];
+      applyState(snap);
+    });
+    liveEvents.addEventListener('state', e => applyState(JSON.parse(e.data)));
+    liveEvents.addEventListener('metrics', e => renderMetrics(JSON.parse(e.data)));
+  }
+
   // Load initial state
-  initColorRanges();
-  loadProfiles();
   initPipelineControls();
+  if (window.EventSource) {
+    connectEvents();
+  } else {
+    initColorRanges();
+    loadProfiles();
+  }
 })();
@@ -0,0 +1,36 @@
+import numpy as np
+
+from core.background import BG_RESEED_REFRESHES, BG_ROW_STRIDE, BackgroundModel
+
+
+def _scene(h=120, w=160):
+    background = np.full((h, w, 3), 100, np.uint8)
+    alpha = np.zeros((h, w), np.uint8)
+    return background, alpha
+
+
+def test_large_foreground_stays_out_without_person_mask():
+    background, alpha = _scene()
+    frame = background.copy()
+    # Someone close to the camera filling most of the frame
+    frame[:, 10:150] = 220
+    model = BackgroundModel()
+    for _ in range(BG_ROW_STRIDE * BG_RESEED_REFRESHES * 4):
+        model.update(background, frame, alpha)
+    assert model.reseeds == 0
+    assert background[:, 10:150].max() == 100
+
+
+def test_lasting_scene_change_reseeds_with_person_mask():
+    background, alpha = _scene()
+    person = np.zeros(alpha.shape, np.uint8)
+    frame = np.full(background.shape, 200, np.uint8)
+    model = BackgroundModel()
+    for _ in range(BG_ROW_STRIDE * (BG_RESEED_REFRESHES - 1)):
+        model.update(background, frame, alpha, person)
+    # A brief change is not enough
+    assert model.reseeds == 0
+    for _ in range(BG_ROW_STRIDE):
+        model.update(background, frame, alpha, person)
+    assert model.reseeds == BG_ROW_STRIDE
+    assert np.array_equal(background, frame)
@@ -0,0 +1,20 @@
+import app as appmod
+
+
+def test_malformed_op_does_not_abort_batch():
+    client = appmod.app.test_client()
+    ops = [
+        {'path': '/set_effect', 'body': {'effect': 'blur'}},
+        {'path': '/set_hsv', 'body': {'h_min': 10}},
+        {'path': '/set_effect', 'body': {'effect': 'pixelate'}},
+    ]
+    response = client.post('/batch', json={'ops': ops})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert len(results) == 3
+    assert results[0]['status'] == 'ok'
+    assert results[1]['status'] == 500
+    assert 'KeyError' in results[1]['error']
+    assert results[2]['status'] == 'ok'
+    assert appmod.config.current.effect == 'pixelate'
+    client.post('/set_effect', json={'effect': 'none'})
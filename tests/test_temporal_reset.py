@@ -0,0 +1,50 @@
+import threading
+
+import numpy as np
+
+from core.processing import temporal_smooth_mask
+from core.state import apply_temporal_reset, create_state, reset_temporal_state
+
+
+def test_reset_from_another_thread_while_pushing():
+    state = create_state()
+    mask = np.zeros((120, 160), np.uint8)
+    mask[30:90, 40:120] = 255
+    mask_f = mask.astype(np.float32) / 255.0
+    stop = threading.Event()
+
+    def resetter():
+        while not stop.is_set():
+            reset_temporal_state(state)
+
+    thread = threading.Thread(target=resetter)
+    thread.start()
+    try:
+        for _ in range(3000):
+            apply_temporal_reset(state)
+            out = state['mask_history'].push(mask, 5, motion=(1.0, -1.0))
+            assert out.shape == mask.shape
+            temporal_smooth_mask(mask_f, state['mask_history_float'], 5, motion=(1.0, 0.0))
+    finally:
+        stop.set()
+        thread.join()
+
+    reset_temporal_state(state)
+    apply_temporal_reset(state)
+    assert len(state['mask_history']) == 0
+    assert len(state['mask_history_float']) == 0
+
+
+def test_reset_applies_before_next_frame_only():
+    state = create_state()
+    mask = np.full((8, 8), 255, np.uint8)
+    history = state['mask_history']
+    for _ in range(3):
+        history.push(mask, 5)
+    reset_temporal_state(state)
+    assert len(history) == 3
+    apply_temporal_reset(state)
+    assert len(history) == 0
+    history.push(mask, 5)
+    apply_temporal_reset(state)
+    assert len(history) == 1